@@ -0,0 +1,354 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import psycopg2
+
+import generate
+import loader
+from config import read_config
+
+
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+"""
+    Statements benchmarked for the task3_* files once the files themselves have been run as setup.
+    Every timed run is rolled back, so the inserts measure trigger overhead without changing the data.
+"""
+TASK3_QUERIES = {
+    "task3_1": "INSERT INTO products (product_id, name, category_id, weight, price) "
+               "SELECT md5(random()::text), 'benchmark', category_id, 1, 10 FROM product_category LIMIT 1",
+    "task3_2": "INSERT INTO shopping_carts (order_id, product_id, amount) "
+               "SELECT o.order_id, p.product_id, 1 FROM orders o, products p "
+               "WHERE NOT EXISTS (SELECT 1 FROM shopping_carts sc WHERE sc.order_id = o.order_id AND sc.product_id = p.product_id) "
+               "LIMIT 1",
+    "task3_3": "SELECT * FROM customer_view",
+}
+
+
+"""
+    Splits an SQL script into statements on semicolons outside of quotes, dollar quotes and comments.
+    Returns list of statements without comment-only chunks.
+"""
+def split_statements(script):
+    statements = []
+    current = []
+    i = 0
+    while i < len(script):
+        char = script[i]
+        if script.startswith("--", i):
+            end = script.find("\n", i)
+            end = len(script) if end == -1 else end
+            current.append(script[i:end])
+            i = end
+            continue
+        if char == "'":
+            end = script.find("'", i + 1)
+            end = len(script) - 1 if end == -1 else end
+            current.append(script[i:end + 1])
+            i = end + 1
+            continue
+        if char == "$":
+            tag_end = script.find("$", i + 1)
+            tag = script[i:tag_end + 1]
+            if tag_end != -1 and (tag == "$$" or tag[1:-1].isidentifier()):
+                end = script.find(tag, tag_end + 1)
+                end = len(script) - len(tag) if end == -1 else end
+                current.append(script[i:end + len(tag)])
+                i = end + len(tag)
+                continue
+        if char == ";":
+            statements.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    statements.append("".join(current))
+
+    result = []
+    for statement in statements:
+        code = "\n".join(line for line in statement.splitlines() if not line.strip().startswith("--")).strip()
+        if code:
+            result.append(statement.strip())
+    return result
+
+
+def is_query(statement):
+    code = "\n".join(line for line in statement.splitlines() if not line.strip().startswith("--")).lstrip().upper()
+    return code.startswith("SELECT") or code.startswith("WITH")
+
+
+"""
+    Returns the content of an SQL script with LF line endings; a relative path is relative to BASE_DIRECTORY.
+"""
+def read_script(path):
+    with open(os.path.join(BASE_DIRECTORY, path), newline="") as script_file:
+        return script_file.read().replace("\r\n", "\n")
+
+
+"""
+    Returns list of (name, statement) to benchmark and list of (name, statement) to run once as setup.
+    - task2_* files: every query is benchmarked, other statements (e.g. CREATE EXTENSION) are setup.
+    - task3_* files: the whole file is setup, the statement of TASK3_QUERIES is benchmarked.
+"""
+def collect_queries(directory=BASE_DIRECTORY):
+    queries = []
+    setup = []
+    for path in sorted(glob.glob(os.path.join(directory, "task2_*.sql"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        statements = split_statements(read_script(path))
+        query_count = sum(1 for statement in statements if is_query(statement))
+        number = 0
+        for statement in statements:
+            if not is_query(statement):
+                setup.append((name, statement))
+                continue
+            number += 1
+            queries.append((name if query_count == 1 else "%s#%d" % (name, number), statement))
+
+    for path in sorted(glob.glob(os.path.join(directory, "task3_*.sql"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        setup.extend((name, statement) for statement in split_statements(read_script(path)))
+        if name in TASK3_QUERIES:
+            queries.append((name, TASK3_QUERIES[name]))
+    return queries, setup
+
+
+"""
+    Runs the setup statements one by one, each committed on its own.
+    Returns list of (name, error message) for statements that failed, e.g. objects that already exist.
+"""
+def run_setup(conn, setup):
+    errors = []
+    for name, statement in setup:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(statement)
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            errors.append((name, str(e).strip().splitlines()[0]))
+    return errors
+
+
+"""
+    Returns the p-th percentile (0-100) of sorted values with linear interpolation.
+"""
+def percentile(values, p):
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * p / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+"""
+    Times one statement: warmup runs first, then runs timed runs including fetching all rows.
+    Every run is rolled back. Returns dict with row count, latencies (ms) and the EXPLAIN (ANALYZE, BUFFERS) plan.
+"""
+def benchmark_query(conn, statement, runs, warmup):
+    latencies = []
+    rows = 0
+    with conn.cursor() as cursor:
+        for run in range(warmup + runs):
+            started = time.perf_counter()
+            cursor.execute(statement)
+            if cursor.description is not None:
+                rows = len(cursor.fetchall())
+            else:
+                rows = cursor.rowcount
+            elapsed = time.perf_counter() - started
+            conn.rollback()
+            if run >= warmup:
+                latencies.append(elapsed * 1000)
+
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement)
+        plan = cursor.fetchone()[0]
+        conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    plan = plan[0]
+
+    latencies.sort()
+    top = plan["Plan"]
+    return {
+        "rows": rows,
+        "runs": runs,
+        "min_ms": latencies[0],
+        "mean_ms": sum(latencies) / len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": latencies[-1],
+        "planning_ms": plan.get("Planning Time", 0.0),
+        "execution_ms": plan.get("Execution Time", 0.0),
+        "shared_hit_blocks": top.get("Shared Hit Blocks", 0),
+        "shared_read_blocks": top.get("Shared Read Blocks", 0),
+        "temp_written_blocks": top.get("Temp Written Blocks", 0),
+        "plan": plan,
+    }
+
+
+"""
+    Returns the data directory of a scale factor, generating the dataset first if it does not exist yet.
+"""
+def dataset_directory(scale):
+    directory = os.path.join(BASE_DIRECTORY, "db_x%d" % scale)
+    if not os.path.exists(os.path.join(directory, "shopping_carts.csv")):
+        generate.generate(generate.DATA_DIRECTORY, directory, scale)
+    return directory
+
+
+"""
+    Loads every scale factor (unless load is False), runs the setup and benchmarks all queries.
+    Returns list of result dicts, one per (scale, query).
+"""
+def run_benchmark(conn_params, scales, runs, warmup, selected=None, load=True, workers=4):
+    queries, setup = collect_queries()
+    if selected:
+        queries = [(name, statement) for name, statement in queries if name.split("#")[0] in selected]
+
+    results = []
+    for scale in scales:
+        if load:
+            started = time.perf_counter()
+            loader.load(conn_params, dataset_directory(scale), fresh=True, workers=workers)
+            print(f"scale {scale}: loaded in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+        conn = psycopg2.connect(**conn_params)
+        try:
+            for name, error in run_setup(conn, setup):
+                print(f"scale {scale}: setup {name}: {error}", file=sys.stderr)
+
+            for name, statement in queries:
+                try:
+                    result = benchmark_query(conn, statement, runs, warmup)
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    result = {"error": str(e).strip().splitlines()[0]}
+                result.update({"scale": scale, "query": name})
+                results.append(result)
+                if "error" in result:
+                    print(f"scale {scale}: {name}: {result['error']}", file=sys.stderr)
+                else:
+                    print(f"scale {scale}: {name}: p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms", file=sys.stderr)
+        finally:
+            conn.close()
+    return results
+
+
+REPORT_COLUMNS = [
+    "scale", "query", "rows", "runs", "min_ms", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms",
+    "planning_ms", "execution_ms", "shared_hit_blocks", "shared_read_blocks", "temp_written_blocks", "error",
+]
+
+
+"""
+    Writes results to path as JSON (with plans) or, for a .csv path, as CSV (without plans).
+"""
+def write_report(path, results, runs, warmup):
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=REPORT_COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(results)
+        return
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "runs": runs,
+        "warmup": warmup,
+        "results": results,
+    }
+    with open(path, "w") as report_file:
+        json.dump(report, report_file, indent=2, default=str)
+
+
+"""
+    Reads a JSON or CSV report. Returns dict (scale, query) -> result.
+"""
+def read_report(path):
+    if path.endswith(".csv"):
+        with open(path, newline="") as report_file:
+            results = list(csv.DictReader(report_file))
+    else:
+        with open(path) as report_file:
+            results = json.load(report_file)["results"]
+    return {(int(result["scale"]), result["query"]): result for result in results}
+
+
+"""
+    Compares metric of two reports. Returns list of (scale, query, old, new, ratio) where new > old * (1 + threshold).
+"""
+def compare_reports(old, new, metric="p50_ms", threshold=0.2):
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        if not old[key].get(metric) or not new[key].get(metric):
+            continue
+        old_value = float(old[key][metric])
+        new_value = float(new[key][metric])
+        if old_value > 0 and new_value > old_value * (1 + threshold):
+            regressions.append((key[0], key[1], old_value, new_value, new_value / old_value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the task2_*/task3_* queries.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="load the dataset and time the queries")
+    run_parser.add_argument("--config", default="database.cfg")
+    run_parser.add_argument("--scales", default="1", help="comma separated scale factors, e.g. 1,10,100")
+    run_parser.add_argument("--runs", type=int, default=10, help="timed runs per query, at least 1")
+    run_parser.add_argument("--warmup", type=int, default=2)
+    run_parser.add_argument("--queries", default="", help="comma separated file names, e.g. task2_1,task3_3")
+    run_parser.add_argument("--no-load", action="store_true", help="benchmark the data already in the database")
+    run_parser.add_argument("--workers", type=int, default=4)
+    run_parser.add_argument("--output", default="benchmark.json", help="report path, .json or .csv")
+
+    compare_parser = commands.add_parser("compare", help="compare two reports and fail on regressions")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--metric", default="p50_ms")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if args.runs < 1:
+            parser.error("--runs must be at least 1")
+        if args.warmup < 0:
+            parser.error("--warmup must not be negative")
+        results = run_benchmark(
+            read_config(filename=args.config, section="postgresql"),
+            [int(scale) for scale in args.scales.split(",")],
+            args.runs, args.warmup,
+            selected=set(filter(None, args.queries.split(","))),
+            load=not args.no_load, workers=args.workers
+        )
+        write_report(args.output, results, args.runs, args.warmup)
+
+        print("Scale|Query|Rows|p50 ms|p95 ms|p99 ms")
+        for result in results:
+            if "error" in result:
+                print(f"{result['scale']}|{result['query']}|ERROR {result['error']}")
+            else:
+                print(f"{result['scale']}|{result['query']}|{result['rows']}|"
+                      f"{result['p50_ms']:.2f}|{result['p95_ms']:.2f}|{result['p99_ms']:.2f}")
+        print(f"report written to {args.output}")
+
+    else:
+        regressions = compare_reports(read_report(args.old), read_report(args.new), args.metric, args.threshold)
+        for scale, query, old_value, new_value, ratio in regressions:
+            print(f"REGRESSION {scale}|{query}|{old_value:.2f} -> {new_value:.2f} {args.metric} (x{ratio:.2f})")
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
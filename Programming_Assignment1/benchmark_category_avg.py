@@ -0,0 +1,123 @@
+import argparse
+import sys
+import time
+
+import psycopg2
+
+from benchmark import read_script
+from config import read_config
+
+
+"""
+    Trigger modes of category_avg_prices: scripts to install, in order.
+    - row: task3_1.sql, AVG(price) of the category recomputed per inserted row.
+    - statement: category_avg_prices.sql on top, running sums folded per statement.
+"""
+MODES = {
+    "row": ["task3_1.sql"],
+    "statement": ["task3_1.sql", "category_avg_prices.sql"],
+}
+
+# products of the bulk load use ids with this prefix
+BULK_PREFIX = "bulk-avg-"
+
+
+"""
+    Installs a trigger mode from scratch inside the current transaction.
+"""
+def install_mode(cursor, mode):
+    cursor.execute("DROP TABLE IF EXISTS category_avg_prices")
+    for trigger in ("trg_update_avg_price", "trg_update_avg_price_insert",
+                    "trg_update_avg_price_update", "trg_update_avg_price_delete"):
+        cursor.execute("DROP TRIGGER IF EXISTS %s ON products" % trigger)
+    for script in MODES[mode]:
+        cursor.execute(read_script(script))
+
+
+"""
+    Returns the number of categories whose avg_price differs from AVG(price) over products.
+"""
+def count_mismatches(cursor):
+    cursor.execute(
+        "SELECT COUNT(*) FROM ("
+        "  (SELECT category_id, ROUND(AVG(price), 2) FROM products WHERE category_id IS NOT NULL GROUP BY category_id"
+        "   EXCEPT SELECT category_id, avg_price FROM category_avg_prices)"
+        "  UNION ALL"
+        "  (SELECT category_id, avg_price FROM category_avg_prices"
+        "   EXCEPT SELECT category_id, ROUND(AVG(price), 2) FROM products WHERE category_id IS NOT NULL GROUP BY category_id)"
+        ") mismatches"
+    )
+    return cursor.fetchone()[0]
+
+
+def timed(cursor, sql, params=()):
+    started = time.perf_counter()
+    cursor.execute(sql, params)
+    return time.perf_counter() - started
+
+
+"""
+    Bulk inserts `size` products into one category with a single INSERT ... SELECT, then (statement mode only,
+    the row trigger ignores them) updates their prices, moves half of them to another category and deletes them.
+    Everything is rolled back. Returns dict of operation -> seconds, plus the mismatch count after each step.
+"""
+def run_mode(conn, mode, size, category_id, other_category_id):
+    results = {}
+    try:
+        with conn.cursor() as cursor:
+            install_mode(cursor, mode)
+
+            results["insert"] = timed(
+                cursor,
+                "INSERT INTO products (product_id, name, category_id, weight, price) "
+                "SELECT %s || i, 'bulk product', %s, 1, 1 + i %% 100 FROM generate_series(1, %s) i",
+                (BULK_PREFIX, category_id, size)
+            )
+            results["insert_mismatches"] = count_mismatches(cursor)
+
+            if mode == "statement":
+                results["update_price"] = timed(
+                    cursor, "UPDATE products SET price = price * 2 WHERE product_id LIKE %s", (BULK_PREFIX + "%",)
+                )
+                results["move_category"] = timed(
+                    cursor,
+                    "UPDATE products SET category_id = %s WHERE product_id LIKE %s AND price > 100",
+                    (other_category_id, BULK_PREFIX + "%")
+                )
+                results["delete"] = timed(cursor, "DELETE FROM products WHERE product_id LIKE %s", (BULK_PREFIX + "%",))
+                results["final_mismatches"] = count_mismatches(cursor)
+    finally:
+        conn.rollback()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load time of products with the row and the statement category_avg_prices trigger.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma separated product counts")
+    parser.add_argument("--modes", default="row,statement")
+    parser.add_argument("--category", type=int, default=1, help="category of the bulk loaded products")
+    parser.add_argument("--other-category", type=int, default=2, help="category half of them are moved to")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    failed = False
+    try:
+        print("Mode|Products|Insert s|Update price s|Move category s|Delete s|Mismatches")
+        for size in [int(size) for size in args.sizes.split(",")]:
+            for mode in args.modes.split(","):
+                results = run_mode(conn, mode, size, args.category, args.other_category)
+                mismatches = results["insert_mismatches"] + results.get("final_mismatches", 0)
+                failed = failed or mismatches > 0
+                print("%s|%d|%.3f|%s|%s|%s|%d" % (
+                    mode, size, results["insert"],
+                    *("%.3f" % results[key] if key in results else "-" for key in ("update_price", "move_category", "delete")),
+                    mismatches
+                ))
+    finally:
+        conn.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+-- Statement-level maintenance of category_avg_prices (task3_1.sql).
+-- task3_1.sql recomputes AVG(price) of the whole category for every inserted product row, so inserting
+-- N products into one category reads the category N times. Here every category keeps a running sum_price
+-- and product_count; one statement trigger per operation folds all rows of the statement, read from its
+-- transition tables, into one update per category. Price updates, category moves and deletes are handled too.
+-- Replaces trg_update_avg_price. Run after task3_1.sql.
+
+
+ALTER TABLE category_avg_prices ADD COLUMN IF NOT EXISTS sum_price DECIMAL NOT NULL DEFAULT 0;
+ALTER TABLE category_avg_prices ADD COLUMN IF NOT EXISTS product_count INTEGER NOT NULL DEFAULT 0;
+
+DROP TRIGGER IF EXISTS trg_update_avg_price ON products;
+
+
+-- Fill the running aggregates from the current products
+LOCK TABLE products IN SHARE MODE;
+
+DELETE FROM category_avg_prices;
+
+INSERT INTO category_avg_prices (category_id, avg_price, sum_price, product_count)
+SELECT category_id, AVG(price), SUM(price), COUNT(*)
+FROM products
+WHERE category_id IS NOT NULL
+GROUP BY category_id;
+
+
+-- Adds the per-category deltas to the running aggregates, drops categories without products
+CREATE OR REPLACE FUNCTION apply_category_price_deltas(p_category_ids INTEGER[], p_sums DECIMAL[], p_counts INTEGER[])
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO category_avg_prices AS c (category_id, avg_price, sum_price, product_count)
+    SELECT d.category_id, d.sum_price / NULLIF(d.product_count, 0), d.sum_price, d.product_count
+    FROM unnest(p_category_ids, p_sums, p_counts) AS d(category_id, sum_price, product_count)
+    ORDER BY d.category_id
+    ON CONFLICT (category_id) DO UPDATE
+    SET sum_price = c.sum_price + EXCLUDED.sum_price,
+        product_count = c.product_count + EXCLUDED.product_count,
+        avg_price = (c.sum_price + EXCLUDED.sum_price) / NULLIF(c.product_count + EXCLUDED.product_count, 0);
+
+    DELETE FROM category_avg_prices WHERE product_count <= 0;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Transition tables cannot be attached to a trigger on several events, so there is one trigger per event
+-- and the function reads the transition tables that exist for TG_OP
+CREATE OR REPLACE FUNCTION update_avg_price_statement()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_category_ids INTEGER[];
+    v_sums DECIMAL[];
+    v_counts INTEGER[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(category_id), array_agg(sum_price), array_agg(product_count)
+        INTO v_category_ids, v_sums, v_counts
+        FROM (
+            SELECT category_id, SUM(price) AS sum_price, COUNT(*)::INTEGER AS product_count
+            FROM new_rows
+            WHERE category_id IS NOT NULL
+            GROUP BY category_id
+        ) d;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(category_id), array_agg(sum_price), array_agg(product_count)
+        INTO v_category_ids, v_sums, v_counts
+        FROM (
+            SELECT category_id, -SUM(price) AS sum_price, -COUNT(*)::INTEGER AS product_count
+            FROM old_rows
+            WHERE category_id IS NOT NULL
+            GROUP BY category_id
+        ) d;
+    ELSE
+        SELECT array_agg(category_id), array_agg(sum_price), array_agg(product_count)
+        INTO v_category_ids, v_sums, v_counts
+        FROM (
+            SELECT category_id, SUM(price) AS sum_price, SUM(product_count)::INTEGER AS product_count
+            FROM (
+                SELECT category_id, price, 1 AS product_count FROM new_rows
+                UNION ALL
+                SELECT category_id, -price, -1 FROM old_rows
+            ) changes
+            WHERE category_id IS NOT NULL
+            GROUP BY category_id
+            HAVING SUM(price) <> 0 OR SUM(product_count) <> 0
+        ) d;
+    END IF;
+
+    IF v_category_ids IS NOT NULL THEN
+        PERFORM apply_category_price_deltas(v_category_ids, v_sums, v_counts);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE TRIGGER trg_update_avg_price_insert
+AFTER INSERT ON products
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION update_avg_price_statement();
+
+CREATE OR REPLACE TRIGGER trg_update_avg_price_update
+AFTER UPDATE ON products
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION update_avg_price_statement();
+
+CREATE OR REPLACE TRIGGER trg_update_avg_price_delete
+AFTER DELETE ON products
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION update_avg_price_statement();
@@ -0,0 +1,19 @@
+from configparser import ConfigParser
+
+
+def read_config(filename="database.cfg", section="postgresql", required=True):
+    # create a parser
+    parser = ConfigParser()
+    # read config file
+    parser.read(filename)
+
+    # get section, default to postgresql
+    db = {}
+    if parser.has_section(section):
+        params = parser.items(section)
+        for param in params:
+            db[param[0]] = param[1]
+    elif required:
+        raise Exception('Section {0} not found in the {1} file'.format(section, filename))
+
+    return db
@@ -0,0 +1,17 @@
+"""
+    Compares incrementally maintained tables with the views recomputing them from the base tables.
+    - tables maps table name -> view name; both are compared with EXCEPT ALL in both directions, so
+      duplicated rows count too.
+    - Runs in the caller's transaction; callers set REPEATABLE READ first to compare one snapshot.
+    - Returns list of (table, missing rows, unexpected rows) of the tables that differ.
+"""
+def compare_with_recomputation(cursor, tables):
+    differences = []
+    for table, expected in tables.items():
+        cursor.execute("SELECT * FROM %s EXCEPT ALL SELECT * FROM %s" % (expected, table))
+        missing = cursor.fetchall()
+        cursor.execute("SELECT * FROM %s EXCEPT ALL SELECT * FROM %s" % (table, expected))
+        unexpected = cursor.fetchall()
+        if missing or unexpected:
+            differences.append((table, missing, unexpected))
+    return differences
@@ -0,0 +1,181 @@
+import argparse
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+
+from benchmark import read_script
+from config import read_config
+from consistency import compare_with_recomputation
+
+
+# pair count table -> view with its full recomputation
+PAIR_TABLES = {
+    "category_pair_counts": "category_pair_counts_expected",
+    "product_pair_counts": "product_pair_counts_expected",
+}
+
+
+"""
+    Creates the pair count tables and their triggers, then fills them from the current data.
+"""
+def install(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(read_script("copurchase.sql"))
+        cursor.execute("SELECT copurchase_rebuild()")
+    conn.commit()
+
+
+def rebuild(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT copurchase_rebuild()")
+    conn.commit()
+
+
+"""
+    In-memory snapshot of the pair count tables, sorted once so that top-K lookups are list slices.
+    - top_category_pairs(k) returns the rows of task2_5.sql: (category name 1, category name 2, count),
+      names in alphabetical order, highest counts first.
+    - top_product_pairs(k, product_id=None) returns (product id 1, product id 2, count), optionally only
+      the pairs containing product_id.
+    - The snapshot is reloaded by refresh(), or on the next lookup once it is older than max_age seconds.
+    - The index may be shared by threads: reloads are serialized, so conn is only used by one of them at a
+      time and concurrent lookups of a stale snapshot trigger a single reload. conn must not be used by
+      other code while the index is in use.
+"""
+class CoPurchaseIndex:
+    def __init__(self, conn, max_age=60):
+        self.conn = conn
+        self.max_age = max_age
+        self.loaded_at = None
+        self.category_pairs = []
+        self.product_pairs = []
+        self.pairs_by_product = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        with self._refresh_lock:
+            self._load()
+
+    def _load(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cursor.execute(
+                "SELECT c1.name, c2.name, cpc.pair_count "
+                "FROM category_pair_counts cpc "
+                "JOIN product_category c1 ON cpc.category_id1 = c1.category_id "
+                "JOIN product_category c2 ON cpc.category_id2 = c2.category_id"
+            )
+            category_rows = cursor.fetchall()
+            cursor.execute("SELECT product_id1, product_id2, pair_count FROM product_pair_counts")
+            product_rows = cursor.fetchall()
+        self.conn.rollback()
+
+        category_pairs = sorted(
+            ((min(name1, name2), max(name1, name2), count) for name1, name2, count in category_rows),
+            key=lambda pair: -pair[2]
+        )
+        product_pairs = sorted(product_rows, key=lambda pair: -pair[2])
+        pairs_by_product = defaultdict(list)
+        for pair in product_pairs:
+            pairs_by_product[pair[0]].append(pair)
+            pairs_by_product[pair[1]].append(pair)
+
+        with self._lock:
+            self.category_pairs = category_pairs
+            self.product_pairs = product_pairs
+            self.pairs_by_product = dict(pairs_by_product)
+            self.loaded_at = time.monotonic()
+
+    def _is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+
+    def _ensure_fresh(self):
+        if not self._is_stale():
+            return
+        with self._refresh_lock:
+            # another thread may have reloaded the snapshot while this one waited
+            if self._is_stale():
+                self._load()
+
+    def top_category_pairs(self, k=10):
+        self._ensure_fresh()
+        return self.category_pairs[:k]
+
+    def top_product_pairs(self, k=10, product_id=None):
+        self._ensure_fresh()
+        if product_id is None:
+            return self.product_pairs[:k]
+        return self.pairs_by_product.get(product_id, [])[:k]
+
+
+"""
+    Compares the pair count tables with their full recomputation, and the top category pairs with task2_5.sql.
+    The top-10 comparison uses the counts only since task2_5.sql orders ties arbitrarily.
+    Returns list of (name, missing rows, unexpected rows); empty if the counts are consistent.
+"""
+def check(conn):
+    differences = []
+    with conn.cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+
+        differences.extend(compare_with_recomputation(cursor, PAIR_TABLES))
+
+        cursor.execute(read_script("task2_5.sql"))
+        expected = [row[2] for row in cursor.fetchall()]
+        cursor.execute("SELECT pair_count FROM category_pair_counts ORDER BY pair_count DESC LIMIT 10")
+        actual = [row[0] for row in cursor.fetchall()]
+        if expected != actual:
+            differences.append(("task2_5", expected, actual))
+    conn.rollback()
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally maintained co-purchase pair counts (task2_5).")
+    parser.add_argument("command", choices=["install", "rebuild", "check", "top"])
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("-k", type=int, default=10, help="number of pairs for top")
+    parser.add_argument("--product", default=None, help="top: product pairs of this product instead of category pairs")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    try:
+        if args.command == "install":
+            install(conn)
+            print("co-purchase counts installed")
+
+        elif args.command == "rebuild":
+            rebuild(conn)
+            print("co-purchase counts rebuilt")
+
+        elif args.command == "check":
+            differences = check(conn)
+            for name, missing, unexpected in differences:
+                print(f"MISMATCH {name}|missing={missing}|unexpected={unexpected}")
+            print("%d inconsistent pair counts" % len(differences))
+            sys.exit(1 if differences else 0)
+
+        else:
+            index = CoPurchaseIndex(conn)
+            index.refresh()
+            started = time.perf_counter()
+            if args.product:
+                pairs = index.top_product_pairs(args.k, product_id=args.product)
+            else:
+                pairs = index.top_category_pairs(args.k)
+            elapsed = time.perf_counter() - started
+
+            print("Item 1|Item 2|Count")
+            for first, second, count in pairs:
+                print(f"{first}|{second}|{count}")
+            print(f"lookup took {elapsed * 1e6:.1f} us")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
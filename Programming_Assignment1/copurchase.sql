@@ -0,0 +1,400 @@
+-- Co-purchase counts behind task2_5.sql (top category pairs).
+-- Every pair of cart lines of the same order counts once, for orders that are neither cancelled nor refunded:
+-- category_pair_counts keeps the pairs of lines in two different categories (task2_5.sql CategoryPairCounts),
+-- product_pair_counts the pairs of products. Triggers add the pairs of a line when it is put into a counted
+-- order and retract them when it leaves, and add or retract whole orders when they are cancelled, refunded,
+-- or un-refunded.
+-- Install with: python copurchase.py install
+
+
+CREATE TABLE IF NOT EXISTS category_pair_counts (
+    category_id1 INTEGER,
+    category_id2 INTEGER,
+    pair_count INTEGER NOT NULL,
+    PRIMARY KEY (category_id1, category_id2),
+    CHECK (category_id1 < category_id2)
+);
+
+CREATE TABLE IF NOT EXISTS product_pair_counts (
+    product_id1 VARCHAR(40),
+    product_id2 VARCHAR(40),
+    pair_count INTEGER NOT NULL,
+    PRIMARY KEY (product_id1, product_id2),
+    CHECK (product_id1 < product_id2)
+);
+
+-- pairs whose count dropped to zero are deleted right after every change
+CREATE INDEX IF NOT EXISTS category_pair_counts_zero_idx ON category_pair_counts (category_id1) WHERE pair_count <= 0;
+CREATE INDEX IF NOT EXISTS product_pair_counts_zero_idx ON product_pair_counts (product_id1) WHERE pair_count <= 0;
+
+
+-- Full recomputation, used by copurchase_rebuild() and the consistency check
+CREATE OR REPLACE VIEW copurchase_orders AS
+SELECT o.order_id
+FROM orders o
+LEFT JOIN refunds r ON o.order_id = r.order_id
+WHERE o.status != 'CANCELLED' AND r.order_id IS NULL;
+
+CREATE OR REPLACE VIEW category_pair_counts_expected AS
+SELECT
+    p1.category_id AS category_id1,
+    p2.category_id AS category_id2,
+    COUNT(*)::INTEGER AS pair_count
+FROM copurchase_orders o1
+JOIN shopping_carts s1 ON o1.order_id = s1.order_id
+JOIN products p1 ON s1.product_id = p1.product_id
+JOIN shopping_carts s2 ON o1.order_id = s2.order_id
+JOIN products p2 ON s2.product_id = p2.product_id
+WHERE p1.category_id < p2.category_id
+GROUP BY p1.category_id, p2.category_id;
+
+CREATE OR REPLACE VIEW product_pair_counts_expected AS
+SELECT
+    s1.product_id AS product_id1,
+    s2.product_id AS product_id2,
+    COUNT(*)::INTEGER AS pair_count
+FROM copurchase_orders o1
+JOIN shopping_carts s1 ON o1.order_id = s1.order_id
+JOIN shopping_carts s2 ON o1.order_id = s2.order_id
+WHERE s1.product_id < s2.product_id
+GROUP BY s1.product_id, s2.product_id;
+
+
+CREATE OR REPLACE FUNCTION copurchase_rebuild()
+RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE orders, shopping_carts, products, refunds IN SHARE MODE;
+    TRUNCATE category_pair_counts, product_pair_counts;
+    INSERT INTO category_pair_counts SELECT * FROM category_pair_counts_expected;
+    INSERT INTO product_pair_counts SELECT * FROM product_pair_counts_expected;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION copurchase_is_counted(p_order_id VARCHAR)
+RETURNS BOOLEAN AS $$
+    SELECT EXISTS (
+        SELECT 1
+        FROM orders o
+        WHERE o.order_id = p_order_id
+        AND o.status != 'CANCELLED'
+        AND NOT EXISTS (SELECT 1 FROM refunds r WHERE r.order_id = o.order_id)
+    );
+$$ LANGUAGE sql STABLE;
+
+
+-- Adds (p_sign = 1) or retracts (p_sign = -1) the pairs of one line, in category p_category_id,
+-- with every other line of its order.
+-- Lines of products that no longer exist are skipped: when several products are deleted in one statement,
+-- the pair of two deleted products is retracted by the first one only.
+CREATE OR REPLACE FUNCTION copurchase_apply_line(p_order_id VARCHAR, p_product_id VARCHAR, p_category_id INTEGER, p_sign INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO category_pair_counts AS c (category_id1, category_id2, pair_count)
+    SELECT LEAST(p_category_id, p.category_id), GREATEST(p_category_id, p.category_id), p_sign * COUNT(*)
+    FROM shopping_carts sc
+    JOIN products p ON sc.product_id = p.product_id
+    WHERE sc.order_id = p_order_id
+    AND sc.product_id <> p_product_id
+    AND p.category_id <> p_category_id
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (category_id1, category_id2) DO UPDATE
+    SET pair_count = c.pair_count + EXCLUDED.pair_count;
+
+    INSERT INTO product_pair_counts AS c (product_id1, product_id2, pair_count)
+    SELECT LEAST(p_product_id, sc.product_id), GREATEST(p_product_id, sc.product_id), p_sign
+    FROM shopping_carts sc
+    JOIN products p ON sc.product_id = p.product_id
+    WHERE sc.order_id = p_order_id
+    AND sc.product_id <> p_product_id
+    ORDER BY 1, 2
+    ON CONFLICT (product_id1, product_id2) DO UPDATE
+    SET pair_count = c.pair_count + EXCLUDED.pair_count;
+
+    DELETE FROM category_pair_counts WHERE pair_count <= 0;
+    DELETE FROM product_pair_counts WHERE pair_count <= 0;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Adds (p_sign = 1) or retracts (p_sign = -1) all pairs of an order
+CREATE OR REPLACE FUNCTION copurchase_apply_order(p_order_id VARCHAR, p_sign INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO category_pair_counts AS c (category_id1, category_id2, pair_count)
+    SELECT p1.category_id, p2.category_id, p_sign * COUNT(*)
+    FROM shopping_carts s1
+    JOIN products p1 ON s1.product_id = p1.product_id
+    JOIN shopping_carts s2 ON s1.order_id = s2.order_id
+    JOIN products p2 ON s2.product_id = p2.product_id
+    WHERE s1.order_id = p_order_id
+    AND p1.category_id < p2.category_id
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (category_id1, category_id2) DO UPDATE
+    SET pair_count = c.pair_count + EXCLUDED.pair_count;
+
+    INSERT INTO product_pair_counts AS c (product_id1, product_id2, pair_count)
+    SELECT s1.product_id, s2.product_id, p_sign
+    FROM shopping_carts s1
+    JOIN shopping_carts s2 ON s1.order_id = s2.order_id
+    WHERE s1.order_id = p_order_id
+    AND s1.product_id < s2.product_id
+    ORDER BY 1, 2
+    ON CONFLICT (product_id1, product_id2) DO UPDATE
+    SET pair_count = c.pair_count + EXCLUDED.pair_count;
+
+    DELETE FROM category_pair_counts WHERE pair_count <= 0;
+    DELETE FROM product_pair_counts WHERE pair_count <= 0;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Cart changes, statement level: a multi-row INSERT puts several lines into an order at once, so the pairs
+-- of every touched counted order are computed before and after the statement and the difference is applied.
+-- Lines removed by the deletion of their order or product were already retracted by the BEFORE DELETE
+-- triggers; their order is no longer counted and lines of missing products are left out on both sides.
+-- Shared by trg_copurchase_cart_insert, _update and _delete: an insert only has new_rows and a delete only
+-- old_rows, so the (order_id, product_id) lines of the tables TG_OP has are read into arrays and the
+-- missing side stays an empty array, which lets one CTE below handle all three events.
+CREATE OR REPLACE FUNCTION copurchase_cart_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_new_order_ids VARCHAR[] := '{}';
+    v_new_product_ids VARCHAR[] := '{}';
+    v_old_order_ids VARCHAR[] := '{}';
+    v_old_product_ids VARCHAR[] := '{}';
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT COALESCE(array_agg(order_id), '{}'), COALESCE(array_agg(product_id), '{}')
+        INTO v_new_order_ids, v_new_product_ids
+        FROM new_rows;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT COALESCE(array_agg(order_id), '{}'), COALESCE(array_agg(product_id), '{}')
+        INTO v_old_order_ids, v_old_product_ids
+        FROM old_rows;
+    END IF;
+
+    WITH NewLines AS (
+        SELECT * FROM unnest(v_new_order_ids, v_new_product_ids) AS l(order_id, product_id)
+    ), OldLines AS (
+        SELECT * FROM unnest(v_old_order_ids, v_old_product_ids) AS l(order_id, product_id)
+    ), CountedOrders AS (
+        SELECT order_id
+        FROM (SELECT order_id FROM NewLines UNION SELECT order_id FROM OldLines) touched
+        WHERE copurchase_is_counted(order_id)
+    ), LinesAfter AS (
+        SELECT sc.order_id, sc.product_id
+        FROM CountedOrders co
+        JOIN shopping_carts sc ON co.order_id = sc.order_id
+    ), LinesBefore AS (
+        (SELECT order_id, product_id FROM LinesAfter
+         EXCEPT ALL
+         SELECT order_id, product_id FROM NewLines)
+        UNION ALL
+        SELECT ol.order_id, ol.product_id
+        FROM OldLines ol
+        JOIN CountedOrders co ON ol.order_id = co.order_id
+    ), Pairs AS (
+        SELECT l1.product_id AS product_id1, l2.product_id AS product_id2, 1 AS delta
+        FROM LinesAfter l1
+        JOIN LinesAfter l2 ON l1.order_id = l2.order_id AND l1.product_id < l2.product_id
+        UNION ALL
+        SELECT l1.product_id, l2.product_id, -1
+        FROM LinesBefore l1
+        JOIN LinesBefore l2 ON l1.order_id = l2.order_id AND l1.product_id < l2.product_id
+    ), ProductPairs AS (
+        SELECT pp.product_id1, pp.product_id2, p1.category_id AS category_id1, p2.category_id AS category_id2, pp.delta
+        FROM Pairs pp
+        JOIN products p1 ON pp.product_id1 = p1.product_id
+        JOIN products p2 ON pp.product_id2 = p2.product_id
+    ), CategoryUpdate AS (
+        INSERT INTO category_pair_counts AS c (category_id1, category_id2, pair_count)
+        SELECT LEAST(category_id1, category_id2), GREATEST(category_id1, category_id2), SUM(delta)
+        FROM ProductPairs
+        WHERE category_id1 <> category_id2
+        GROUP BY 1, 2
+        HAVING SUM(delta) <> 0
+        ORDER BY 1, 2
+        ON CONFLICT (category_id1, category_id2) DO UPDATE
+        SET pair_count = c.pair_count + EXCLUDED.pair_count
+    )
+    INSERT INTO product_pair_counts AS c (product_id1, product_id2, pair_count)
+    SELECT product_id1, product_id2, SUM(delta)
+    FROM ProductPairs
+    GROUP BY product_id1, product_id2
+    HAVING SUM(delta) <> 0
+    ORDER BY product_id1, product_id2
+    ON CONFLICT (product_id1, product_id2) DO UPDATE
+    SET pair_count = c.pair_count + EXCLUDED.pair_count;
+
+    DELETE FROM category_pair_counts WHERE pair_count <= 0;
+    DELETE FROM product_pair_counts WHERE pair_count <= 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Orders being cancelled or un-cancelled, and deleted orders
+CREATE OR REPLACE FUNCTION copurchase_order_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_refunded BOOLEAN;
+BEGIN
+    v_refunded := EXISTS (SELECT 1 FROM refunds r WHERE r.order_id = OLD.order_id);
+
+    IF TG_OP = 'DELETE' THEN
+        IF OLD.status != 'CANCELLED' AND NOT v_refunded THEN
+            PERFORM copurchase_apply_order(OLD.order_id, -1);
+        END IF;
+        RETURN OLD;
+    END IF;
+
+    IF NOT v_refunded AND (OLD.status = 'CANCELLED') <> (NEW.status = 'CANCELLED') THEN
+        PERFORM copurchase_apply_order(NEW.order_id, CASE WHEN NEW.status = 'CANCELLED' THEN -1 ELSE 1 END);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Deleted products retract the pairs of their lines. BEFORE DELETE: the lines are still there.
+CREATE OR REPLACE FUNCTION copurchase_product_deleted()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_line RECORD;
+BEGIN
+    FOR v_line IN
+        SELECT sc.order_id
+        FROM shopping_carts sc
+        WHERE sc.product_id = OLD.product_id
+        AND copurchase_is_counted(sc.order_id)
+    LOOP
+        PERFORM copurchase_apply_line(v_line.order_id, OLD.product_id, OLD.category_id, -1);
+    END LOOP;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Category moves re-file the category pairs of every counted order with a moved product. Statement level,
+-- so that pairs of two products moved by the same statement are retracted with both old categories.
+CREATE OR REPLACE FUNCTION copurchase_products_moved()
+RETURNS TRIGGER AS $$
+BEGIN
+    WITH Moved AS (
+        SELECT o.product_id, o.category_id AS old_category_id
+        FROM old_rows o
+        JOIN new_rows n ON o.product_id = n.product_id
+        WHERE o.category_id IS DISTINCT FROM n.category_id
+    ), AffectedOrders AS (
+        SELECT DISTINCT sc.order_id
+        FROM shopping_carts sc
+        JOIN Moved m ON sc.product_id = m.product_id
+        WHERE copurchase_is_counted(sc.order_id)
+    ), Lines AS (
+        SELECT
+            sc.order_id,
+            p.category_id AS new_category_id,
+            CASE WHEN m.product_id IS NULL THEN p.category_id ELSE m.old_category_id END AS old_category_id
+        FROM AffectedOrders a
+        JOIN shopping_carts sc ON a.order_id = sc.order_id
+        JOIN products p ON sc.product_id = p.product_id
+        LEFT JOIN Moved m ON sc.product_id = m.product_id
+    ), Deltas AS (
+        SELECT l1.new_category_id AS category_id1, l2.new_category_id AS category_id2, 1 AS delta
+        FROM Lines l1
+        JOIN Lines l2 ON l1.order_id = l2.order_id
+        WHERE l1.new_category_id < l2.new_category_id
+        UNION ALL
+        SELECT l1.old_category_id, l2.old_category_id, -1
+        FROM Lines l1
+        JOIN Lines l2 ON l1.order_id = l2.order_id
+        WHERE l1.old_category_id < l2.old_category_id
+    )
+    INSERT INTO category_pair_counts AS c (category_id1, category_id2, pair_count)
+    SELECT category_id1, category_id2, SUM(delta)
+    FROM Deltas
+    GROUP BY category_id1, category_id2
+    HAVING SUM(delta) <> 0
+    ORDER BY category_id1, category_id2
+    ON CONFLICT (category_id1, category_id2) DO UPDATE
+    SET pair_count = c.pair_count + EXCLUDED.pair_count;
+
+    DELETE FROM category_pair_counts WHERE pair_count <= 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- A refund retracts the order's pairs, removing the refund adds them back
+CREATE OR REPLACE FUNCTION copurchase_refund_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.order_id = NEW.order_id THEN
+        RETURN NULL;
+    END IF;
+    -- copurchase_is_counted sees the refunds after this statement: the old order is no longer refunded,
+    -- the new one is; check the status only
+    IF TG_OP IN ('UPDATE', 'DELETE') AND copurchase_is_counted(OLD.order_id) THEN
+        PERFORM copurchase_apply_order(OLD.order_id, 1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND EXISTS (
+        SELECT 1 FROM orders o WHERE o.order_id = NEW.order_id AND o.status != 'CANCELLED'
+    ) THEN
+        PERFORM copurchase_apply_order(NEW.order_id, -1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE TRIGGER trg_copurchase_cart_insert
+AFTER INSERT ON shopping_carts
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION copurchase_cart_changed();
+
+CREATE OR REPLACE TRIGGER trg_copurchase_cart_update
+AFTER UPDATE ON shopping_carts
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION copurchase_cart_changed();
+
+CREATE OR REPLACE TRIGGER trg_copurchase_cart_delete
+AFTER DELETE ON shopping_carts
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION copurchase_cart_changed();
+
+CREATE OR REPLACE TRIGGER trg_copurchase_order_update
+AFTER UPDATE OF status ON orders
+FOR EACH ROW
+WHEN (OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION copurchase_order_changed();
+
+-- BEFORE DELETE: the cart lines are still there to retract
+CREATE OR REPLACE TRIGGER trg_copurchase_order_delete
+BEFORE DELETE ON orders
+FOR EACH ROW
+EXECUTE FUNCTION copurchase_order_changed();
+
+-- fires on every products UPDATE, also price and weight changes; copurchase_products_moved only acts on the
+-- rows whose category_id changed, since an UPDATE OF category_id trigger could not reference old_rows/new_rows
+CREATE OR REPLACE TRIGGER trg_copurchase_product_category
+AFTER UPDATE ON products
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION copurchase_products_moved();
+
+CREATE OR REPLACE TRIGGER trg_copurchase_product_delete
+BEFORE DELETE ON products
+FOR EACH ROW
+EXECUTE FUNCTION copurchase_product_deleted();
+
+CREATE OR REPLACE TRIGGER trg_copurchase_refund
+AFTER INSERT OR UPDATE OR DELETE ON refunds
+FOR EACH ROW
+EXECUTE FUNCTION copurchase_refund_changed();
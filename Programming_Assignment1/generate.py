@@ -0,0 +1,114 @@
+import argparse
+import csv
+import os
+import random
+import uuid
+
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db")
+
+# namespace of the ids derived for the copies of the dataset
+SCALE_NAMESPACE = uuid.UUID("5f0c3f4e-8a51-4d0e-9a43-352000000001")
+
+
+"""
+    Returns the id of copy number `copy` of a source row id. Copy 0 keeps the original ids.
+"""
+def scaled_id(source_id, copy):
+    if copy == 0:
+        return source_id
+    return str(uuid.uuid5(SCALE_NAMESPACE, "%s:%d" % (source_id, copy)))
+
+
+def read_rows(path):
+    with open(path, newline="") as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader)
+        return header, [row for row in reader if row]
+
+
+"""
+    Writes header and rows to path, returns the row count.
+"""
+def write_rows(path, header, rows):
+    count = 0
+    with open(path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+"""
+    Synthesizes the cart lines of an order: 1 to 5 distinct products, 1 to 4 of each.
+    Lines only depend on the order id, so every run generates the same carts.
+"""
+def cart_lines(order_id, product_ids):
+    rng = random.Random(order_id)
+    for product_id in rng.sample(product_ids, min(len(product_ids), rng.randint(1, 5))):
+        yield order_id, product_id, rng.randint(1, 4)
+
+
+"""
+    Writes a dataset scale times the size of source_directory into target_directory.
+    - customers, orders and refunds are copied `scale` times with derived ids; every copy only references its own rows.
+    - product_categories and products are copied once, so queries grouping by them keep the same groups.
+    - shopping_carts.csv is synthesized for every order since the source dataset has no cart lines.
+    Returns dict of file name -> row count.
+"""
+def generate(source_directory, target_directory, scale):
+    os.makedirs(target_directory, exist_ok=True)
+    counts = {}
+
+    for name in ("product_categories.csv", "products.csv"):
+        header, rows = read_rows(os.path.join(source_directory, name))
+        counts[name] = write_rows(os.path.join(target_directory, name), header, rows)
+    product_ids = [row[0] for row in rows]
+
+    # customers.csv and refunds.csv: id in the first column
+    header, customers = read_rows(os.path.join(source_directory, "customers.csv"))
+    counts["customers.csv"] = write_rows(
+        os.path.join(target_directory, "customers.csv"), header,
+        ([scaled_id(row[0], copy)] + row[1:] for copy in range(scale) for row in customers)
+    )
+
+    # orders.csv: order_id, customer_id, ...
+    header, orders = read_rows(os.path.join(source_directory, "orders.csv"))
+    counts["orders.csv"] = write_rows(
+        os.path.join(target_directory, "orders.csv"), header,
+        ([scaled_id(row[0], copy), scaled_id(row[1], copy)] + row[2:] for copy in range(scale) for row in orders)
+    )
+
+    header, refunds = read_rows(os.path.join(source_directory, "refunds.csv"))
+    counts["refunds.csv"] = write_rows(
+        os.path.join(target_directory, "refunds.csv"), header,
+        ([scaled_id(row[0], copy)] + row[1:] for copy in range(scale) for row in refunds)
+    )
+
+    counts["shopping_carts.csv"] = write_rows(
+        os.path.join(target_directory, "shopping_carts.csv"), ["order_id", "product_id", "amount"],
+        (line for copy in range(scale) for row in orders for line in cart_lines(scaled_id(row[0], copy), product_ids))
+    )
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a scaled-up copy of the db/*.csv dataset for benchmarking.")
+    parser.add_argument("scale", type=int, help="scale factor, e.g. 10, 100 or 1000")
+    parser.add_argument("--source", default=DATA_DIRECTORY)
+    parser.add_argument("--target", default=None, help="output directory, default db_x<scale>")
+    args = parser.parse_args()
+
+    target = args.target or os.path.join(os.path.dirname(DATA_DIRECTORY), "db_x%d" % args.scale)
+    counts = generate(args.source, target, args.scale)
+
+    print("File|Rows")
+    for name, count in counts.items():
+        print(f"{name}|{count}")
+    print(f"written to {target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from config import read_config
+
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db")
+
+
+"""
+    Tables of task1.sql in FK-dependency order.
+    - file: CSV file in the data directory, tables without a file are skipped.
+    - depends: tables referenced by foreign keys of this table.
+    - columns: column definitions of task1.sql without keys and constraints.
+    - constraints: keys and constraints of task1.sql, added after the data is loaded.
+"""
+TABLES = {
+    "product_category": {
+        "file": "product_categories.csv",
+        "depends": [],
+        "columns": "category_id SERIAL, name VARCHAR(255) NOT NULL",
+        "constraints": [
+            "ALTER TABLE product_category ADD PRIMARY KEY (category_id)",
+        ],
+    },
+    "customers": {
+        "file": "customers.csv",
+        "depends": [],
+        "columns": "customer_id VARCHAR(40), name VARCHAR(20) NOT NULL, surname VARCHAR(30) NOT NULL, "
+                   "address TEXT NOT NULL, state VARCHAR(5) NOT NULL, gender CHAR(1)",
+        "constraints": [
+            "ALTER TABLE customers ADD PRIMARY KEY (customer_id)",
+            "ALTER TABLE customers ADD CHECK (gender IN ('M', 'F'))",
+        ],
+    },
+    "products": {
+        "file": "products.csv",
+        "depends": ["product_category"],
+        "columns": "product_id VARCHAR(40), name VARCHAR(255) NOT NULL, category_id INT, "
+                   "weight DECIMAL NOT NULL, price DECIMAL NOT NULL",
+        "constraints": [
+            "ALTER TABLE products ADD PRIMARY KEY (product_id)",
+            "ALTER TABLE products ADD FOREIGN KEY (category_id) REFERENCES product_category(category_id) "
+            "ON DELETE CASCADE ON UPDATE CASCADE",
+        ],
+    },
+    "orders": {
+        "file": "orders.csv",
+        "depends": ["customers"],
+        "columns": "order_id VARCHAR(40), customer_id VARCHAR(40), order_time TIMESTAMP NOT NULL, "
+                   "shipping_time TIMESTAMP, status VARCHAR(10) NOT NULL",
+        "constraints": [
+            "ALTER TABLE orders ADD PRIMARY KEY (order_id)",
+            "ALTER TABLE orders ADD FOREIGN KEY (customer_id) REFERENCES customers(customer_id) "
+            "ON DELETE CASCADE ON UPDATE CASCADE",
+        ],
+    },
+    "shopping_carts": {
+        "file": "shopping_carts.csv",
+        "depends": ["orders", "products"],
+        "columns": "order_id VARCHAR(40), product_id VARCHAR(40), amount INTEGER NOT NULL",
+        "constraints": [
+            "ALTER TABLE shopping_carts ADD PRIMARY KEY (order_id, product_id)",
+            "ALTER TABLE shopping_carts ADD FOREIGN KEY (order_id) REFERENCES orders(order_id) "
+            "ON DELETE CASCADE ON UPDATE CASCADE",
+            "ALTER TABLE shopping_carts ADD FOREIGN KEY (product_id) REFERENCES products(product_id) "
+            "ON DELETE CASCADE ON UPDATE CASCADE",
+        ],
+    },
+    "refunds": {
+        "file": "refunds.csv",
+        "depends": ["orders"],
+        "columns": "order_id VARCHAR(40), reason VARCHAR(50) NOT NULL",
+        "constraints": [
+            "ALTER TABLE refunds ADD PRIMARY KEY (order_id)",
+            "ALTER TABLE refunds ADD FOREIGN KEY (order_id) REFERENCES orders(order_id) "
+            "ON DELETE CASCADE ON UPDATE CASCADE",
+        ],
+    },
+}
+
+
+"""
+    File wrapper that counts the lines streamed through it.
+"""
+class LineCountingReader:
+    def __init__(self, file):
+        self.file = file
+        self.lines = 0
+        self.last_byte = b"\n"
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        if data:
+            self.lines += data.count(b"\n")
+            self.last_byte = data[-1:]
+        return data
+
+    def rows(self):
+        # header line is not a row, a last line without newline is
+        return self.lines - 1 + (0 if self.last_byte == b"\n" else 1)
+
+
+"""
+    Groups tables into levels; every table only references tables of earlier levels.
+"""
+def dependency_levels(tables):
+    levels = []
+    placed = set()
+    remaining = list(tables)
+    while remaining:
+        level = [t for t in remaining if all(d in placed or d not in tables for d in TABLES[t]["depends"])]
+        if not level:
+            raise ValueError("circular foreign keys between %s" % ", ".join(remaining))
+        levels.append(level)
+        placed.update(level)
+        remaining = [t for t in remaining if t not in placed]
+    return levels
+
+
+"""
+    Streams one CSV file into its table with COPY FROM STDIN.
+    Returns (table, row count, seconds).
+"""
+def copy_table(conn_params, table, path):
+    started = time.perf_counter()
+    conn = psycopg2.connect(**conn_params)
+    try:
+        with open(path, "rb") as csv_file, conn.cursor() as cursor:
+            header = csv_file.readline().decode().strip()
+            csv_file.seek(0)
+            reader = LineCountingReader(csv_file)
+            cursor.copy_expert(
+                "COPY %s (%s) FROM STDIN WITH (FORMAT csv, HEADER true)" % (table, header),
+                reader
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return table, reader.rows(), time.perf_counter() - started
+
+
+"""
+    Drops the tables and recreates them without keys and constraints.
+"""
+def create_bare_tables(conn, tables):
+    with conn.cursor() as cursor:
+        for table in reversed(tables):
+            cursor.execute("DROP TABLE IF EXISTS %s CASCADE" % table)
+        for table in tables:
+            cursor.execute("CREATE TABLE %s (%s)" % (table, TABLES[table]["columns"]))
+    conn.commit()
+
+
+"""
+    Adds the keys and constraints of task1.sql. Primary keys of all tables are built in parallel, foreign keys after them.
+"""
+def add_constraints(conn_params, tables, workers):
+    def run(statements):
+        conn = psycopg2.connect(**conn_params)
+        try:
+            with conn.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+
+    keys = [[s for s in TABLES[t]["constraints"] if "FOREIGN KEY" not in s] for t in tables]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run, keys))
+    run([s for t in tables for s in TABLES[t]["constraints"] if "FOREIGN KEY" in s])
+
+    if "product_category" in tables:
+        run(["SELECT setval(pg_get_serial_sequence('product_category', 'category_id'), "
+             "COALESCE((SELECT MAX(category_id) FROM product_category), 1))"])
+
+
+"""
+    Loads every CSV of data_directory into the task1.sql schema.
+    - fresh=True recreates the tables without keys, loads all of them in parallel and adds keys and constraints afterwards.
+    - fresh=False loads into the existing tables, level by level in FK-dependency order, tables of a level in parallel.
+    Returns list of (table, row count, seconds).
+"""
+def load(conn_params, data_directory=DATA_DIRECTORY, fresh=False, workers=4):
+    tables = [t for t in TABLES if os.path.exists(os.path.join(data_directory, TABLES[t]["file"]))]
+
+    if fresh:
+        conn = psycopg2.connect(**conn_params)
+        try:
+            create_bare_tables(conn, tables)
+        finally:
+            conn.close()
+        levels = [tables]
+    else:
+        levels = dependency_levels(tables)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for level in levels:
+            results.extend(executor.map(
+                lambda t: copy_table(conn_params, t, os.path.join(data_directory, TABLES[t]["file"])),
+                level
+            ))
+
+    if fresh:
+        started = time.perf_counter()
+        add_constraints(conn_params, tables, workers)
+        results.append(("(constraints)", 0, time.perf_counter() - started))
+
+    conn = psycopg2.connect(**conn_params)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for table in tables:
+                cursor.execute("ANALYZE %s" % table)
+    finally:
+        conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load the db/*.csv dataset into the task1.sql schema with COPY.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--data", default=DATA_DIRECTORY, help="directory of the CSV files")
+    parser.add_argument("--fresh", action="store_true", help="recreate tables and add keys after loading")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    results = load(read_config(filename=args.config, section="postgresql"), args.data, args.fresh, args.workers)
+    elapsed = time.perf_counter() - started
+
+    print("Table|Rows|Seconds|Rows/s")
+    for table, rows, seconds in results:
+        print(f"{table}|{rows}|{seconds:.2f}|{rows / seconds if seconds else 0:.0f}")
+    total = sum(rows for _, rows, _ in results)
+    print(f"total|{total}|{elapsed:.2f}|{total / elapsed:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import argparse
+import itertools
+import sys
+import time
+
+import numpy as np
+import psycopg2
+
+from config import read_config
+from reports import DEFAULT_CACHE_DIRECTORY, ReportCache, fingerprint, scanned_tables, table_versions
+
+
+"""
+    Dimensions a cube can be grouped by, as SQL expressions over the joined tables.
+    month is 'YYYY-MM', so the same month of different years is not merged like TO_CHAR(order_time, 'Month') does.
+"""
+DIMENSIONS = {
+    "gender": "c.gender",
+    "state": "c.state",
+    "category": "pc.name",
+    "status": "o.status",
+    "year": "EXTRACT(YEAR FROM o.order_time)::INTEGER",
+    "month": "TO_CHAR(o.order_time, 'YYYY-MM')",
+    "month_of_year": "EXTRACT(MONTH FROM o.order_time)::INTEGER",
+    "weekday": "EXTRACT(ISODOW FROM o.order_time)::INTEGER",
+}
+
+"""
+    Aggregated measures of a cube. order_count is not additive, which is why margins are read from the
+    cube's own grouping sets instead of being summed up in Python.
+"""
+MEASURES = {
+    "cart_total": "SUM(p.price * sc.amount)",
+    "item_count": "SUM(sc.amount)",
+    "order_count": "COUNT(DISTINCT o.order_id)",
+}
+
+BASE_QUERY = (
+    "FROM customers c "
+    "JOIN orders o ON c.customer_id = o.customer_id "
+    "JOIN shopping_carts sc ON o.order_id = sc.order_id "
+    "JOIN products p ON sc.product_id = p.product_id "
+    "LEFT JOIN product_category pc ON p.category_id = pc.category_id"
+)
+
+
+"""
+    Returns the query computing every measure for all subsets of dimensions with a single GROUPING SETS
+    aggregation. The GROUPING() column tells rolled up dimensions apart from NULL values.
+"""
+def cube_query(dimensions):
+    expressions = [DIMENSIONS[dimension] for dimension in dimensions]
+    grouping_sets = []
+    for size in range(len(dimensions), -1, -1):
+        for subset in itertools.combinations(expressions, size):
+            grouping_sets.append("(%s)" % ", ".join(subset))
+    select = expressions + ["GROUPING(%s)" % ", ".join(expressions) if expressions else "0"]
+    select += [MEASURES[measure] for measure in MEASURES]
+    return "SELECT %s %s GROUP BY GROUPING SETS (%s)" % (", ".join(select), BASE_QUERY, ", ".join(grouping_sets))
+
+
+def sort_key(value):
+    return (value is None, value)
+
+
+"""
+    Aggregates of all grouping sets of some dimensions, as NumPy arrays.
+    - values[dimension] are the sorted distinct values of a dimension, codes[dimension] the index of each
+      row's value in them, -1 where the dimension is rolled up.
+    - grouping holds the GROUPING() bit mask of every row, measures[name] the aggregate of every row.
+"""
+class Cube:
+    def __init__(self, dimensions, rows):
+        self.dimensions = list(dimensions)
+        count = len(self.dimensions)
+        columns = list(zip(*rows)) if rows else [()] * (count + 1 + len(MEASURES))
+
+        self.grouping = np.array(columns[count], dtype=np.int64)
+        self.values = {}
+        self.codes = {}
+        for i, dimension in enumerate(self.dimensions):
+            present = (self.grouping & self._bit(dimension)) == 0
+            raw = np.array(columns[i], dtype=object)
+            values = sorted(set(raw[present]), key=sort_key)
+            index = {value: code for code, value in enumerate(values)}
+            codes = np.full(len(rows), -1, dtype=np.int64)
+            codes[present] = [index[value] for value in raw[present]]
+            self.values[dimension] = values
+            self.codes[dimension] = codes
+
+        self.measures = {
+            measure: np.array(columns[count + 1 + j], dtype=float) for j, measure in enumerate(MEASURES)
+        }
+
+    # GROUPING(a, b, c) sets the most significant bit for a
+    def _bit(self, dimension):
+        return 1 << (len(self.dimensions) - 1 - self.dimensions.index(dimension))
+
+    """
+        Returns the measure of the grouping set of dimensions as a dense array over all value combinations,
+        in itertools.product order of the dimension values, NaN where a combination has no rows.
+    """
+    def aggregate(self, dimensions, measure):
+        for dimension in dimensions:
+            if dimension not in self.values:
+                raise ValueError("dimension %s is not in the cube" % dimension)
+        mask = sum(self._bit(dimension) for dimension in self.dimensions if dimension not in dimensions)
+        selected = self.grouping == mask
+
+        shape = [len(self.values[dimension]) for dimension in dimensions]
+        result = np.full(int(np.prod(shape)), np.nan)
+        if dimensions:
+            flat = np.ravel_multi_index([self.codes[dimension][selected] for dimension in dimensions], shape)
+        else:
+            flat = np.zeros(int(selected.sum()), dtype=np.int64)
+        result[flat] = self.measures[measure][selected]
+        return result
+
+    """
+        Pivots the measure into a table with the row dimensions down and the column dimensions across.
+        - Returns (row labels, column labels, matrix); labels are tuples of dimension values.
+        - Rows and columns without any value are dropped.
+        - With margins, a "Total" row and column are added from the cube's coarser grouping sets; the Total
+          row is left out without row dimensions and the Total column without column dimensions.
+    """
+    def pivot(self, rows, columns=(), measure="cart_total", margins=False):
+        rows = list(rows)
+        columns = list(columns)
+        row_labels = list(itertools.product(*[self.values[dimension] for dimension in rows]))
+        column_labels = list(itertools.product(*[self.values[dimension] for dimension in columns]))
+        matrix = self.aggregate(rows + columns, measure).reshape(len(row_labels), len(column_labels))
+
+        # without row or column dimensions the single row or column already is the total
+        if margins and columns:
+            matrix = np.column_stack([matrix, self.aggregate(rows, measure)])
+            column_labels.append(("Total",) * len(columns))
+        if margins and rows:
+            total_row = self.aggregate(columns, measure)
+            if columns:
+                total_row = np.append(total_row, self.aggregate([], measure))
+            matrix = np.vstack([matrix, total_row])
+            row_labels.append(("Total",) * len(rows))
+
+        kept_rows = ~np.isnan(matrix).all(axis=1)
+        kept_columns = ~np.isnan(matrix).all(axis=0)
+        matrix = matrix[kept_rows][:, kept_columns]
+        row_labels = [label for label, kept in zip(row_labels, kept_rows) if kept]
+        column_labels = [label for label, kept in zip(column_labels, kept_columns) if kept]
+        return row_labels, column_labels, matrix
+
+
+"""
+    Loads the cube of dimensions with one GROUPING SETS query.
+    - With a ReportCache, the result is reused while the scanned tables are unchanged, across runs too.
+    - Returns tuple (cube, cached).
+"""
+def load_cube(conn, dimensions, cache=None):
+    query = cube_query(dimensions)
+    versions = table_versions(conn) if cache is not None else None
+    entry = cache.get(query, versions) if cache is not None else None
+    if entry is not None:
+        return Cube(dimensions, entry["rows"]), True
+
+    started = time.perf_counter()
+    with conn.cursor() as cursor:
+        tables = scanned_tables(cursor, query)
+        cursor.execute(query)
+        rows = cursor.fetchall()
+    conn.rollback()
+    if cache is not None:
+        cache.put(query, {
+            "columns": list(dimensions) + ["grouping"] + list(MEASURES),
+            "rows": rows,
+            "tables": tables,
+            "fingerprint": fingerprint(tables, versions),
+            "computed_at": time.time(),
+            "elapsed": time.perf_counter() - started,
+        })
+    return Cube(dimensions, rows), False
+
+
+def format_value(value):
+    if np.isnan(value):
+        return ""
+    return ("%.2f" % value).rstrip("0").rstrip(".")
+
+
+def format_label(label):
+    return "/".join(str(value) for value in label) or "all"
+
+
+def print_pivot(rows, columns, row_labels, column_labels, matrix, out=None):
+    out = out or sys.stdout
+    out.write("|".join(["/".join(rows) or "all"] + [format_label(label) for label in column_labels]) + "\n")
+    for label, values in zip(row_labels, matrix):
+        out.write("|".join([format_label(label)] + [format_value(value) for value in values]) + "\n")
+
+
+"""
+    Parses "rows:columns" with comma separated dimensions, e.g. "gender:month" or "gender,state:year".
+"""
+def parse_layout(layout):
+    rows, _, columns = layout.partition(":")
+    return [dimension for dimension in rows.split(",") if dimension], [dimension for dimension in columns.split(",") if dimension]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pivot cart totals by any dimensions from one cached GROUPING SETS cube.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--pivot", action="append", metavar="ROWS:COLUMNS",
+                        help="layout to print, e.g. gender:month (the task2_7 report); may be repeated")
+    parser.add_argument("--measure", choices=sorted(MEASURES), default="cart_total")
+    parser.add_argument("--margins", action="store_true", help="add Total row and column")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIRECTORY)
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    layouts = [parse_layout(layout) for layout in (args.pivot or ["gender:month"])]
+    dimensions = []
+    for rows, columns in layouts:
+        for dimension in rows + columns:
+            if dimension not in DIMENSIONS:
+                parser.error("unknown dimension %s, choose from %s" % (dimension, ", ".join(sorted(DIMENSIONS))))
+            if dimension not in dimensions:
+                dimensions.append(dimension)
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    try:
+        started = time.perf_counter()
+        # every layout is a pivot of the same cube over the union of their dimensions
+        cube, cached = load_cube(conn, dimensions, cache=None if args.no_cache else ReportCache(args.cache_dir))
+        print(f"cube {','.join(dimensions)}: {'cached' if cached else 'computed'} in {time.perf_counter() - started:.3f} s",
+              file=sys.stderr)
+    finally:
+        conn.close()
+
+    for rows, columns in layouts:
+        print_pivot(rows, columns, *cube.pivot(rows, columns, measure=args.measure, margins=args.margins))
+        print()
+
+
+if __name__ == "__main__":
+    main()
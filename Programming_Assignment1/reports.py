@@ -0,0 +1,329 @@
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import psycopg2.extensions
+
+from benchmark import BASE_DIRECTORY, is_query, read_script, run_setup, split_statements
+from config import read_config
+
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(BASE_DIRECTORY, ".report_cache")
+
+
+"""
+    Returns list of (name, query) of the task2_* report suite and list of (name, statement) to run once as setup.
+    Files with several queries are named task2_N#1, task2_N#2, ... like in benchmark.py.
+"""
+def collect_reports(directory=BASE_DIRECTORY):
+    reports = []
+    setup = []
+    for path in sorted(glob.glob(os.path.join(directory, "task2_*.sql"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        statements = split_statements(read_script(path))
+        queries = [statement for statement in statements if is_query(statement)]
+        setup.extend((name, statement) for statement in statements if not is_query(statement))
+        for number, query in enumerate(queries, 1):
+            reports.append((name if len(queries) == 1 else "%s#%d" % (name, number), query))
+    return reports, setup
+
+
+def query_hash(query):
+    return hashlib.sha256(query.strip().encode("utf-8")).hexdigest()
+
+
+"""
+    Returns dict "schema.table" -> data version of every user table.
+    - The version is (relfilenode, inserted, updated, deleted tuples) from pg_stat_user_tables. The counters
+      only grow, TRUNCATE and VACUUM FULL change the relfilenode and a stats reset changes the counters too.
+    - The counters are updated when a writing transaction ends and reach the statistics views with a delay
+      of up to about a second; reports read right after a write may need an explicit invalidation.
+"""
+def table_versions(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT s.schemaname || '.' || s.relname, c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del "
+            "FROM pg_stat_user_tables s JOIN pg_class c ON c.oid = s.relid"
+        )
+        versions = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+    conn.rollback()
+    return versions
+
+
+"""
+    Returns the sorted "schema.table" names scanned by the plan of query, views resolved to their tables.
+"""
+def scanned_tables(cursor, query):
+    cursor.execute("EXPLAIN (VERBOSE, FORMAT JSON) " + query)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    tables = set()
+    nodes = [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if "Relation Name" in node:
+            tables.add("%s.%s" % (node.get("Schema", "public"), node["Relation Name"]))
+        nodes.extend(node.get("Plans", []))
+    return sorted(tables)
+
+
+def fingerprint(tables, versions):
+    return tuple((table, versions.get(table)) for table in tables)
+
+
+"""
+    Cache of report results keyed by query hash; an entry is valid while the data versions of the tables its
+    query scanned are unchanged.
+    - Entries are kept in memory and, when directory is given, pickled to <directory>/<query hash>.pickle so
+      that later runs reuse them.
+    - invalidate() drops one query or every entry.
+"""
+class ReportCache:
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "invalidations": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+    def _load(self, key):
+        entry = self._entries.get(key)
+        if entry is None and self.directory and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key), "rb") as entry_file:
+                    entry = self._entries[key] = pickle.load(entry_file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                entry = None
+        return entry
+
+    """
+        Returns the cached entry of query if the tables it scanned still have the given versions, else None.
+        An entry is a dict with columns, rows, tables, fingerprint, computed_at and elapsed.
+    """
+    def get(self, query, versions):
+        key = query_hash(query)
+        with self._lock:
+            entry = self._load(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry["fingerprint"] != fingerprint(entry["tables"], versions):
+                self._stats["stale"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, query, entry):
+        key = query_hash(query)
+        with self._lock:
+            self._entries[key] = entry
+            if self.directory:
+                # write and rename, a parallel reader never sees a partial file
+                temporary = self._path(key) + ".%d.tmp" % os.getpid()
+                with open(temporary, "wb") as entry_file:
+                    pickle.dump(entry, entry_file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temporary, self._path(key))
+
+    """
+        Drops the entry of query, or every entry when query is None.
+    """
+    def invalidate(self, query=None):
+        with self._lock:
+            if query is not None:
+                keys = {query_hash(query)}
+            else:
+                keys = set(self._entries)
+                if self.directory:
+                    keys.update(os.path.basename(path)[:-len(".pickle")] for path in glob.glob(os.path.join(self.directory, "*.pickle")))
+            for key in keys:
+                removed = self._entries.pop(key, None) is not None
+                if self.directory and os.path.exists(self._path(key)):
+                    os.remove(self._path(key))
+                    removed = True
+                if removed:
+                    self._stats["invalidations"] += 1
+
+    """
+        Returns hit/miss/stale/invalidation counters and the hit rate of the lookups so far.
+    """
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+# connection of the current worker thread or process, opened by init_worker
+_worker = threading.local()
+_worker_connections = []
+_worker_lock = threading.Lock()
+
+
+def init_worker(conn_params):
+    _worker.conn = psycopg2.connect(**conn_params)
+    _worker.conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    with _worker_lock:
+        _worker_connections.append(_worker.conn)
+
+
+"""
+    Runs one report on the worker's connection, inside the exported snapshot when one is given, so that all
+    reports of a run see the same data. Returns (name, entry) or (name, {"error": message}).
+"""
+def run_report(name, query, snapshot=None):
+    conn = _worker.conn
+    started = time.perf_counter()
+    try:
+        with conn.cursor() as cursor:
+            if snapshot is not None:
+                cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            tables = scanned_tables(cursor, query)
+            cursor.execute(query)
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        return name, {
+            "columns": columns,
+            "rows": rows,
+            "tables": tables,
+            "computed_at": time.time(),
+            "elapsed": time.perf_counter() - started,
+        }
+    except psycopg2.Error as e:
+        return name, {"error": str(e).strip().splitlines()[0]}
+    finally:
+        conn.rollback()
+
+
+"""
+    Runs the reports concurrently on workers connections, serving unchanged ones from the cache.
+    - Data versions are read before the snapshot is exported: a write between the two only makes the cached
+      result look older than it is, so the next run recomputes it.
+    - mode is "threads" (one connection per thread) or "processes" (one connection per process).
+    - Returns list of (name, cached, entry) in report order.
+"""
+def run_reports(conn_params, reports, cache=None, workers=4, mode="threads"):
+    coordinator = psycopg2.connect(**conn_params)
+    try:
+        versions = table_versions(coordinator)
+        results = {}
+        pending = []
+        for name, query in reports:
+            entry = cache.get(query, versions) if cache is not None else None
+            if entry is not None:
+                results[name] = (True, entry)
+            else:
+                pending.append((name, query))
+
+        if pending:
+            # the coordinator's transaction keeps the exported snapshot alive while the workers use it
+            coordinator.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+            with coordinator.cursor() as cursor:
+                cursor.execute("SELECT pg_export_snapshot()")
+                snapshot = cursor.fetchone()[0]
+
+            workers = max(1, min(workers, len(pending)))
+            tasks = [(name, query, snapshot) for name, query in pending]
+            if mode == "processes":
+                with multiprocessing.Pool(workers, initializer=init_worker, initargs=(conn_params,)) as pool:
+                    computed = pool.starmap(run_report, tasks)
+            else:
+                with ThreadPoolExecutor(workers, initializer=init_worker, initargs=(conn_params,)) as pool:
+                    computed = list(pool.map(lambda task: run_report(*task), tasks))
+                with _worker_lock:
+                    for conn in _worker_connections:
+                        conn.close()
+                    _worker_connections.clear()
+            coordinator.rollback()
+
+            queries = dict(pending)
+            for name, entry in computed:
+                if "error" not in entry:
+                    entry["fingerprint"] = fingerprint(entry["tables"], versions)
+                    if cache is not None:
+                        cache.put(queries[name], entry)
+                results[name] = (False, entry)
+    finally:
+        coordinator.close()
+
+    return [(name, results[name][0], results[name][1]) for name, _ in reports]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the task2_* report suite in parallel with a result cache.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--reports", default="", help="comma separated report names, e.g. task2_1,task2_4")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--mode", choices=["threads", "processes"], default="threads")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIRECTORY, help="directory of the cached results")
+    parser.add_argument("--no-cache", action="store_true", help="recompute every report and do not store results")
+    parser.add_argument("--invalidate", action="store_true", help="drop the cached results of the selected reports first")
+    parser.add_argument("--setup", action="store_true", help="run the non-query statements of the task2 files first")
+    parser.add_argument("--show", action="store_true", help="print the rows of every report")
+    args = parser.parse_args()
+
+    conn_params = read_config(filename=args.config, section="postgresql")
+    reports, setup = collect_reports()
+    selected = set(filter(None, args.reports.split(",")))
+    if selected:
+        reports = [(name, query) for name, query in reports if name.split("#")[0] in selected]
+
+    if args.setup:
+        conn = psycopg2.connect(**conn_params)
+        try:
+            for name, error in run_setup(conn, setup):
+                print(f"setup {name}: {error}", file=sys.stderr)
+        finally:
+            conn.close()
+
+    cache = None if args.no_cache else ReportCache(args.cache_dir)
+    if cache is not None and args.invalidate:
+        for _, query in reports:
+            cache.invalidate(query)
+
+    started = time.perf_counter()
+    results = run_reports(conn_params, reports, cache=cache, workers=args.workers, mode=args.mode)
+    elapsed = time.perf_counter() - started
+
+    failed = 0
+    print("Report|Cache|Rows|Seconds")
+    for name, cached, entry in results:
+        if "error" in entry:
+            failed += 1
+            print(f"{name}|-|ERROR {entry['error']}|")
+        else:
+            print(f"{name}|{'hit' if cached else 'miss'}|{len(entry['rows'])}|{0.0 if cached else entry['elapsed']:.3f}")
+
+    if args.show:
+        for name, _, entry in results:
+            if "error" not in entry:
+                print(f"\n{name}")
+                print("|".join(entry["columns"]))
+                for row in entry["rows"]:
+                    print("|".join(str(value) for value in row))
+
+    if cache is not None:
+        stats = cache.stats()
+        print(f"cache: {stats['hits']} hits, {stats['misses']} misses ({stats['stale']} stale), hit rate {stats['hit_rate']:.0%}")
+    print(f"{len(results)} reports in {elapsed:.2f} s")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import sys
+
+import psycopg2
+
+from benchmark import read_script
+from config import read_config
+from consistency import compare_with_recomputation
+
+
+"""
+    Reports served from the summary tables, with the original query each one replaces.
+    - view: summaries.sql view reading the summary tables.
+    - query: task2 file computing the same rows from the base tables.
+    - key: converts a result row so that both sides compare equal (EXTRACT returns numeric in the original).
+"""
+REPORTS = {
+    "weekday_revenue": {
+        "view": "weekday_revenue_report",
+        "query": "task2_4.sql",
+        "key": lambda row: (row[0], row[1]),
+    },
+    "monthly_top_cart": {
+        "view": "monthly_top_cart_report",
+        "query": "task2_2.sql",
+        "key": lambda row: (row[0], int(row[1]), int(row[2]), row[3]),
+    },
+}
+
+# summary table -> view with its full recomputation
+SUMMARY_TABLES = {
+    "order_totals": "order_totals_expected",
+    "daily_revenue": "daily_revenue_expected",
+}
+
+
+"""
+    Creates the summary tables, triggers and report views, then fills the tables from the current data.
+"""
+def install(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(read_script("summaries.sql"))
+        cursor.execute("SELECT summary_rebuild()")
+    conn.commit()
+
+
+"""
+    Recomputes the summary tables from scratch.
+"""
+def rebuild(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT summary_rebuild()")
+    conn.commit()
+
+
+"""
+    Compares every summary table with its full recomputation and every report with its original task2 query.
+    Returns list of (name, missing rows, unexpected rows); empty if the summaries are consistent.
+"""
+def reconcile(conn):
+    differences = []
+    with conn.cursor() as cursor:
+        # one snapshot for all comparisons
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+
+        differences.extend(compare_with_recomputation(cursor, SUMMARY_TABLES))
+
+        for name, report in REPORTS.items():
+            cursor.execute("SELECT * FROM %s" % report["view"])
+            actual = sorted(map(report["key"], cursor.fetchall()))
+            cursor.execute(read_script(report["query"]))
+            expected = sorted(map(report["key"], cursor.fetchall()))
+            if actual != expected:
+                missing = [row for row in expected if row not in actual]
+                unexpected = [row for row in actual if row not in expected]
+                differences.append((name, missing, unexpected))
+    conn.rollback()
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summary tables behind the task2_2/task2_4 reports.")
+    parser.add_argument("command", choices=["install", "rebuild", "reconcile", "report"])
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--report", choices=sorted(REPORTS), default=None, help="report to print, default all")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    try:
+        if args.command == "install":
+            install(conn)
+            print("summary tables installed")
+
+        elif args.command == "rebuild":
+            rebuild(conn)
+            print("summary tables rebuilt")
+
+        elif args.command == "reconcile":
+            differences = reconcile(conn)
+            for name, missing, unexpected in differences:
+                for row in missing:
+                    print(f"MISSING {name}|{'|'.join(map(str, row))}")
+                for row in unexpected:
+                    print(f"UNEXPECTED {name}|{'|'.join(map(str, row))}")
+            print("%d inconsistent summaries" % len(differences))
+            sys.exit(1 if differences else 0)
+
+        else:
+            with conn.cursor() as cursor:
+                for name in [args.report] if args.report else sorted(REPORTS):
+                    cursor.execute("SELECT * FROM %s" % REPORTS[name]["view"])
+                    print(name)
+                    print("|".join(column.name for column in cursor.description))
+                    for row in cursor.fetchall():
+                        print("|".join(map(str, row)))
+            conn.rollback()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+-- Summary tables behind task2_2.sql (top cart per month) and task2_4.sql (average revenue per weekday).
+-- The tables are kept up to date by the triggers below, so the reports read the summaries instead of
+-- joining orders, shopping_carts, products and refunds on every run.
+-- Install with: python summaries.py install
+
+
+-- Total of every order with at least one cart line (task2_2.sql OrderTotals)
+CREATE TABLE IF NOT EXISTS order_totals (
+    order_id VARCHAR(40) PRIMARY KEY,
+    customer_id VARCHAR(40),
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    cart_total DECIMAL NOT NULL,
+    line_count INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS order_totals_month_idx ON order_totals (year, month, cart_total DESC);
+
+
+-- Revenue per day of orders that are neither cancelled nor refunded (task2_4.sql RevenueByDay)
+CREATE TABLE IF NOT EXISTS daily_revenue (
+    day DATE PRIMARY KEY,
+    revenue DECIMAL NOT NULL,
+    line_count INTEGER NOT NULL
+);
+
+
+-- Full recomputation of the summaries, used by summary_rebuild() and the reconciliation
+CREATE OR REPLACE VIEW order_totals_expected AS
+SELECT
+    o.order_id,
+    o.customer_id,
+    EXTRACT(YEAR FROM o.order_time)::INTEGER AS year,
+    EXTRACT(MONTH FROM o.order_time)::INTEGER AS month,
+    SUM(sc.amount * p.price) AS cart_total,
+    COUNT(*)::INTEGER AS line_count
+FROM orders o
+JOIN shopping_carts sc ON o.order_id = sc.order_id
+JOIN products p ON sc.product_id = p.product_id
+GROUP BY o.order_id;
+
+CREATE OR REPLACE VIEW daily_revenue_expected AS
+SELECT
+    o.order_time::DATE AS day,
+    SUM(sc.amount * p.price) AS revenue,
+    COUNT(*)::INTEGER AS line_count
+FROM orders o
+JOIN shopping_carts sc ON o.order_id = sc.order_id
+JOIN products p ON sc.product_id = p.product_id
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM refunds r
+    WHERE r.order_id = o.order_id
+)
+AND o.status NOT IN ('CANCELLED')
+GROUP BY day;
+
+
+CREATE OR REPLACE FUNCTION summary_rebuild()
+RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE orders, shopping_carts, products, refunds IN SHARE MODE;
+    TRUNCATE order_totals, daily_revenue;
+    INSERT INTO order_totals SELECT * FROM order_totals_expected;
+    INSERT INTO daily_revenue SELECT * FROM daily_revenue_expected;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Adds revenue and line count to a day, removes days without lines
+CREATE OR REPLACE FUNCTION summary_apply_day(p_day DATE, p_revenue DECIMAL, p_lines INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    IF p_lines = 0 AND p_revenue = 0 THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO daily_revenue AS d (day, revenue, line_count)
+    VALUES (p_day, p_revenue, p_lines)
+    ON CONFLICT (day) DO UPDATE
+    SET revenue = d.revenue + EXCLUDED.revenue,
+        line_count = d.line_count + EXCLUDED.line_count;
+
+    DELETE FROM daily_revenue WHERE day = p_day AND line_count <= 0;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Adds total and line count to an order, and to its day if the order counts as revenue
+CREATE OR REPLACE FUNCTION summary_apply_order(
+    p_order_id VARCHAR, p_customer_id VARCHAR, p_order_time TIMESTAMP, p_is_revenue BOOLEAN,
+    p_total DECIMAL, p_lines INTEGER
+)
+RETURNS VOID AS $$
+BEGIN
+    IF p_lines = 0 AND p_total = 0 THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO order_totals AS t (order_id, customer_id, year, month, cart_total, line_count)
+    VALUES (
+        p_order_id, p_customer_id,
+        EXTRACT(YEAR FROM p_order_time), EXTRACT(MONTH FROM p_order_time),
+        p_total, p_lines
+    )
+    ON CONFLICT (order_id) DO UPDATE
+    SET cart_total = t.cart_total + EXCLUDED.cart_total,
+        line_count = t.line_count + EXCLUDED.line_count;
+
+    DELETE FROM order_totals WHERE order_id = p_order_id AND line_count <= 0;
+
+    IF p_is_revenue THEN
+        PERFORM summary_apply_day(p_order_time::DATE, p_total, p_lines);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Applies one cart line change. Skipped when the order or product is being deleted,
+-- their BEFORE DELETE triggers already removed the line.
+CREATE OR REPLACE FUNCTION summary_apply_cart_line(p_order_id VARCHAR, p_product_id VARCHAR, p_amount INTEGER, p_lines INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_order orders%ROWTYPE;
+    v_price DECIMAL;
+BEGIN
+    SELECT * INTO v_order FROM orders WHERE order_id = p_order_id;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+    SELECT price INTO v_price FROM products WHERE product_id = p_product_id;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    PERFORM summary_apply_order(
+        v_order.order_id, v_order.customer_id, v_order.order_time,
+        v_order.status NOT IN ('CANCELLED') AND NOT EXISTS (SELECT 1 FROM refunds r WHERE r.order_id = p_order_id),
+        p_amount * v_price, p_lines
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION summary_cart_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM summary_apply_cart_line(OLD.order_id, OLD.product_id, -OLD.amount, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM summary_apply_cart_line(NEW.order_id, NEW.product_id, NEW.amount, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Moves the order's total when its customer, time or status changes, removes it when the order is deleted
+CREATE OR REPLACE FUNCTION summary_order_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_total DECIMAL;
+    v_lines INTEGER;
+    v_refunded BOOLEAN;
+BEGIN
+    SELECT COALESCE(SUM(sc.amount * p.price), 0), COUNT(*) INTO v_total, v_lines
+    FROM shopping_carts sc
+    JOIN products p ON sc.product_id = p.product_id
+    WHERE sc.order_id = OLD.order_id;
+
+    IF v_lines > 0 THEN
+        v_refunded := EXISTS (SELECT 1 FROM refunds r WHERE r.order_id = OLD.order_id);
+
+        PERFORM summary_apply_order(
+            OLD.order_id, OLD.customer_id, OLD.order_time,
+            OLD.status NOT IN ('CANCELLED') AND NOT v_refunded, -v_total, -v_lines
+        );
+        IF TG_OP = 'UPDATE' THEN
+            PERFORM summary_apply_order(
+                NEW.order_id, NEW.customer_id, NEW.order_time,
+                NEW.status NOT IN ('CANCELLED') AND NOT v_refunded, v_total, v_lines
+            );
+        END IF;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Removes all lines of a deleted product, or applies a price change to all lines of the product
+CREATE OR REPLACE FUNCTION summary_product_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_line RECORD;
+BEGIN
+    FOR v_line IN SELECT sc.order_id, sc.amount FROM shopping_carts sc WHERE sc.product_id = OLD.product_id LOOP
+        IF TG_OP = 'DELETE' THEN
+            PERFORM summary_apply_cart_line(v_line.order_id, OLD.product_id, -v_line.amount, -1);
+        ELSE
+            PERFORM summary_apply_order(o.order_id, o.customer_id, o.order_time,
+                                        o.status NOT IN ('CANCELLED')
+                                        AND NOT EXISTS (SELECT 1 FROM refunds r WHERE r.order_id = o.order_id),
+                                        v_line.amount * (NEW.price - OLD.price), 0)
+            FROM orders o
+            WHERE o.order_id = v_line.order_id;
+        END IF;
+    END LOOP;
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Adds (p_sign = 1) or removes (p_sign = -1) the revenue of an order that stops or starts being refunded
+CREATE OR REPLACE FUNCTION summary_apply_refund(p_order_id VARCHAR, p_sign INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_order orders%ROWTYPE;
+    v_total DECIMAL;
+    v_lines INTEGER;
+BEGIN
+    SELECT * INTO v_order FROM orders WHERE order_id = p_order_id;
+    IF NOT FOUND OR v_order.status IN ('CANCELLED') THEN
+        RETURN;
+    END IF;
+
+    SELECT COALESCE(SUM(sc.amount * p.price), 0), COUNT(*) INTO v_total, v_lines
+    FROM shopping_carts sc
+    JOIN products p ON sc.product_id = p.product_id
+    WHERE sc.order_id = p_order_id;
+
+    PERFORM summary_apply_day(v_order.order_time::DATE, p_sign * v_total, p_sign * v_lines);
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION summary_refund_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.order_id = NEW.order_id THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM summary_apply_refund(OLD.order_id, 1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM summary_apply_refund(NEW.order_id, -1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE TRIGGER trg_summary_cart
+AFTER INSERT OR UPDATE OR DELETE ON shopping_carts
+FOR EACH ROW
+EXECUTE FUNCTION summary_cart_changed();
+
+CREATE OR REPLACE TRIGGER trg_summary_order_update
+AFTER UPDATE OF customer_id, order_time, status ON orders
+FOR EACH ROW
+WHEN (OLD.customer_id IS DISTINCT FROM NEW.customer_id
+      OR OLD.order_time IS DISTINCT FROM NEW.order_time
+      OR OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION summary_order_changed();
+
+-- BEFORE DELETE: the cart lines are still there to compute what to remove
+CREATE OR REPLACE TRIGGER trg_summary_order_delete
+BEFORE DELETE ON orders
+FOR EACH ROW
+EXECUTE FUNCTION summary_order_changed();
+
+CREATE OR REPLACE TRIGGER trg_summary_product_price
+AFTER UPDATE OF price ON products
+FOR EACH ROW
+WHEN (OLD.price IS DISTINCT FROM NEW.price)
+EXECUTE FUNCTION summary_product_changed();
+
+CREATE OR REPLACE TRIGGER trg_summary_product_delete
+BEFORE DELETE ON products
+FOR EACH ROW
+EXECUTE FUNCTION summary_product_changed();
+
+CREATE OR REPLACE TRIGGER trg_summary_refund
+AFTER INSERT OR UPDATE OR DELETE ON refunds
+FOR EACH ROW
+EXECUTE FUNCTION summary_refund_changed();
+
+
+-- task2_4.sql on top of daily_revenue
+CREATE OR REPLACE VIEW weekday_revenue_report AS
+WITH AverageRevenue AS (
+    SELECT
+        EXTRACT(ISODOW FROM day) AS day_of_week,
+        AVG(revenue) AS avg_daily_revenue
+    FROM daily_revenue
+    GROUP BY day_of_week
+)
+SELECT
+    CASE day_of_week
+        WHEN 1 THEN 'Monday'
+        WHEN 2 THEN 'Tuesday'
+        WHEN 3 THEN 'Wednesday'
+        WHEN 4 THEN 'Thursday'
+        WHEN 5 THEN 'Friday'
+        WHEN 6 THEN 'Saturday'
+        WHEN 7 THEN 'Sunday'
+    END AS weekday,
+    avg_daily_revenue
+FROM AverageRevenue
+ORDER BY avg_daily_revenue DESC
+LIMIT 3;
+
+
+-- task2_2.sql on top of order_totals: walks the distinct months over order_totals_month_idx
+-- and reads the top carts of each month from the same index
+CREATE OR REPLACE VIEW monthly_top_cart_report AS
+WITH RECURSIVE Months AS (
+    (SELECT year, month FROM order_totals ORDER BY year, month LIMIT 1)
+    UNION ALL
+    SELECT next_month.year, next_month.month
+    FROM Months m
+    CROSS JOIN LATERAL (
+        SELECT year, month
+        FROM order_totals
+        WHERE (year, month) > (m.year, m.month)
+        ORDER BY year, month
+        LIMIT 1
+    ) next_month
+)
+SELECT
+    top.customer_id,
+    m.year,
+    m.month,
+    top.cart_total
+FROM Months m
+CROSS JOIN LATERAL (
+    SELECT customer_id, cart_total
+    FROM order_totals
+    WHERE year = m.year AND month = m.month
+    ORDER BY cart_total DESC
+    FETCH FIRST 1 ROWS WITH TIES
+) top
+ORDER BY m.month ASC;
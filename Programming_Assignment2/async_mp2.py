@@ -0,0 +1,261 @@
+import asyncio
+import uuid
+
+import asyncpg
+
+from config import read_config
+from messages import *
+from mp2 import MAX_CART_WEIGHT, SESSION_ADMISSION_ATTEMPTS, SESSION_TTL, STATEMENTS, RetryPolicy, create_retry_policy
+from seller import Seller
+
+
+"""
+    Asynchronous counterpart of mp2.reserve_stocks; locks stock rows in canonical order, then decreases them.
+    Returns tuple (demand row count, reserved row count).
+"""
+async def reserve_stocks(conn, demand, *args):
+    await conn.execute(STATEMENTS.sql("lock_%s_stocks" % demand), *args)
+    row = await conn.fetchrow(STATEMENTS.sql("reserve_%s_stocks" % demand), *args)
+    return row[0], row[1]
+
+
+"""
+    asyncio variant of Mp2Client on top of an asyncpg connection pool.
+    - Every operation is a coroutine with the same arguments and return tuples as its Mp2Client counterpart.
+    - Operations borrow a pooled connection only while they run, so many customer and seller
+      sessions can be multiplexed on one event loop.
+    - Create instances with `await AsyncMp2Client.create(config_filename)` and release them with `await client.close()`.
+    - SQL comes from the mp2.STATEMENTS registry; asyncpg prepares and caches statements per connection by itself.
+"""
+class AsyncMp2Client:
+    def __init__(self, pool, retry_policy=None, session_ttl=SESSION_TTL):
+        self.pool = pool
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.session_ttl = session_ttl
+
+    """
+        Creates the connection pool from the [postgresql] and [pool] sections of the configuration file.
+    """
+    @classmethod
+    async def create(cls, config_filename):
+        db_conn_params = read_config(filename=config_filename, section="postgresql")
+        pool_params = read_config(filename=config_filename, section="pool", required=False)
+        retry_params = read_config(filename=config_filename, section="retry", required=False)
+        session_params = read_config(filename=config_filename, section="sessions", required=False)
+
+        pool = await asyncpg.create_pool(
+            min_size=int(pool_params.get("minconn", 1)),
+            max_size=int(pool_params.get("maxconn", 10)),
+            max_inactive_connection_lifetime=float(pool_params.get("idle_timeout", 300)),
+            **db_conn_params
+        )
+        return cls(
+            pool,
+            retry_policy=create_retry_policy(retry_params),
+            session_ttl=float(session_params.get("ttl", SESSION_TTL))
+        )
+
+    """
+        Closes the connection pool.
+    """
+    async def close(self):
+        await self.pool.close()
+
+    """
+        Returns connection pool sizes.
+    """
+    def pool_stats(self):
+        return {
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "minconn": self.pool.get_min_size(),
+            "maxconn": self.pool.get_max_size(),
+        }
+
+    """
+        Runs body(conn) in one transaction on a pooled connection, see Mp2Client._run_transaction.
+    """
+    async def _run_transaction(self, body, failure):
+        attempt = 1
+        while True:
+            try:
+                async with self.pool.acquire() as conn:
+                    transaction = conn.transaction()
+                    await transaction.start()
+                    try:
+                        result = await body(conn)
+                    except BaseException:
+                        await transaction.rollback()
+                        raise
+                    if result[0]:
+                        await transaction.commit()
+                    else:
+                        await transaction.rollback()
+                    return result
+            except asyncpg.PostgresError as e:
+                if not self.retry_policy.should_retry(e, attempt):
+                    return failure
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+            except Exception as e:
+                return failure
+
+    async def sign_up(self, seller_id, password, plan_id):
+        async def body(conn):
+            await conn.execute(STATEMENTS.sql("insert_seller"), seller_id, password, int(plan_id))
+            return True, CMD_EXECUTION_SUCCESS
+
+        return await self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
+
+    async def sign_in(self, seller_id, password):
+        async def body(conn):
+            seller = await conn.fetchrow(STATEMENTS.sql("seller_by_credentials"), seller_id, password)
+            if seller is None:
+                return None, USER_SIGNIN_FAILED
+
+            session_token = str(uuid.uuid4())
+            for _ in range(SESSION_ADMISSION_ATTEMPTS):
+                slot = await conn.fetchval(STATEMENTS.sql("open_session"), seller_id, self.session_ttl, session_token)
+                if slot is not None:
+                    return Seller(seller[0], slot, seller[3], session_token=session_token), CMD_EXECUTION_SUCCESS
+            return None, USER_ALL_SESSIONS_ARE_USED
+
+        return await self._run_transaction(body, failure=(None, USER_SIGNIN_FAILED))
+
+    async def sign_out(self, seller):
+        if seller.session_token is None:
+            return False, CMD_EXECUTION_FAILED
+
+        async def body(conn):
+            await conn.execute(STATEMENTS.sql("close_session"), seller.session_token)
+            return True, CMD_EXECUTION_SUCCESS
+
+        return await self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
+
+    async def quit(self, seller):
+        if not seller:
+            return True, CMD_EXECUTION_SUCCESS
+        return await self.sign_out(seller)
+
+    async def show_plans(self):
+        try:
+            async with self.pool.acquire() as conn:
+                plans = await conn.fetch(STATEMENTS.sql("all_plans"))
+            print("#|Name|Max Sessions")
+            for plan in plans:
+                print(f"{plan[0]}|{plan[1]}|{plan[2]}")
+            return True, CMD_EXECUTION_SUCCESS
+        except Exception as e:
+            return False, CMD_EXECUTION_FAILED
+
+    async def show_subscription(self, seller):
+        try:
+            async with self.pool.acquire() as conn:
+                plan = await conn.fetchrow(STATEMENTS.sql("plan_by_id"), int(seller.plan_id))
+            print("#|Name|Max Sessions")
+            print(f"{plan[0]}|{plan[1]}|{plan[2]}")
+            return True, CMD_EXECUTION_SUCCESS
+        except Exception as e:
+            return False, CMD_EXECUTION_FAILED
+
+    async def change_stock(self, seller, product_id, change_amount):
+        async def body(conn):
+            status = await conn.execute(STATEMENTS.sql("change_stock"), change_amount, product_id, seller.seller_id)
+            if status == "UPDATE 0":
+                return False, CMD_EXECUTION_FAILED
+            return True, CMD_EXECUTION_SUCCESS
+
+        return await self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
+
+    async def subscribe(self, seller, plan_id):
+        async def body(conn):
+            current_plan = await conn.fetchrow(STATEMENTS.sql("plan_by_id"), int(seller.plan_id))
+            new_plan = await conn.fetchrow(STATEMENTS.sql("plan_by_id"), int(plan_id))
+            if new_plan[2] < current_plan[2]:
+                return None, SUBSCRIBE_MAX_PARALLEL_SESSIONS_UNAVAILABLE
+            await conn.execute(STATEMENTS.sql("change_plan"), int(plan_id), seller.seller_id)
+            return Seller(seller.seller_id, seller.session_count, plan_id, session_token=seller.session_token), CMD_EXECUTION_SUCCESS
+
+        return await self._run_transaction(body, failure=(None, CMD_EXECUTION_FAILED))
+
+    async def ship(self, order_ids):
+        order_ids = sorted(set(order_ids))
+
+        async def body(conn):
+            found = await conn.fetch(STATEMENTS.sql("lock_orders"), order_ids)
+            if len(found) < len(order_ids):
+                return False, CMD_EXECUTION_FAILED
+
+            line_count, reserved_count = await reserve_stocks(conn, "orders", order_ids)
+            if reserved_count < line_count:
+                return False, CMD_EXECUTION_FAILED
+
+            await conn.execute(STATEMENTS.sql("ship_orders"), order_ids)
+            return True, CMD_EXECUTION_SUCCESS
+
+        return await self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
+
+    async def show_cart(self, customer_id):
+        try:
+            async with self.pool.acquire() as conn:
+                order_id = await conn.fetchval(STATEMENTS.sql("find_cart_order"), customer_id)
+                if order_id is None:
+                    return False, CMD_EXECUTION_FAILED
+                cart_items = await conn.fetch(STATEMENTS.sql("cart_items"), order_id)
+            lines = ["Order Id|Seller Id|Product Id|Amount"]
+            lines.extend(f"{item[0]}|{item[1]}|{item[2]}|{item[3]}" for item in cart_items)
+            print("\n".join(lines))
+            return True, CMD_EXECUTION_SUCCESS
+        except Exception as e:
+            return False, CMD_EXECUTION_FAILED
+
+    async def change_cart(self, customer_id, product_id, seller_id, change_amount):
+        async def body(conn):
+            order_id = await conn.fetchval(STATEMENTS.sql("lock_cart_order"), customer_id)
+            if order_id is None:
+                order_id = await conn.fetchval(STATEMENTS.sql("create_cart_order"), customer_id)
+
+            product_weight = await conn.fetchrow(STATEMENTS.sql("product_weight"), product_id)
+            product_weight = product_weight[0] or 0
+
+            if change_amount > 0:
+                stock_count = await conn.fetchval(STATEMENTS.sql("stock_count"), product_id, seller_id)
+                if stock_count < change_amount:
+                    return False, STOCK_UNAVAILABLE
+
+                status = await conn.execute(
+                    STATEMENTS.sql("add_cart_totals"),
+                    product_weight * change_amount, change_amount, order_id, MAX_CART_WEIGHT
+                )
+                if status == "UPDATE 0":
+                    return False, WEIGHT_LIMIT
+
+                await conn.execute(STATEMENTS.sql("add_cart_item"), order_id, product_id, seller_id, change_amount)
+
+            elif change_amount < 0:
+                new_amount = await conn.fetchval(STATEMENTS.sql("remove_cart_item"), change_amount, order_id, product_id, seller_id)
+                if new_amount is not None:
+                    removed_amount = new_amount - change_amount - max(new_amount, 0)
+                    await conn.execute(STATEMENTS.sql("delete_empty_cart_item"), order_id, product_id, seller_id)
+                    await conn.execute(STATEMENTS.sql("remove_cart_totals"), product_weight * removed_amount, removed_amount, order_id)
+
+            return True, CMD_EXECUTION_SUCCESS
+
+        return await self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
+
+    async def purchase_cart(self, customer_id):
+        async def body(conn):
+            order_id = await conn.fetchval(STATEMENTS.sql("lock_cart_order"), customer_id)
+            if order_id is None:
+                return False, EMPTY_CART
+
+            line_count, reserved_count = await reserve_stocks(conn, "cart", order_id)
+            if line_count == 0:
+                return False, EMPTY_CART
+            if reserved_count < line_count:
+                return False, STOCK_UNAVAILABLE
+
+            await conn.execute(STATEMENTS.sql("receive_order"), order_id)
+            return True, CMD_EXECUTION_SUCCESS
+
+        return await self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
@@ -0,0 +1,202 @@
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+
+"""
+    Notification channel of the triggers of migrations/0003_metadata_notify.sql.
+    Payloads are "<table>:<key>", e.g. "plans:2" or "products:93a76885-...".
+"""
+METADATA_CHANNEL = "metadata_changed"
+
+
+"""
+    Thread-safe read-through cache with per-entry expiry and least-recently-used eviction.
+    - Entries expire ttl seconds after they were loaded; ttl <= 0 disables expiry.
+    - When more than maxsize entries are cached, the least recently used one is evicted.
+    - get(key, loader) returns the cached value or calls loader() and caches its result. None is not cached.
+"""
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (value, loaded_at), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        # bumped by every invalidation; a value loaded while it changed may be stale and is not cached
+        self._generation = 0
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self.ttl <= 0 or now - entry[1] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[0]
+                del self._entries[key]
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            generation = self._generation
+
+        # load outside the lock, a slow query must not block hits on other keys
+        value = loader()
+        if value is None:
+            return None
+
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(key, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+
+    """
+        Returns hit/miss/eviction/expiration/invalidation counters and the current size.
+    """
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+            return stats
+
+
+"""
+    Cache of the rarely changing plans and products rows used by Mp2Client.
+    - plans are cached by plan_id, the full plan list under ALL_PLANS; products by product_id as (weight, price).
+    - Invalidation comes from LISTEN on METADATA_CHANNEL over a dedicated autocommit connection. Pending
+      notifications are drained before every lookup, so no background thread is needed.
+    - Without a listener connection (listen=False, or the migration is missing) entries only expire by ttl.
+    - One instance can be shared by many Mp2Client objects and threads.
+"""
+class MetadataCache:
+    ALL_PLANS = "*"
+
+    def __init__(self, plan_ttl=300.0, product_ttl=300.0, maxsize=1024):
+        self.plans = TTLCache(maxsize=maxsize, ttl=plan_ttl)
+        self.products = TTLCache(maxsize=maxsize, ttl=product_ttl)
+        self.listen_conn = None
+        self._listen_lock = threading.Lock()
+        self._notifications = 0
+
+    """
+        Opens the listener connection. Returns True if notifications are received from now on.
+    """
+    def listen(self, conn_params):
+        try:
+            conn = psycopg2.connect(**conn_params)
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("LISTEN %s" % METADATA_CHANNEL)
+        except psycopg2.Error:
+            return False
+        self.listen_conn = conn
+        # anything cached before LISTEN may have missed its notification
+        self.plans.clear()
+        self.products.clear()
+        return True
+
+    def close(self):
+        with self._listen_lock:
+            if self.listen_conn is not None:
+                self.listen_conn.close()
+                self.listen_conn = None
+
+    """
+        Applies every pending notification without blocking.
+        If the listener connection breaks, everything is dropped and the cache falls back to ttl expiry.
+    """
+    def poll(self):
+        if self.listen_conn is None:
+            return
+        with self._listen_lock:
+            conn = self.listen_conn
+            if conn is None:
+                return
+            try:
+                if select.select([conn], [], [], 0)[0] or conn.notifies:
+                    conn.poll()
+                notifies = list(conn.notifies)
+                conn.notifies.clear()
+                self._notifications += len(notifies)
+            except (psycopg2.Error, ValueError, OSError):
+                conn.close()
+                self.listen_conn = None
+                self.plans.clear()
+                self.products.clear()
+                return
+
+        for notify in notifies:
+            table, _, key = notify.payload.partition(":")
+            if table == "plans":
+                self.plans.invalidate(self.ALL_PLANS)
+                if key.isdigit():
+                    self.plans.invalidate(int(key))
+                else:
+                    self.plans.clear()
+            elif table == "products":
+                self.products.invalidate(key)
+
+    """
+        Returns (plan_id, name, max_parallel_sessions) of a plan, loader() runs the query on a cache miss.
+    """
+    def plan(self, plan_id, loader):
+        self.poll()
+        return self.plans.get(int(plan_id), loader)
+
+    """
+        Returns the list of all plans, loader() runs the query on a cache miss.
+    """
+    def all_plans(self, loader):
+        self.poll()
+        return self.plans.get(self.ALL_PLANS, loader)
+
+    """
+        Returns (weight, price) of a product, loader() runs the query on a cache miss.
+    """
+    def product(self, product_id, loader):
+        self.poll()
+        return self.products.get(product_id, loader)
+
+    def stats(self):
+        return {
+            "plans": self.plans.stats(),
+            "products": self.products.stats(),
+            "notifications": self._notifications,
+            "listening": self.listen_conn is not None,
+        }
+
+
+"""
+    Builds a MetadataCache from the [cache] section of the configuration file and starts listening
+    unless listen is false.
+"""
+def create_cache(conn_params, cache_params):
+    cache = MetadataCache(
+        plan_ttl=float(cache_params.get("plan_ttl", 300)),
+        product_ttl=float(cache_params.get("product_ttl", 300)),
+        maxsize=int(cache_params.get("maxsize", 1024)),
+    )
+    if cache_params.get("listen", "true").lower() in ("1", "true", "yes", "on"):
+        cache.listen(conn_params)
+    return cache
@@ -0,0 +1,215 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from cache import TTLCache
+
+
+"""
+    In-memory state of a customer's 'CREATED' cart.
+    - lines maps (product_id, seller_id) to the amount in the cart, weight is the running cart weight.
+    - order_id is generated locally for new carts; the order row is written by the first flush.
+    - dirty carts have changes that are not in shopping_carts yet. version is bumped by every change, so a
+      flush only marks the cart clean if nothing changed while it was written.
+"""
+class Cart:
+    def __init__(self, customer_id, order_id=None, lines=None, weight=0.0, persisted=False):
+        self.customer_id = customer_id
+        self.order_id = order_id or str(uuid.uuid4())
+        self.lines = dict(lines or {})
+        self.weight = weight
+        self.persisted = persisted
+        self.dirty = False
+        self.version = 0
+        self.changed_at = None
+        self.lock = threading.Lock()
+
+    def change(self, product_id, seller_id, change_amount, product_weight):
+        key = (product_id, seller_id)
+        amount = self.lines.get(key, 0)
+        new_amount = max(amount + change_amount, 0)
+        if new_amount > 0:
+            self.lines[key] = new_amount
+        else:
+            self.lines.pop(key, None)
+        self.weight = max(self.weight + product_weight * (new_amount - amount), 0)
+        self.dirty = True
+        self.version += 1
+        self.changed_at = time.monotonic()
+
+    """
+        Returns (version, order_id, list of (product_id, seller_id, amount)) to be written by a flush.
+    """
+    def snapshot(self):
+        return self.version, self.order_id, [(product_id, seller_id, amount) for (product_id, seller_id), amount in self.lines.items()]
+
+    def flushed(self, version, order_id):
+        self.order_id = order_id
+        self.persisted = True
+        if self.version == version:
+            self.dirty = False
+
+
+"""
+    Write-behind store of 'CREATED' carts keyed by customer, shared by the Mp2Client objects of a process.
+    - At most maxsize carts are kept; adding one more evicts the least recently used cart. Evicted dirty
+      carts are returned to the caller, which should flush them, and stay pending until a flush wrote them:
+      get() and peek() still return a pending cart and the background flusher retries failed flushes.
+    - Dirty carts unchanged for flush_interval seconds are written by the background flusher (start()).
+    - Stock counts used by change_cart are snapshots, cached for stock_ttl seconds; product weights come from
+      the client's metadata cache. purchase_cart writes the cart and re-validates it against the database.
+    - The store assumes that this process is the only writer of its customers' carts; changes made to
+      shopping_carts by other processes while a cart is cached are overwritten by the next flush.
+"""
+class CartStore:
+    def __init__(self, maxsize=10000, flush_interval=5.0, stock_ttl=2.0):
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.stocks = TTLCache(maxsize=maxsize * 4, ttl=stock_ttl)
+        self._carts = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "flushes": 0, "flush_failures": 0}
+        self._flusher = None
+        self._stopped = threading.Event()
+
+    """
+        Returns the cart of the customer; loader(customer_id) loads it on a miss and returns a Cart or None
+        for a customer without a cart. Returns (cart, list of evicted dirty carts).
+    """
+    def get(self, customer_id, loader):
+        with self._lock:
+            cart = self._carts.get(customer_id)
+            if cart is not None:
+                self._carts.move_to_end(customer_id)
+                self._stats["hits"] += 1
+                return cart, []
+            # an evicted cart that is not written yet is newer than its rows in the database
+            cart = self._pending.pop(customer_id, None)
+            if cart is not None:
+                self._stats["hits"] += 1
+                return cart, self._insert(cart)
+            self._stats["misses"] += 1
+
+        cart = loader(customer_id) or Cart(customer_id)
+
+        with self._lock:
+            # a parallel get may have loaded the cart meanwhile, and it may have been evicted since
+            existing = self._carts.get(customer_id)
+            if existing is not None:
+                return existing, []
+            existing = self._pending.pop(customer_id, None)
+            if existing is not None:
+                return existing, self._insert(existing)
+            return cart, self._insert(cart)
+
+    """
+        Adds the cart as most recently used and evicts the least recently used carts above maxsize; dirty ones
+        are kept pending. Returns the evicted dirty carts. Called with the store lock held.
+    """
+    def _insert(self, cart):
+        self._carts[cart.customer_id] = cart
+        evicted = []
+        while len(self._carts) > self.maxsize:
+            _, old = self._carts.popitem(last=False)
+            self._stats["evictions"] += 1
+            if old.dirty:
+                self._pending[old.customer_id] = old
+                evicted.append(old)
+        return evicted
+
+    """
+        Returns the cached cart of the customer or None, without loading it.
+    """
+    def peek(self, customer_id):
+        with self._lock:
+            return self._carts.get(customer_id) or self._pending.get(customer_id)
+
+    def discard(self, customer_id):
+        with self._lock:
+            self._carts.pop(customer_id, None)
+            self._pending.pop(customer_id, None)
+
+    """
+        Returns the dirty carts unchanged for flush_interval seconds, or all dirty carts if force is set.
+        Pending evicted carts are always due.
+    """
+    def due(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            return list(self._pending.values()) + [
+                cart for cart in self._carts.values()
+                if cart.dirty and (force or now - cart.changed_at >= self.flush_interval)
+            ]
+
+    """
+        Writes the cart with write(cart_snapshot) -> order_id and marks it clean. Returns True on success.
+    """
+    def flush(self, cart, write):
+        with cart.lock:
+            version, order_id, lines = cart.snapshot()
+        order_id = write(cart.customer_id, order_id, lines)
+
+        with self._lock:
+            self._stats["flushes" if order_id else "flush_failures"] += 1
+        if not order_id:
+            return False
+        with cart.lock:
+            cart.flushed(version, order_id)
+        with self._lock:
+            # a change made through an older reference while the cart was pending keeps it pending
+            if self._pending.get(cart.customer_id) is cart and not cart.dirty:
+                del self._pending[cart.customer_id]
+        return True
+
+    """
+        Starts the background flusher. connect() opens the flusher's own connection, write(conn, customer_id,
+        order_id, lines) writes one cart on it and returns its order_id, or None if it failed.
+    """
+    def start(self, connect, write):
+        if self._flusher is not None:
+            return
+
+        def run():
+            conn = connect()
+            try:
+                while not self._stopped.wait(self.flush_interval / 2):
+                    for cart in self.due():
+                        self.flush(cart, lambda *args: write(conn, *args))
+                # flush whatever is left when the store is closed
+                for cart in self.due(force=True):
+                    self.flush(cart, lambda *args: write(conn, *args))
+            finally:
+                conn.close()
+
+        self._flusher = threading.Thread(target=run, name="cart-store-flusher", daemon=True)
+        self._flusher.start()
+
+    """
+        Stops the flusher after it wrote every dirty cart.
+    """
+    def close(self):
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._carts)
+            stats["dirty"] = sum(1 for cart in self._carts.values() if cart.dirty)
+            stats["pending"] = len(self._pending)
+            return stats
+
+
+"""
+    Builds a CartStore from the [cart_store] section of the configuration file.
+"""
+def create_cart_store(cart_store_params):
+    return CartStore(
+        maxsize=int(cart_store_params.get("maxsize", 10000)),
+        flush_interval=float(cart_store_params.get("flush_interval", 5)),
+        stock_ttl=float(cart_store_params.get("stock_ttl", 2)),
+    )
@@ -1,7 +1,7 @@
 from configparser import ConfigParser
 
 
-def read_config(filename="database.cfg", section="postgresql"):
+def read_config(filename="database.cfg", section="postgresql", required=True):
     # create a parser
     parser = ConfigParser()
     # read config file
@@ -13,7 +13,7 @@ def read_config(filename="database.cfg", section="postgresql"):
         params = parser.items(section)
         for param in params:
             db[param[0]] = param[1]
-    else:
+    elif required:
         raise Exception('Section {0} not found in the {1} file'.format(section, filename))
 
     return db
@@ -0,0 +1,114 @@
+import uuid
+
+from psycopg2.extras import execute_values
+
+
+FIXTURE_CATEGORY_ID = 352000
+FIXTURE_PLAN_ID = 352000
+
+
+"""
+    Returns a short unique prefix for fixture ids so that concurrent benchmark runs do not collide.
+    Every id stays within the varchar(36) columns of construct_db.sql.
+"""
+def new_prefix(name):
+    return "%s-%s" % (name[:8], uuid.uuid4().hex[:8])
+
+
+"""
+    Seeds a catalog of sellers, products, stocks and customers whose ids all start with prefix.
+    - Every seller stocks every product with stock_count items.
+    - Returns a dict with the created sellers, products and customers.
+"""
+def seed_catalog(conn, prefix, seller_count=1, product_count=10, customer_count=1, stock_count=1000000, product_weight=0.01, max_parallel_sessions=1000):
+    sellers = ["%s-s%d" % (prefix, i) for i in range(seller_count)]
+    products = ["%s-p%d" % (prefix, i) for i in range(product_count)]
+    customers = ["%s-c%d" % (prefix, i) for i in range(customer_count)]
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO product_category (category_id, name) VALUES (%s, 'benchmark') ON CONFLICT DO NOTHING",
+            (FIXTURE_CATEGORY_ID,)
+        )
+        cursor.execute(
+            "INSERT INTO plans (plan_id, name, max_parallel_sessions) VALUES (%s, 'benchmark', %s) "
+            "ON CONFLICT (plan_id) DO UPDATE SET max_parallel_sessions = EXCLUDED.max_parallel_sessions",
+            (FIXTURE_PLAN_ID, max_parallel_sessions)
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO sellers (seller_id, password, session_count, plan_id) VALUES %s",
+            [(seller_id, "password", 0, FIXTURE_PLAN_ID) for seller_id in sellers]
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO products (product_id, name, category_id, weight, price) VALUES %s",
+            [(product_id, product_id, FIXTURE_CATEGORY_ID, product_weight, 1) for product_id in products]
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO stocks (product_id, seller_id, stock_count) VALUES %s",
+            [(product_id, seller_id, stock_count) for product_id in products for seller_id in sellers]
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO customers (customer_id, name, surname, address, state, gender) VALUES %s",
+            [(customer_id, "bench", "bench", "benchmark", "NA", None) for customer_id in customers]
+        )
+    conn.commit()
+
+    return {"sellers": sellers, "products": products, "customers": customers}
+
+
+"""
+    Creates a CREATED order for the customer with the given (product_id, seller_id, amount) items.
+    Returns the new order id.
+"""
+def create_cart(conn, customer_id, items):
+    order_id = str(uuid.uuid4())
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO orders (order_id, customer_id, status) VALUES (%s, %s, 'CREATED')",
+            (order_id, customer_id)
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO shopping_carts (order_id, product_id, seller_id, amount) VALUES %s",
+            [(order_id, product_id, seller_id, amount) for product_id, seller_id, amount in items]
+        )
+    conn.commit()
+    return order_id
+
+
+"""
+    Deletes everything seeded with the given prefix. Orders and cart lines are removed by cascade.
+"""
+def cleanup(conn, prefix):
+    pattern = prefix + "-%"
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM customers WHERE customer_id LIKE %s", (pattern,))
+        cursor.execute("DELETE FROM products WHERE product_id LIKE %s", (pattern,))
+        cursor.execute("DELETE FROM sellers WHERE seller_id LIKE %s", (pattern,))
+    conn.commit()
+
+
+"""
+    Creates count CREATED orders for the customer, each with the given (product_id, seller_id, amount) items,
+    in a single transaction. Returns the new order ids.
+"""
+def create_carts(conn, customer_id, items, count):
+    order_ids = [str(uuid.uuid4()) for _ in range(count)]
+    with conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            "INSERT INTO orders (order_id, customer_id, status) VALUES %s",
+            [(order_id, customer_id, "CREATED") for order_id in order_ids]
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO shopping_carts (order_id, product_id, seller_id, amount) VALUES %s",
+            [(order_id, product_id, seller_id, amount) for order_id in order_ids for product_id, seller_id, amount in items],
+            page_size=1000
+        )
+    conn.commit()
+    return order_ids
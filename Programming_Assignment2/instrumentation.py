@@ -0,0 +1,339 @@
+import bisect
+import functools
+import logging
+import sys
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import errorcodes
+
+
+"""
+    Upper bounds in seconds of the latency histograms.
+"""
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+"""
+    Upper bounds of the round trip and row count histograms.
+"""
+COUNT_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 1000, 10000]
+
+"""
+    Public Mp2Client operations wrapped by instrument_client.
+"""
+OPERATIONS = [
+    "sign_up", "sign_in", "sign_out", "quit", "show_plans", "show_subscription", "change_stock", "subscribe",
+    "ship", "ship_orders", "show_cart", "change_cart", "purchase_cart", "heartbeat", "reap_sessions",
+]
+
+SLOW_LOGGER = logging.getLogger("mp2.slow")
+
+
+"""
+    Cumulative histogram with fixed bucket upper bounds, like a Prometheus histogram.
+"""
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    """
+        Returns the approximate q-quantile (0 <= q <= 1), the upper bound of the bucket it falls into.
+    """
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        return {"buckets": list(zip(self.buckets + [float("inf")], self.counts)), "sum": self.total, "count": self.count}
+
+
+"""
+    Thread-safe in-process registry of counters and histograms.
+    - Metrics are identified by name and a tuple of (label, value) pairs.
+    - snapshot() returns plain dicts, prometheus_text() the Prometheus text exposition format.
+"""
+class MetricsRegistry:
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._cursor_class = None
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def counter(self, name, labels=()):
+        with self._lock:
+            return self._counters.get((name, tuple(labels)), 0)
+
+    def histogram(self, name, labels=()):
+        with self._lock:
+            return self._histograms.get((name, tuple(labels)))
+
+    """
+        Returns the cursor class that reports the statements it runs to this registry.
+    """
+    def cursor_class(self):
+        with self._lock:
+            if self._cursor_class is None:
+                self._cursor_class = type("InstrumentedCursor", (InstrumentedCursor,), {"registry": self})
+            return self._cursor_class
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": {key: value for key, value in self._counters.items()},
+                "histograms": {key: histogram.snapshot() for key, histogram in self._histograms.items()},
+            }
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            for name in sorted(set(key[0] for key in self._counters)):
+                lines.append("# TYPE %s counter" % name)
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append("%s%s %s" % (name, format_labels(labels), value))
+
+            for name in sorted(set(key[0] for key in self._histograms)):
+                lines.append("# TYPE %s histogram" % name)
+                for (metric, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + [float("inf")], histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append("%s_bucket%s %d" % (name, format_labels(labels + (("le", le),)), cumulative))
+                    lines.append("%s_sum%s %r" % (name, format_labels(labels), histogram.total))
+                    lines.append("%s_count%s %d" % (name, format_labels(labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+    return "{%s}" % ",".join('%s="%s"' % (label, value) for (label, _), value in zip(labels, escaped))
+
+
+"""
+    Measurements of the operation running in the current thread.
+"""
+class OperationContext:
+    def __init__(self, name):
+        self.name = name
+        self.db_time = 0.0
+        self.round_trips = 0
+        self.rows = 0
+        self.retries = 0
+        self.failure = None
+
+
+_current = threading.local()
+
+
+def current_operation():
+    return getattr(_current, "operation", None)
+
+
+"""
+    Counts a retry of the current operation and forgets the failure that caused it.
+    Does nothing outside an instrumented operation.
+"""
+def record_retry():
+    operation = current_operation()
+    if operation is not None:
+        operation.retries += 1
+        operation.failure = None
+
+
+"""
+    Records the exception that made the current operation fail: the SQLSTATE condition name for
+    database errors, the exception class otherwise.
+"""
+def record_failure(error):
+    operation = current_operation()
+    if operation is not None:
+        operation.failure = failure_cause(error)
+
+
+def failure_cause(error):
+    pgcode = getattr(error, "pgcode", None)
+    if pgcode:
+        try:
+            return errorcodes.lookup(pgcode).lower()
+        except KeyError:
+            return pgcode
+    return type(error).__name__
+
+
+"""
+    Returns a short label of a SQL string: the statement name for EXECUTE, otherwise the leading keyword.
+"""
+def statement_label(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    words = str(query).split(None, 2)
+    if not words:
+        return "empty"
+    if words[0].upper() == "EXECUTE" and len(words) > 1:
+        return words[1].split("(")[0]
+    return words[0].lower()
+
+
+"""
+    Cursor that times every statement and counts its round trip and rows.
+    - Measurements are added to the operation running in the current thread, if any.
+    - The mp2_sql_seconds histogram of the cursor's registry gets one observation per statement.
+"""
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    registry = None
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception as e:
+            record_failure(e)
+            raise
+        finally:
+            self._record(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        except Exception as e:
+            record_failure(e)
+            raise
+        finally:
+            self._record(query, time.perf_counter() - started)
+
+    def _record(self, query, elapsed):
+        operation = current_operation()
+        if operation is not None:
+            operation.db_time += elapsed
+            operation.round_trips += 1
+            operation.rows += max(self.rowcount, 0)
+        if self.registry is not None:
+            self.registry.observe("mp2_sql_seconds", elapsed, (("statement", statement_label(query)),))
+
+
+"""
+    Wraps fn as the named operation.
+    - Wall time, DB time, round trips, rows, retries and the outcome are recorded in the registry.
+    - An operation succeeded when its result tuple starts with a truthy value. A failure is labelled with the
+      recorded exception cause, or with the returned message when the operation failed without an exception.
+    - Operations slower than slow_threshold seconds are logged on SLOW_LOGGER.
+    - Nested operations (quit calling sign_out) are measured as part of the outermost one.
+"""
+def instrument(fn, name, registry, slow_threshold=None):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if current_operation() is not None:
+            return fn(*args, **kwargs)
+
+        operation = _current.operation = OperationContext(name)
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            record_failure(e)
+            result = None
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.operation = None
+            record_operation(registry, operation, elapsed, result, slow_threshold)
+        return result
+
+    return wrapper
+
+
+def record_operation(registry, operation, elapsed, result, slow_threshold):
+    labels = (("operation", operation.name),)
+    if isinstance(result, tuple):
+        succeeded = bool(result[0])
+        cause = operation.failure or (result[1] if len(result) > 1 and isinstance(result[1], str) else "failed")
+    else:
+        succeeded = result is not None and result is not False
+        cause = operation.failure or "failed"
+
+    registry.observe("mp2_operation_seconds", elapsed, labels)
+    registry.observe("mp2_operation_db_seconds", operation.db_time, labels)
+    registry.observe("mp2_operation_round_trips", operation.round_trips, labels, buckets=COUNT_BUCKETS)
+    registry.observe("mp2_operation_rows", operation.rows, labels, buckets=COUNT_BUCKETS)
+    registry.inc("mp2_operation_retries_total", labels, operation.retries)
+    registry.inc("mp2_operations_total", labels + (("outcome", "success" if succeeded else "failure"),))
+    if not succeeded:
+        registry.inc("mp2_operation_failures_total", labels + (("cause", cause),))
+
+    if slow_threshold is not None and elapsed >= slow_threshold:
+        SLOW_LOGGER.warning(
+            "slow %s: %.1f ms (db %.1f ms, %d round trips, %d rows, %d retries, %s)",
+            operation.name, elapsed * 1000, operation.db_time * 1000, operation.round_trips,
+            operation.rows, operation.retries, "ok" if succeeded else cause
+        )
+
+
+"""
+    Wraps every operation of OPERATIONS on the client object with instrument().
+"""
+def instrument_client(client, registry, slow_threshold=None):
+    for name in OPERATIONS:
+        method = getattr(client, name, None)
+        if method is not None:
+            setattr(client, name, instrument(method, name, registry, slow_threshold))
+
+
+"""
+    Sends slow command log lines to path, or to stderr when path is empty.
+"""
+def configure_slow_log(path=""):
+    if SLOW_LOGGER.handlers:
+        return
+    handler = logging.FileHandler(path) if path else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    SLOW_LOGGER.addHandler(handler)
+    SLOW_LOGGER.setLevel(logging.WARNING)
+    SLOW_LOGGER.propagate = False
+
+
+"""
+    Metrics registry shared by the Mp2Client objects of this process.
+"""
+REGISTRY = MetricsRegistry()
@@ -1,4 +1,11 @@
-from mp2 import Mp2Client, tokenize_command
+import argparse
+import bisect
+import sys
+import time
+
+from psycopg2.extensions import TransactionRollbackError
+
+from mp2 import SHIP_PER_ORDER, Mp2Client, tokenize_command
 from validators import *
 
 AUTH_SELLER = None
@@ -23,256 +30,406 @@ def print_seller_info(seller):
         print(ANON_SELLER, end=" > ")
 
 
-def main():
-    global AUTH_SELLER, POSTGRESQL_CONFIG_FILE_NAME
+"""
+    Keeps the signed in seller's session alive; an expired session may have been reaped or taken over.
+    In batch mode it must run before begin_command(), outside the savepoint of the command.
+"""
+def keep_session_alive(client):
+    global AUTH_SELLER
 
-    client = Mp2Client(config_filename=POSTGRESQL_CONFIG_FILE_NAME)
-    client.help()
+    if AUTH_SELLER:
+        with client.borrow():
+            session_alive = client.heartbeat(seller=AUTH_SELLER)
 
-    while True:
-        # print customer information if signed in
-        print_seller_info(seller=AUTH_SELLER)
+        if not session_alive:
+            AUTH_SELLER = None
+            print_error_msg(messages.USER_SESSION_EXPIRED)
 
-        # get new command from user
-        cmd_text = input()
-        cmd_tokens = tokenize_command(cmd_text)
-        cmd = cmd_tokens[0] if len(cmd_tokens) > 0 else ""
 
-        if cmd == "help":
-            client.help()
+"""
+    Runs one tokenized command on the client.
+    Returns False if the program should quit, True otherwise.
+"""
+def execute_command(client, cmd_tokens):
+    global AUTH_SELLER
 
-        elif cmd == "sign_up":
-            # validate command
-            validation_result, validation_message = sign_up_validator(AUTH_SELLER, cmd_tokens)
+    cmd = cmd_tokens[0] if len(cmd_tokens) > 0 else ""
 
-            if validation_result:
-                client.connect()
-                _, arg_seller_id, arg_password, arg_plan_id = cmd_tokens
+    # run_batch sends the heartbeat itself, in its own savepoint before the command's savepoint is opened
+    if cmd != "" and not client.in_batch:
+        keep_session_alive(client)
 
-                # sign up
-                exec_success, exec_message = client.sign_up(seller_id=arg_seller_id, password=arg_password, plan_id=arg_plan_id)
+    if cmd == "help":
+        client.help()
+
+    elif cmd == "sign_up":
+        # validate command
+        validation_result, validation_message = sign_up_validator(AUTH_SELLER, cmd_tokens)
 
-                client.disconnect()
+        if validation_result:
+            _, arg_seller_id, arg_password, arg_plan_id = cmd_tokens
 
-                # print message
-                if exec_success:
-                    print_success_msg(exec_message)
-                else:
-                    print_error_msg(exec_message)
+            # sign up
+            with client.borrow():
+                exec_success, exec_message = client.sign_up(seller_id=arg_seller_id, password=arg_password, plan_id=arg_plan_id)
 
+            # print message
+            if exec_success:
+                print_success_msg(exec_message)
             else:
-                print_error_msg(validation_message)
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
 
-        elif cmd == "sign_in":
-            # validate command
-            validation_result, validation_message = sign_in_validator(AUTH_SELLER, cmd_tokens)
+    elif cmd == "sign_in":
+        # validate command
+        validation_result, validation_message = sign_in_validator(AUTH_SELLER, cmd_tokens)
 
-            if validation_result:
-                _, arg_seller_id, arg_password = cmd_tokens
+        if validation_result:
+            _, arg_seller_id, arg_password = cmd_tokens
 
-                client.connect()
+            with client.borrow():
                 seller, exec_message = client.sign_in(seller_id=arg_seller_id, password=arg_password)
 
-                if seller:
-                    AUTH_SELLER = seller
-                    print_success_msg(exec_message)
-                else:
-                    print_error_msg(exec_message)
-
+            if seller:
+                AUTH_SELLER = seller
+                print_success_msg(exec_message)
             else:
-                print_error_msg(validation_message)
+                print_error_msg(exec_message)
 
-        elif cmd == "sign_out":
-            # validate command
-            validation_result, validation_message = basic_validator(AUTH_SELLER, cmd_tokens)
+        else:
+            print_error_msg(validation_message)
 
-            if validation_result:
-                exec_success, exec_message = client.sign_out(seller=AUTH_SELLER)
+    elif cmd == "sign_out":
+        # validate command
+        validation_result, validation_message = basic_validator(AUTH_SELLER, cmd_tokens)
 
-                if exec_success:
-                    AUTH_SELLER = None
-                    client.disconnect()
-                    print_success_msg(exec_message)
+        if validation_result:
+            with client.borrow():
+                exec_success, exec_message = client.sign_out(seller=AUTH_SELLER)
 
-                else:
-                    print_error_msg(exec_message)
+            if exec_success:
+                AUTH_SELLER = None
+                print_success_msg(exec_message)
 
             else:
-                print_error_msg(validation_message)
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
 
-        elif cmd == "quit":
-            # validate command
-            validation_result, validation_message = quit_validator(cmd_tokens)
+    elif cmd == "quit":
+        # validate command
+        validation_result, validation_message = quit_validator(cmd_tokens)
 
-            if validation_result:
+        if validation_result:
 
+            with client.borrow():
                 exec_success, exec_message = client.quit(seller=AUTH_SELLER)
 
-                if exec_success:
-                    break
-                else:
-                    print_error_msg(exec_message)
-
+            if exec_success:
+                return False
             else:
-                print_error_msg(validation_message)
+                print_error_msg(exec_message)
 
-        elif cmd == "show_plans":
-            # validate command
-            validation_result, validation_message = basic_validator(AUTH_SELLER, cmd_tokens)
+        else:
+            print_error_msg(validation_message)
 
-            if validation_result:
-                exec_success, exec_message = client.show_plans()
+    elif cmd == "show_plans":
+        # validate command
+        validation_result, validation_message = basic_validator(AUTH_SELLER, cmd_tokens)
 
-                if not exec_success:
-                    print_error_msg(exec_message)
+        if validation_result:
+            with client.borrow():
+                exec_success, exec_message = client.show_plans()
 
-            else:
-                print_error_msg(validation_message)
-        
-        elif cmd == "show_subscription":
-            # validate command
-            validation_result, validation_message = basic_validator(AUTH_SELLER, cmd_tokens)
+            if not exec_success:
+                print_error_msg(exec_message)
 
-            if validation_result:
+        else:
+            print_error_msg(validation_message)
+    
+    elif cmd == "show_subscription":
+        # validate command
+        validation_result, validation_message = basic_validator(AUTH_SELLER, cmd_tokens)
+
+        if validation_result:
+            with client.borrow():
                 exec_success, exec_message = client.show_subscription(seller=AUTH_SELLER)
 
-                if not exec_success:
-                    print_error_msg(exec_message)
+            if not exec_success:
+                print_error_msg(exec_message)
 
+        else:
+            print_error_msg(validation_message)
+    
+    elif cmd == "change_stock":
+        # validate command
+        validation_result, validation_message = change_stock_validator(AUTH_SELLER, cmd_tokens)
+
+        if validation_result:
+            _, arg_product_id, arg_op, arg_change = cmd_tokens
+
+            if arg_op == "add":
+                arg_change = int(arg_change)
+            elif arg_op == "remove":
+                arg_change = -1 * int(arg_change)
             else:
-                print_error_msg(validation_message)
-        
-        elif cmd == "change_stock":
-            # validate command
-            validation_result, validation_message = change_stock_validator(AUTH_SELLER, cmd_tokens)
-
-            if validation_result:
-                _, arg_product_id, arg_op, arg_change = cmd_tokens
-
-                if arg_op == "add":
-                    arg_change = int(arg_change)
-                elif arg_op == "remove":
-                    arg_change = -1 * int(arg_change)
-                else:
-                    print_error_msg(messages.CMD_UNDEFINED)
+                print_error_msg(messages.CMD_UNDEFINED)
 
+            with client.borrow():
                 exec_success, exec_message = client.change_stock(seller=AUTH_SELLER, product_id=arg_product_id, change_amount=arg_change)
 
-                if exec_success:
-                    print_success_msg(exec_message)
-                else:
-                    print_error_msg(exec_message)
-
+            if exec_success:
+                print_success_msg(exec_message)
             else:
-                print_error_msg(validation_message)
+                print_error_msg(exec_message)
 
-        elif cmd == "subscribe":
-            # validate command
-            validation_result, validation_message = subscribe_validator(AUTH_SELLER, cmd_tokens)
+        else:
+            print_error_msg(validation_message)
 
-            if validation_result:
-                _, arg_plan_id = cmd_tokens
+    elif cmd == "subscribe":
+        # validate command
+        validation_result, validation_message = subscribe_validator(AUTH_SELLER, cmd_tokens)
 
-                seller, exec_message = client.subscribe(seller=AUTH_SELLER, plan_id=arg_plan_id)
+        if validation_result:
+            _, arg_plan_id = cmd_tokens
 
-                if seller:
-                    AUTH_SELLER = seller
-                    print_success_msg(exec_message)
+            with client.borrow():
+                seller, exec_message = client.subscribe(seller=AUTH_SELLER, plan_id=arg_plan_id)
 
-                else:
-                    print_error_msg(exec_message)
+            if seller:
+                AUTH_SELLER = seller
+                print_success_msg(exec_message)
 
             else:
-                print_error_msg(validation_message)
+                print_error_msg(exec_message)
 
-        elif cmd == "ship":
-            client.connect()
+        else:
+            print_error_msg(validation_message)
 
-            # validate command
-            validation_result, validation_message = ship_validator(cmd_tokens)
+    elif cmd == "ship":
+        # validate command
+        validation_result, validation_message = ship_validator(cmd_tokens)
 
-            if validation_result:
+        if validation_result:
+            with client.borrow():
                 exec_success, exec_message = client.ship(order_ids=cmd_tokens[1:])
 
-                if exec_success:
-                    print_success_msg(exec_message)
-                else:
-                    print_error_msg(exec_message)
-
+            if exec_success:
+                print_success_msg(exec_message)
             else:
-                print_error_msg(validation_message)
-            
-            client.disconnect()
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
+
+    elif cmd == "ship_partial":
+        # validate command
+        validation_result, validation_message = ship_validator(cmd_tokens)
+
+        if validation_result:
+            with client.borrow():
+                exec_success, report = client.ship_orders(order_ids=cmd_tokens[1:], mode=SHIP_PER_ORDER)
+
+            # print result of every order
+            print("Order Id|Result")
+            for order_id, result in report:
+                print(f"{order_id}|{result}")
 
-        elif cmd == "show_cart":
-            client.connect()
-            # validate command
-            validation_result, validation_message = show_cart_validator(cmd_tokens)
+        else:
+            print_error_msg(validation_message)
+
+    elif cmd == "show_cart":
+        # validate command
+        validation_result, validation_message = show_cart_validator(cmd_tokens)
 
-            if validation_result:
-                _, arg_customer_id = cmd_tokens
+        if validation_result:
+            _, arg_customer_id = cmd_tokens
 
+            with client.borrow():
                 exec_success, exec_message = client.show_cart(customer_id=arg_customer_id)
 
-                if not exec_success:
-                    print_error_msg(exec_message)
+            if not exec_success:
+                print_error_msg(exec_message)
 
+        else:
+            print_error_msg(validation_message)
+    
+    elif cmd == "change_cart":
+        # validate command
+        validation_result, validation_message = change_cart_validator(cmd_tokens)
+
+        if validation_result:
+            _, arg_customer_id, arg_product_id, arg_seller_id, arg_op, arg_change = cmd_tokens
+
+            if arg_op == "add":
+                arg_change = int(arg_change)
+            elif arg_op == "remove":
+                arg_change = -1 * int(arg_change)
             else:
-                print_error_msg(validation_message)
-            
-            client.disconnect()
-        
-        elif cmd == "change_cart":
-            client.connect()
-
-            # validate command
-            validation_result, validation_message = change_cart_validator(cmd_tokens)
-
-            if validation_result:
-                _, arg_customer_id, arg_product_id, arg_seller_id, arg_op, arg_change = cmd_tokens
-
-                if arg_op == "add":
-                    arg_change = int(arg_change)
-                elif arg_op == "remove":
-                    arg_change = -1 * int(arg_change)
-                else:
-                    print_error_msg(messages.CMD_UNDEFINED)
+                print_error_msg(messages.CMD_UNDEFINED)
 
+            with client.borrow():
                 exec_success, exec_message = client.change_cart(customer_id=arg_customer_id, product_id=arg_product_id, seller_id=arg_seller_id, change_amount=arg_change)
 
-                if exec_success:
-                    print_success_msg(exec_message)
-                else:
-                    print_error_msg(exec_message)
-
+            if exec_success:
+                print_success_msg(exec_message)
             else:
-                print_error_msg(validation_message)
-                
-            client.disconnect()
+                print_error_msg(exec_message)
 
-        elif cmd == "purchase_cart":
-            client.connect()
-            # validate command
-            validation_result, validation_message = purchase_cart_validator(cmd_tokens)
+        else:
+            print_error_msg(validation_message)
+
+    elif cmd == "purchase_cart":
+        # validate command
+        validation_result, validation_message = purchase_cart_validator(cmd_tokens)
 
-            if validation_result:
-                _, arg_customer_id = cmd_tokens
+        if validation_result:
+            _, arg_customer_id = cmd_tokens
 
+            with client.borrow():
                 exec_success, exec_message = client.purchase_cart(customer_id=arg_customer_id)
 
-                if not exec_success:
-                    print_error_msg(exec_message)
+            if not exec_success:
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
 
+    elif cmd == "":
+        pass
+
+    else:
+        print_error_msg(messages.CMD_UNDEFINED)
+
+    return True
+
+
+"""
+    Upper bounds in seconds of the latency histogram buckets of the batch summary.
+"""
+LATENCY_BUCKETS = [0.001, 0.01, 0.1, 1.0]
+
+
+"""
+    Runs the commands of stream (one per line, lines starting with # are skipped) on one connection.
+    - Commands are grouped into transactions of batch_size commands; every command runs in its own savepoint,
+      so a failing command is undone without losing the rest of its batch.
+    - Under the repeatable_read and serializable isolation levels a serialization failure or deadlock is not
+      retried per command, since a retry would reuse the snapshot of the batch transaction. It aborts the
+      batch instead: the commands since the last commit are rolled back and no further commands are run.
+    - Command output is written to stdout block-buffered instead of being flushed per line.
+    - A summary with commands/sec and per-command latency histograms is printed to stderr at the end.
+    - Returns False if the batch was aborted, True otherwise.
+"""
+def run_batch(client, stream, batch_size):
+    sys.stdout.reconfigure(line_buffering=False)
+    latencies = {}
+    command_count = 0
+    started = time.perf_counter()
+
+    aborted = False
+    client.connect()
+    client.begin_batch()
+    try:
+        for line in stream:
+            cmd_tokens = tokenize_command(line.strip())
+            if cmd_tokens[0] == "" or cmd_tokens[0].startswith("#"):
+                continue
+
+            command_started = time.perf_counter()
+            keep_session_alive(client)
+            client.begin_command()
+            keep_running = execute_command(client, cmd_tokens)
+            client.end_command()
+            latencies.setdefault(cmd_tokens[0], []).append(time.perf_counter() - command_started)
+
+            command_count += 1
+            if command_count % batch_size == 0:
+                client.commit_batch()
+            if not keep_running:
+                break
+        client.commit_batch()
+    except TransactionRollbackError:
+        # end_batch() rolls back the aborted batch transaction
+        aborted = True
+    finally:
+        client.end_batch()
+        sys.stdout.flush()
+
+    print_batch_summary(latencies, command_count, time.perf_counter() - started)
+    if aborted:
+        print("ERROR: %s" % messages.BATCH_ABORTED, file=sys.stderr)
+    return not aborted
+
+
+def print_batch_summary(latencies, command_count, elapsed):
+    print(f"{command_count} commands in {elapsed:.2f} s ({command_count / elapsed if elapsed else 0:.1f} commands/s)", file=sys.stderr)
+    bucket_names = ["<%gms" % (bound * 1000) for bound in LATENCY_BUCKETS] + [">=%gms" % (LATENCY_BUCKETS[-1] * 1000)]
+    print("Command|Count|p50 ms|p99 ms|" + "|".join(bucket_names), file=sys.stderr)
+    for cmd, values in sorted(latencies.items()):
+        values.sort()
+        histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        for value in values:
+            histogram[bisect.bisect_right(LATENCY_BUCKETS, value)] += 1
+        p50 = values[int(0.5 * (len(values) - 1))] * 1000
+        p99 = values[int(0.99 * (len(values) - 1))] * 1000
+        print(f"{cmd}|{len(values)}|{p50:.2f}|{p99:.2f}|" + "|".join(map(str, histogram)), file=sys.stderr)
+
+
+"""
+    Writes the client's metrics to filename, if both are given.
+"""
+def write_metrics(client, filename):
+    metrics_text = client.metrics_text()
+    if filename and metrics_text is not None:
+        with open(filename, "w") as metrics_file:
+            metrics_file.write(metrics_text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seller and customer command line of the e-commerce database.")
+    parser.add_argument("--config", default=POSTGRESQL_CONFIG_FILE_NAME)
+    parser.add_argument("--batch", metavar="FILE", help="run the commands of FILE (- for stdin) non-interactively")
+    parser.add_argument("--batch-size", type=int, default=100, help="commands per transaction in batch mode")
+    parser.add_argument("--metrics", metavar="FILE", help="write operation metrics in the Prometheus text format to FILE on exit")
+    parser.add_argument("--format", choices=["text", "csv", "jsonl"], help="output format of show_cart and show_plans")
+    args = parser.parse_args()
+
+    client = Mp2Client(config_filename=args.config)
+    if args.format:
+        client.output_format = args.format
+
+    if args.batch:
+        try:
+            if args.batch == "-":
+                completed = run_batch(client, sys.stdin, max(1, args.batch_size))
             else:
-                print_error_msg(validation_message)
-            
-            client.disconnect()
+                with open(args.batch) as command_file:
+                    completed = run_batch(client, command_file, max(1, args.batch_size))
+        finally:
+            client.close()
+            write_metrics(client, args.metrics)
+        if not completed:
+            sys.exit(1)
+        return
 
-        elif cmd == "":
-            pass
+    client.help()
 
-        else:
-            print_error_msg(messages.CMD_UNDEFINED)
+    while True:
+        # print customer information if signed in
+        print_seller_info(seller=AUTH_SELLER)
+
+        # get new command from user
+        cmd_text = input()
+        cmd_tokens = tokenize_command(cmd_text)
+
+        if not execute_command(client, cmd_tokens):
+            client.close()
+            write_metrics(client, args.metrics)
+            break
 
 
 if __name__ == '__main__':
@@ -10,9 +10,11 @@ USER_OTHER_SIGNED_IN = "You need to sign out to sign in with another account."
 USER_ALREADY_SIGNED_IN = "You are already signed in to the platform."
 USER_SIGNIN_FAILED = "Seller id or password is wrong."
 USER_ALL_SESSIONS_ARE_USED = "You are out of sessions for signing in."
+USER_SESSION_EXPIRED = "Your session has expired, sign in again."
 
 
 STOCK_UNAVAILABLE = "Not enough stocks."
 SUBSCRIBE_MAX_PARALLEL_SESSIONS_UNAVAILABLE = "New plan's max parallel sessions must be greater than or equal to current plan's max parallel sessions."
 EMPTY_CART = "There are no items to purchase."
-WEIGHT_LIMIT = "Weight limit is exceeded for the order."
\ No newline at end of file
+WEIGHT_LIMIT = "Weight limit is exceeded for the order."
+BATCH_ABORTED = "The batch was aborted by a serialization failure, its uncommitted commands were rolled back."
\ No newline at end of file
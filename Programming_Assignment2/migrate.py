@@ -0,0 +1,93 @@
+import argparse
+import os
+
+import psycopg2
+
+from config import read_config
+
+
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+"""
+    Returns (version, path) of every migration file, ordered by version.
+    A migration file is named <version>_<description>.sql, e.g. 0001_access_path_indexes.sql.
+"""
+def list_migrations(directory=MIGRATIONS_DIRECTORY):
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".sql"):
+            migrations.append((filename.split("_", 1)[0], os.path.join(directory, filename)))
+    return migrations
+
+
+"""
+    Returns the set of versions recorded in schema_migrations, creating the table if needed.
+"""
+def applied_versions(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "    version varchar(16) NOT NULL PRIMARY KEY,"
+            "    name varchar(256) NOT NULL,"
+            "    applied_at timestamp NOT NULL DEFAULT NOW()"
+            ")"
+        )
+        cursor.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+    return versions
+
+
+"""
+    Applies every pending migration in version order, each one in its own transaction.
+    Returns the list of applied versions.
+"""
+def migrate(conn, directory=MIGRATIONS_DIRECTORY, target=None):
+    done = applied_versions(conn)
+    applied = []
+    for version, path in list_migrations(directory):
+        if version in done:
+            continue
+        if target is not None and version > target:
+            break
+        with open(path) as migration_file:
+            sql = migration_file.read()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                    (version, os.path.basename(path))
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations on top of construct_db.sql.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--target", help="last version to apply")
+    parser.add_argument("--list", action="store_true", help="only list migrations and whether they are applied")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    try:
+        if args.list:
+            done = applied_versions(conn)
+            for version, path in list_migrations():
+                print(f"{version}|{os.path.basename(path)}|{'applied' if version in done else 'pending'}")
+            return
+
+        for version in migrate(conn, target=args.target):
+            print(f"applied {version}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
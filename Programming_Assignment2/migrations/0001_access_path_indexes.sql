@@ -0,0 +1,25 @@
+-- Secondary indexes matched to the access paths of the Mp2Client statements in mp2.py.
+
+-- find_cart_order, lock_cart_order: the current cart of a customer
+CREATE INDEX IF NOT EXISTS orders_created_customer_idx ON orders ("customer_id") WHERE "status" = 'CREATED';
+
+-- order history of a customer and the customers -> orders ON DELETE CASCADE
+CREATE INDEX IF NOT EXISTS orders_customer_status_idx ON orders ("customer_id", "status");
+
+-- cart_items, cart demand of purchase_cart and ship: index-only scans of the cart lines of an order
+CREATE INDEX IF NOT EXISTS shopping_carts_order_covering_idx ON shopping_carts ("order_id") INCLUDE ("product_id", "seller_id", "amount");
+
+-- cart_weight, product_weight: product weight without visiting the heap
+CREATE INDEX IF NOT EXISTS products_weight_covering_idx ON products ("product_id") INCLUDE ("weight");
+
+-- stocks of a seller and the sellers -> stocks ON DELETE CASCADE
+CREATE INDEX IF NOT EXISTS stocks_seller_idx ON stocks ("seller_id");
+
+-- stocks had only a unique constraint; (product_id, seller_id) becomes its primary key
+ALTER TABLE stocks ADD CONSTRAINT stocks_pkey PRIMARY KEY ("product_id", "seller_id");
+ALTER TABLE stocks DROP CONSTRAINT IF EXISTS stocks_un;
+
+ANALYZE orders;
+ANALYZE shopping_carts;
+ANALYZE products;
+ANALYZE stocks;
@@ -0,0 +1,5 @@
+-- Running weight and item count of each order, maintained by Mp2Client.change_cart.
+-- Existing 'CREATED' orders must be backfilled with mp2_backfill_cart_totals.py.
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS "cart_weight" decimal NOT NULL DEFAULT 0;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS "item_count" int4 NOT NULL DEFAULT 0;
@@ -0,0 +1,28 @@
+-- Notifies listeners on the metadata_changed channel when plans or products change, so that
+-- the in-process cache of Mp2Client (cache.py) drops the changed rows.
+-- Payload is "<table>:<key>"; notifications are delivered when the changing transaction commits.
+
+CREATE OR REPLACE FUNCTION notify_metadata_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify('metadata_changed', TG_TABLE_NAME || ':' || (to_jsonb(OLD) ->> TG_ARGV[0]));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM pg_notify('metadata_changed', TG_TABLE_NAME || ':' || (to_jsonb(NEW) ->> TG_ARGV[0]));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_plans_metadata_changed ON plans;
+CREATE TRIGGER trg_plans_metadata_changed
+AFTER INSERT OR UPDATE OR DELETE ON plans
+FOR EACH ROW
+EXECUTE FUNCTION notify_metadata_changed('plan_id');
+
+DROP TRIGGER IF EXISTS trg_products_metadata_changed ON products;
+CREATE TRIGGER trg_products_metadata_changed
+AFTER INSERT OR UPDATE OR DELETE ON products
+FOR EACH ROW
+EXECUTE FUNCTION notify_metadata_changed('product_id');
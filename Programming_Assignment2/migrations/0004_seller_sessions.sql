@@ -0,0 +1,32 @@
+-- Active seller sessions, replacing the session_count counter of sellers (which is no longer maintained).
+-- Every session occupies one slot 1..plans.max_parallel_sessions of its seller. The primary key on
+-- (seller_id, slot) makes it impossible to hold more sessions than the plan allows, no matter how many
+-- sign_in calls run in parallel, and sign_in/sign_out never write the sellers row.
+-- A session whose heartbeat_at is older than the session ttl is expired: sign_in may take its slot over
+-- and reap_seller_sessions() deletes it.
+
+CREATE TABLE IF NOT EXISTS seller_sessions (
+	"seller_id" varchar(36) NOT NULL,
+	"slot" int4 NOT NULL,
+	"session_token" uuid NOT NULL,
+	"started_at" timestamp NOT NULL DEFAULT NOW(),
+	"heartbeat_at" timestamp NOT NULL DEFAULT NOW(),
+	PRIMARY KEY ("seller_id", "slot"),
+	FOREIGN KEY("seller_id") REFERENCES sellers("seller_id") ON DELETE CASCADE,
+	CONSTRAINT seller_sessions_token_un UNIQUE (session_token)
+);
+
+-- reaper scan of expired sessions
+CREATE INDEX IF NOT EXISTS seller_sessions_heartbeat_idx ON seller_sessions ("heartbeat_at");
+
+-- Deletes sessions without a heartbeat for ttl_seconds. Returns the number of released sessions.
+CREATE OR REPLACE FUNCTION reap_seller_sessions(ttl_seconds double precision)
+RETURNS integer AS $$
+DECLARE
+    released integer;
+BEGIN
+    DELETE FROM seller_sessions WHERE heartbeat_at < NOW() - make_interval(secs => ttl_seconds);
+    GET DIAGNOSTICS released = ROW_COUNT;
+    RETURN released;
+END;
+$$ LANGUAGE plpgsql;
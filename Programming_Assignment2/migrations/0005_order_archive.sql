@@ -0,0 +1,117 @@
+-- Cold storage of finished orders, range partitioned by order_time with one partition per month.
+-- orders keeps the live rows ('CREATED' carts, 'RECEIVED' and recently shipped orders), so the
+-- status = 'CREATED' lookups of Mp2Client and the live tables stay small as history grows.
+-- Finished orders are moved in batches by archive_orders(), run by mp2_archiver.py.
+
+-- The archive tables have no foreign keys: rows are only inserted by archive_orders() from rows that
+-- satisfied the constraints of orders and shopping_carts.
+CREATE TABLE IF NOT EXISTS orders_archive (
+	"order_id" varchar(36) NOT NULL,
+	"customer_id" varchar(36) NOT NULL,
+	"order_time" timestamp NOT NULL,
+	"shipping_time" timestamp DEFAULT NULL,
+	"status" varchar(24) NOT NULL,
+	"cart_weight" decimal NOT NULL DEFAULT 0,
+	"item_count" int4 NOT NULL DEFAULT 0,
+	PRIMARY KEY ("order_id", "order_time")
+) PARTITION BY RANGE ("order_time");
+
+-- cart lines carry the order_time of their order, so both tables are pruned by the same predicate
+CREATE TABLE IF NOT EXISTS shopping_carts_archive (
+	"order_id" varchar(36) NOT NULL,
+	"product_id" varchar(36) NOT NULL,
+	"seller_id" varchar(36) NOT NULL,
+	"amount" int4 NOT NULL,
+	"order_time" timestamp NOT NULL,
+	PRIMARY KEY ("order_id", "product_id", "seller_id", "order_time")
+) PARTITION BY RANGE ("order_time");
+
+CREATE INDEX IF NOT EXISTS orders_archive_customer_idx ON orders_archive ("customer_id");
+CREATE INDEX IF NOT EXISTS shopping_carts_archive_product_idx ON shopping_carts_archive ("product_id", "seller_id");
+
+-- archive_orders: finished orders by the time they finished; cancelled orders have no shipping_time
+CREATE INDEX IF NOT EXISTS orders_finished_idx ON orders (COALESCE("shipping_time", "order_time")) WHERE "status" IN ('SHIPPED', 'COMPLETED', 'CANCELLED');
+
+
+-- Creates the partitions of both archive tables for the month containing p_month, if missing.
+CREATE OR REPLACE FUNCTION ensure_order_archive_partition(p_month timestamp) RETURNS void AS $$
+DECLARE
+    v_from timestamp := date_trunc('month', p_month);
+    v_to timestamp := date_trunc('month', p_month) + INTERVAL '1 month';
+    v_suffix text := to_char(date_trunc('month', p_month), '"y"YYYY"m"MM');
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF orders_archive FOR VALUES FROM (%L) TO (%L)',
+        'orders_archive_' || v_suffix, v_from, v_to
+    );
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF shopping_carts_archive FOR VALUES FROM (%L) TO (%L)',
+        'shopping_carts_archive_' || v_suffix, v_from, v_to
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Moves up to p_batch_size orders finished before p_before, with their cart lines, to the archive. An order
+-- finished at its shipping_time, or at its order_time if it was cancelled without being shipped.
+-- The partitions created here and the rows inserted below are both routed by order_time.
+-- Orders locked by other transactions are skipped and picked up by a later batch. Returns the number of moved orders.
+CREATE OR REPLACE FUNCTION archive_orders(p_before timestamp, p_batch_size integer) RETURNS integer AS $$
+DECLARE
+    v_order_ids varchar[];
+    v_month timestamp;
+    v_count integer;
+BEGIN
+    SELECT array_agg(order_id) INTO v_order_ids FROM (
+        SELECT order_id FROM orders
+        WHERE status IN ('SHIPPED', 'COMPLETED', 'CANCELLED')
+          AND COALESCE(shipping_time, order_time) < p_before
+          AND order_time IS NOT NULL
+        ORDER BY COALESCE(shipping_time, order_time)
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    ) batch;
+
+    IF v_order_ids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    FOR v_month IN
+        SELECT DISTINCT date_trunc('month', order_time) FROM orders WHERE order_id = ANY(v_order_ids)
+    LOOP
+        PERFORM ensure_order_archive_partition(v_month);
+    END LOOP;
+
+    INSERT INTO shopping_carts_archive (order_id, product_id, seller_id, amount, order_time)
+    SELECT sc.order_id, sc.product_id, sc.seller_id, sc.amount, o.order_time
+    FROM shopping_carts sc
+    JOIN orders o ON o.order_id = sc.order_id
+    WHERE sc.order_id = ANY(v_order_ids);
+
+    -- the cart lines are deleted with their orders by ON DELETE CASCADE
+    WITH moved AS (
+        DELETE FROM orders WHERE order_id = ANY(v_order_ids)
+        RETURNING order_id, customer_id, order_time, shipping_time, status, cart_weight, item_count
+    )
+    INSERT INTO orders_archive (order_id, customer_id, order_time, shipping_time, status, cart_weight, item_count)
+    SELECT order_id, customer_id, order_time, shipping_time, status, cart_weight, item_count FROM moved;
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Live and archived orders for analytics. A predicate on order_time prunes the archive partitions
+-- through the UNION ALL, e.g. WHERE order_time >= '2024-01-01' only scans the partitions from 2024 on.
+CREATE OR REPLACE VIEW order_history AS
+SELECT order_id, customer_id, order_time, shipping_time, status, cart_weight, item_count FROM orders
+UNION ALL
+SELECT order_id, customer_id, order_time, shipping_time, status, cart_weight, item_count FROM orders_archive;
+
+CREATE OR REPLACE VIEW shopping_cart_history AS
+SELECT sc.order_id, sc.product_id, sc.seller_id, sc.amount, o.order_time
+FROM shopping_carts sc
+JOIN orders o ON o.order_id = sc.order_id
+UNION ALL
+SELECT order_id, product_id, seller_id, amount, order_time FROM shopping_carts_archive;
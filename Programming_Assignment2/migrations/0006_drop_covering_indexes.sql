@@ -0,0 +1,7 @@
+-- Drops two covering indexes of 0001_access_path_indexes.sql that duplicate existing keys.
+-- products_weight_covering_idx indexes product_id like the products primary key does, and the cart lines
+-- of an order are read through the leading order_id column of shopping_carts_un, so
+-- shopping_carts_order_covering_idx only adds write cost to every cart change.
+
+DROP INDEX IF EXISTS products_weight_covering_idx;
+DROP INDEX IF EXISTS shopping_carts_order_covering_idx;
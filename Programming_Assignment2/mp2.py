@@ -1,10 +1,431 @@
 import psycopg2
+import random
+import threading
+import time
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
+from psycopg2 import errorcodes
 
+from cache import create_cache
+from cart_store import Cart, create_cart_store
 from config import read_config
+from instrumentation import REGISTRY, configure_slow_log, instrument_client, record_failure, record_retry
 from messages import *
+from pool import create_pool
 from seller import Seller
+from statements import StatementRegistry
+from streaming import DEFAULT_CHUNK_SIZE, DEFAULT_ITERSIZE, FORMATS, stream_query, write_rows
+
+"""
+    Demand queries of purchase_cart and ship, producing at most one (product_id, seller_id, amount) row per stock row.
+"""
+CART_DEMAND_SQL = "SELECT product_id, seller_id, amount FROM shopping_carts WHERE order_id = $1"
+
+ORDERS_DEMAND_SQL = (
+    "SELECT product_id, seller_id, SUM(amount) AS amount FROM shopping_carts "
+    "WHERE order_id = ANY($1::varchar[]) GROUP BY product_id, seller_id"
+)
+
+STOCK_LOCK_SQL = (
+    "WITH demand AS ({demand}) "
+    "SELECT s.product_id FROM stocks s "
+    "JOIN demand d ON s.product_id = d.product_id AND s.seller_id = d.seller_id "
+    "ORDER BY s.product_id, s.seller_id "
+    "FOR UPDATE OF s"
+)
+
+STOCK_RESERVE_SQL = (
+    "WITH demand AS ({demand}), reserved AS ("
+    "    UPDATE stocks s SET stock_count = s.stock_count - d.amount FROM demand d "
+    "    WHERE s.product_id = d.product_id AND s.seller_id = d.seller_id AND s.stock_count >= d.amount "
+    "    RETURNING s.product_id"
+    ") "
+    "SELECT (SELECT COUNT(*) FROM demand), (SELECT COUNT(*) FROM reserved)"
+)
+
+
+"""
+    Hot queries of Mp2Client, prepared once per connection and executed by name.
+"""
+STATEMENTS = StatementRegistry()
+STATEMENTS.register("insert_seller", "INSERT INTO sellers (seller_id, password, session_count, plan_id) VALUES ($1, $2, 0, $3)")
+STATEMENTS.register("seller_by_credentials", "SELECT seller_id, password, session_count, plan_id FROM sellers WHERE seller_id = $1 AND password = $2")
+STATEMENTS.register(
+    "open_session",
+    "INSERT INTO seller_sessions (seller_id, slot, session_token, started_at, heartbeat_at) "
+    "SELECT s.seller_id, g.slot, $3, NOW(), NOW() FROM sellers s "
+    "JOIN plans p ON p.plan_id = s.plan_id "
+    "CROSS JOIN LATERAL generate_series(1, p.max_parallel_sessions) AS g(slot) "
+    "WHERE s.seller_id = $1 AND NOT EXISTS ("
+    "    SELECT 1 FROM seller_sessions ss WHERE ss.seller_id = s.seller_id AND ss.slot = g.slot "
+    "    AND ss.heartbeat_at >= NOW() - make_interval(secs => $2)"
+    ") "
+    "ORDER BY g.slot LIMIT 1 "
+    "ON CONFLICT (seller_id, slot) DO UPDATE "
+    "SET session_token = EXCLUDED.session_token, started_at = EXCLUDED.started_at, heartbeat_at = EXCLUDED.heartbeat_at "
+    "WHERE seller_sessions.heartbeat_at < NOW() - make_interval(secs => $2) "
+    "RETURNING slot"
+)
+STATEMENTS.register("heartbeat_session", "UPDATE seller_sessions SET heartbeat_at = NOW() WHERE session_token = $1")
+STATEMENTS.register("close_session", "DELETE FROM seller_sessions WHERE session_token = $1")
+STATEMENTS.register("reap_sessions", "SELECT reap_seller_sessions($1)")
+STATEMENTS.register("change_plan", "UPDATE sellers SET plan_id = $1 WHERE seller_id = $2")
+STATEMENTS.register("all_plans", "SELECT plan_id, name, max_parallel_sessions FROM plans")
+STATEMENTS.register("plan_by_id", "SELECT plan_id, name, max_parallel_sessions FROM plans WHERE plan_id = $1")
+STATEMENTS.register("change_stock", "UPDATE stocks SET stock_count = stock_count + $1 WHERE product_id = $2 AND seller_id = $3 AND stock_count + $1 >= 0")
+STATEMENTS.register("stock_count", "SELECT stock_count FROM stocks WHERE product_id = $1 AND seller_id = $2")
+STATEMENTS.register("product_weight", "SELECT weight FROM products WHERE product_id = $1")
+STATEMENTS.register("product_metadata", "SELECT weight, price FROM products WHERE product_id = $1")
+STATEMENTS.register("find_cart_order", "SELECT order_id FROM orders WHERE customer_id = $1 AND status = 'CREATED'")
+STATEMENTS.register("lock_cart_order", "SELECT order_id FROM orders WHERE customer_id = $1 AND status = 'CREATED' LIMIT 1 FOR UPDATE")
+STATEMENTS.register("create_cart_order", "INSERT INTO orders (order_id, customer_id, status) VALUES (gen_random_uuid(), $1, 'CREATED') RETURNING order_id")
+STATEMENTS.register("cart_items", "SELECT order_id, seller_id, product_id, amount FROM shopping_carts WHERE order_id = $1")
+STATEMENTS.register(
+    "add_cart_totals",
+    "UPDATE orders SET cart_weight = cart_weight + $1, item_count = item_count + $2 "
+    "WHERE order_id = $3 AND cart_weight + $1 <= $4"
+)
+STATEMENTS.register(
+    "remove_cart_totals",
+    "UPDATE orders SET cart_weight = GREATEST(cart_weight - $1, 0), item_count = GREATEST(item_count - $2, 0) "
+    "WHERE order_id = $3"
+)
+STATEMENTS.register(
+    "add_cart_item",
+    "INSERT INTO shopping_carts (order_id, product_id, seller_id, amount) VALUES ($1, $2, $3, $4) "
+    "ON CONFLICT (order_id, product_id, seller_id) DO UPDATE SET amount = shopping_carts.amount + EXCLUDED.amount"
+)
+STATEMENTS.register("remove_cart_item", "UPDATE shopping_carts SET amount = amount + $1 WHERE order_id = $2 AND product_id = $3 AND seller_id = $4 RETURNING amount")
+STATEMENTS.register("delete_empty_cart_item", "DELETE FROM shopping_carts WHERE amount <= 0 AND order_id = $1 AND product_id = $2 AND seller_id = $3")
+STATEMENTS.register("receive_order", "UPDATE orders SET status = 'RECEIVED', order_time = NOW() WHERE order_id = $1")
+STATEMENTS.register("lock_orders", "SELECT order_id FROM orders WHERE order_id = ANY($1::varchar[]) ORDER BY order_id FOR UPDATE")
+STATEMENTS.register("existing_orders", "SELECT order_id FROM orders WHERE order_id = ANY($1::varchar[])")
+STATEMENTS.register("ship_orders", "UPDATE orders SET status = 'SHIPPED', shipping_time = NOW() WHERE order_id = ANY($1::varchar[])")
+STATEMENTS.register(
+    "ship_order_lines",
+    "SELECT sc.order_id, sc.product_id, sc.seller_id, sc.amount, s.stock_count FROM shopping_carts sc "
+    "LEFT JOIN stocks s ON s.product_id = sc.product_id AND s.seller_id = sc.seller_id "
+    "WHERE sc.order_id = ANY($1::varchar[]) ORDER BY sc.order_id"
+)
+STATEMENTS.register(
+    "take_stocks",
+    "UPDATE stocks s SET stock_count = s.stock_count - d.amount "
+    "FROM (SELECT * FROM unnest($1::varchar[], $2::varchar[], $3::int[]) AS t(product_id, seller_id, amount)) d "
+    "WHERE s.product_id = d.product_id AND s.seller_id = d.seller_id"
+)
+STATEMENTS.register(
+    "cart_state",
+    "SELECT o.order_id, o.cart_weight, sc.product_id, sc.seller_id, sc.amount FROM orders o "
+    "LEFT JOIN shopping_carts sc ON sc.order_id = o.order_id "
+    "WHERE o.customer_id = $1 AND o.status = 'CREATED'"
+)
+STATEMENTS.register("create_cart_order_with_id", "INSERT INTO orders (order_id, customer_id, status) VALUES ($1, $2, 'CREATED')")
+STATEMENTS.register("clear_cart_items", "DELETE FROM shopping_carts WHERE order_id = $1")
+STATEMENTS.register(
+    "insert_cart_items",
+    "INSERT INTO shopping_carts (order_id, product_id, seller_id, amount) "
+    "SELECT $1, t.product_id, t.seller_id, t.amount "
+    "FROM unnest($2::varchar[], $3::varchar[], $4::int[]) AS t(product_id, seller_id, amount)"
+)
+STATEMENTS.register(
+    "recompute_cart_totals",
+    "UPDATE orders o SET cart_weight = t.cart_weight, item_count = t.item_count "
+    "FROM (SELECT COALESCE(SUM(sc.amount * COALESCE(p.weight, 0)), 0) AS cart_weight, COALESCE(SUM(sc.amount), 0) AS item_count "
+    "      FROM shopping_carts sc JOIN products p ON p.product_id = sc.product_id WHERE sc.order_id = $1) t "
+    "WHERE o.order_id = $1 RETURNING o.cart_weight"
+)
+for demand_name, demand_sql in (("cart", CART_DEMAND_SQL), ("orders", ORDERS_DEMAND_SQL)):
+    STATEMENTS.register("lock_%s_stocks" % demand_name, STOCK_LOCK_SQL.format(demand=demand_sql))
+    STATEMENTS.register("reserve_%s_stocks" % demand_name, STOCK_RESERVE_SQL.format(demand=demand_sql))
+
+"""
+    Output columns of show_cart and show_plans as (key, label) pairs, see streaming.write_rows.
+"""
+CART_COLUMNS = [("order_id", "Order Id"), ("seller_id", "Seller Id"), ("product_id", "Product Id"), ("amount", "Amount")]
+PLAN_COLUMNS = [("plan_id", "#"), ("name", "Name"), ("max_parallel_sessions", "Max Sessions")]
+
+"""
+    Weight limit of a single order in kilograms.
+"""
+MAX_CART_WEIGHT = 15
+
+RETRYABLE_SQLSTATES = (errorcodes.SERIALIZATION_FAILURE, errorcodes.DEADLOCK_DETECTED)
+
+"""
+    Seconds without a heartbeat after which a seller session expires, and the minimum seconds between two
+    heartbeats of a session. Overridden by ttl and heartbeat_interval of the [sessions] section.
+"""
+SESSION_TTL = 1800.0
+SESSION_HEARTBEAT_INTERVAL = 60.0
+
+"""
+    open_session attempts of one sign_in. An attempt only fails while free slots are left when a parallel
+    sign_in took the same slot first; the next attempt sees that slot as taken.
+"""
+SESSION_ADMISSION_ATTEMPTS = 3
+
+"""
+    Modes of Mp2Client.ship_orders.
+    - SHIP_ALL_OR_NOTHING: every order is shipped or none is, like ship.
+    - SHIP_PER_ORDER: the orders that can be shipped are shipped, the others are left untouched.
+"""
+SHIP_ALL_OR_NOTHING = "all_or_nothing"
+SHIP_PER_ORDER = "per_order"
+
+"""
+    Per-order results of Mp2Client.ship_orders.
+"""
+SHIP_SHIPPED = "SHIPPED"
+SHIP_NOT_FOUND = "NOT_FOUND"
+SHIP_STOCK_UNAVAILABLE = "STOCK_UNAVAILABLE"
+SHIP_ROLLED_BACK = "ROLLED_BACK"
+SHIP_FAILED = "FAILED"
+
+
+"""
+    Isolation levels of the [transaction] isolation_level setting.
+"""
+ISOLATION_LEVELS = {
+    "read_committed": psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED,
+    "repeatable_read": psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ,
+    "serializable": psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE,
+}
+
+
+"""
+    Retry policy for transactions aborted by serialization failures or deadlocks.
+    - A transaction is run at most max_attempts times.
+    - The n-th retry waits up to base_delay * 2^(n-1) seconds, capped at max_delay. With jitter the wait is drawn
+      uniformly from [0, that bound], so transactions that collided once do not retry in lockstep.
+"""
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=0.01, max_delay=0.5, jitter=True):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def should_retry(self, error, attempt):
+        # psycopg2 errors carry the SQLSTATE in pgcode, asyncpg errors in sqlstate
+        sqlstate = getattr(error, "pgcode", None) or getattr(error, "sqlstate", None)
+        return sqlstate in RETRYABLE_SQLSTATES and attempt < self.max_attempts
+
+    def delay(self, attempt):
+        bound = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if self.jitter:
+            return random.uniform(0, bound)
+        return bound
+
+
+"""
+    Builds a RetryPolicy from the [retry] section of the configuration file, defaults are used for missing keys.
+"""
+def create_retry_policy(retry_params):
+    return RetryPolicy(
+        max_attempts=int(retry_params.get("max_attempts", 3)),
+        base_delay=float(retry_params.get("base_delay", 0.01)),
+        max_delay=float(retry_params.get("max_delay", 0.5)),
+        jitter=retry_params.get("jitter", "true").lower() in ("1", "true", "yes", "on"),
+    )
+
+
+"""
+    Token bucket limiting retries to a share of the transactions, so that an overloaded database is not hit
+    with a retry storm on top of its regular load.
+    - Every transaction adds ratio tokens, every retry takes one token; retries are refused when none is left.
+    - min_per_second tokens are added per second regardless of traffic, so rare transactions can still retry.
+    - At most max_tokens tokens are kept.
+"""
+class RetryBudget:
+    def __init__(self, ratio=0.2, min_per_second=10.0, max_tokens=100.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.max_tokens, self._tokens + (now - self._refilled_at) * self.min_per_second)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+"""
+    Runs transaction bodies with retries of serialization failures and deadlocks.
+    - run(conn, body, failure, commit, rollback) runs body(cursor); the transaction is committed when the 1st
+      element of the result is truthy and rolled back otherwise. commit and rollback default to the connection's.
+    - A retryable error is retried while the retry policy allows another attempt and the retry budget has a
+      token; any other error, or a refused retry, rolls back and returns failure.
+    - With retry False a retryable error is rolled back and raised to the caller instead.
+    - isolation_level (one of ISOLATION_LEVELS) is applied by Mp2Client to the connections it uses.
+    - stats() returns counters of transactions, commits, rollbacks, retries per SQLSTATE and refused retries.
+"""
+class TransactionRunner:
+    def __init__(self, retry_policy=None, budget=None, isolation_level=None):
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.budget = budget or RetryBudget()
+        self.isolation_level = isolation_level
+        self._lock = threading.Lock()
+        self._stats = {
+            "transactions": 0, "commits": 0, "rollbacks": 0, "failures": 0,
+            "retries": 0, "retries_exhausted": 0, "budget_exhausted": 0, "non_retryable": 0,
+        }
+        self._retries_by_sqlstate = {}
+
+    def _count(self, name, sqlstate=None):
+        with self._lock:
+            self._stats[name] += 1
+            if sqlstate is not None:
+                self._retries_by_sqlstate[sqlstate] = self._retries_by_sqlstate.get(sqlstate, 0) + 1
+
+    def run(self, conn, body, failure, commit=None, rollback=None, retry=True):
+        commit = commit or conn.commit
+        rollback = rollback or conn.rollback
+        self._count("transactions")
+        self.budget.deposit()
+
+        attempt = 1
+        while True:
+            try:
+                with conn.cursor() as cursor:
+                    result = body(cursor)
+                if result[0]:
+                    commit()
+                    self._count("commits")
+                else:
+                    rollback()
+                    self._count("rollbacks")
+                return result
+            except psycopg2.Error as e:
+                rollback()
+                if e.pgcode not in RETRYABLE_SQLSTATES:
+                    self._count("non_retryable")
+                    self._count("failures")
+                    return failure
+                if not retry:
+                    self._count("failures")
+                    raise
+                if not self.retry_policy.should_retry(e, attempt):
+                    self._count("retries_exhausted")
+                    self._count("failures")
+                    return failure
+                if not self.budget.withdraw():
+                    self._count("budget_exhausted")
+                    self._count("failures")
+                    return failure
+                self._count("retries", sqlstate=errorcodes.lookup(e.pgcode).lower())
+                record_retry()
+                time.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+            except Exception as e:
+                record_failure(e)
+                rollback()
+                self._count("failures")
+                return failure
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["retries_by_sqlstate"] = dict(self._retries_by_sqlstate)
+            return stats
+
+
+"""
+    Builds a TransactionRunner from the [retry] and [transaction] sections of the configuration file.
+"""
+def create_transaction_runner(retry_params, transaction_params):
+    isolation_level = transaction_params.get("isolation_level", "")
+    if isolation_level and isolation_level not in ISOLATION_LEVELS:
+        raise ValueError("unknown isolation_level: %s" % isolation_level)
+    return TransactionRunner(
+        retry_policy=create_retry_policy(retry_params),
+        budget=RetryBudget(
+            ratio=float(retry_params.get("budget_ratio", 0.2)),
+            min_per_second=float(retry_params.get("budget_min_per_second", 10)),
+        ),
+        isolation_level=isolation_level or None,
+    )
+
+
+"""
+    Reserves stocks for the rows of the "cart" (params: order_id) or "orders" (params: list of order ids) demand.
+    - Stock rows are first locked in canonical (product_id, seller_id) order. Two transactions reserving
+      overlapping rows then always wait on each other in the same order and can not deadlock.
+    - Stocks are decreased with a single conditional UPDATE; rows without enough items are left untouched.
+    - Returns tuple (demand row count, reserved row count). The caller must roll back when they differ.
+"""
+def reserve_stocks(cursor, demand, params):
+    STATEMENTS.execute(cursor, "lock_%s_stocks" % demand, params)
+    STATEMENTS.execute(cursor, "reserve_%s_stocks" % demand, params)
+    return cursor.fetchone()
+
+
+"""
+    Decides which orders can be shipped from the stocks they need.
+    - lines are (order_id, product_id, seller_id, amount, stock_count) rows ordered by order_id; stock_count is
+      None when the seller does not stock the product.
+    - Orders are allocated in order_id order: an order is shippable if every one of its lines still fits into
+      the stock left by the shippable orders before it.
+    - Returns (dict of order_id -> SHIP_SHIPPED or SHIP_STOCK_UNAVAILABLE, list of (product_id, seller_id, amount)
+      taken by the shippable orders).
+"""
+def allocate_stocks(order_ids, lines):
+    lines_by_order = {order_id: [] for order_id in order_ids}
+    remaining = {}
+    for order_id, product_id, seller_id, amount, stock_count in lines:
+        lines_by_order[order_id].append((product_id, seller_id, amount))
+        remaining[(product_id, seller_id)] = stock_count
+
+    results = {}
+    taken = {}
+    for order_id in order_ids:
+        demand = {}
+        for product_id, seller_id, amount in lines_by_order[order_id]:
+            demand[(product_id, seller_id)] = demand.get((product_id, seller_id), 0) + amount
+
+        if all(remaining[key] is not None and remaining[key] >= amount for key, amount in demand.items()):
+            for key, amount in demand.items():
+                remaining[key] -= amount
+                taken[key] = taken.get(key, 0) + amount
+            results[order_id] = SHIP_SHIPPED
+        else:
+            results[order_id] = SHIP_STOCK_UNAVAILABLE
+
+    return results, [(product_id, seller_id, amount) for (product_id, seller_id), amount in sorted(taken.items())]
+
+
+"""
+    Writes a cart of the write-behind cart store to the customer's 'CREATED' order.
+    - The locked 'CREATED' order of the customer is reused; without one the order is created with order_id.
+    - The cart lines replace the order's shopping_carts rows and the running totals are recomputed.
+    - Returns tuple (order_id, cart weight).
+"""
+def write_cart(cursor, customer_id, order_id, lines):
+    STATEMENTS.execute(cursor, "lock_cart_order", (customer_id,))
+    result = cursor.fetchone()
+    if result is None:
+        STATEMENTS.execute(cursor, "create_cart_order_with_id", (order_id, customer_id))
+    else:
+        order_id = result[0]
+
+    STATEMENTS.execute(cursor, "clear_cart_items", (order_id,))
+    if lines:
+        product_ids, seller_ids, amounts = zip(*lines)
+        STATEMENTS.execute(cursor, "insert_cart_items", (order_id, list(product_ids), list(seller_ids), list(amounts)))
+    STATEMENTS.execute(cursor, "recompute_cart_totals", (order_id,))
+    return order_id, cursor.fetchone()[0]
+
 
 """
     Splits given command string by spaces and trims each token.
@@ -15,22 +436,361 @@ def tokenize_command(command):
     return [t.strip() for t in tokens]
 
 class Mp2Client:
-    def __init__(self, config_filename):
+    def __init__(self, config_filename, pool=None, retry_policy=None, cache=None, metrics=None, runner=None, cart_store=None):
         self.db_conn_params = read_config(filename=config_filename, section="postgresql")
         self.conn = None
 
+        # in batch mode commands share one transaction and each runs inside its own savepoint
+        self.in_batch = False
+        self._savepoint = False
+
+        # transactions are retried and run at the isolation level of the runner
+        if runner is None:
+            runner = create_transaction_runner(
+                read_config(filename=config_filename, section="retry", required=False),
+                read_config(filename=config_filename, section="transaction", required=False),
+            )
+        if retry_policy is not None:
+            runner.retry_policy = retry_policy
+        self.runner = runner
+        self.retry_policy = runner.retry_policy
+
+        # connections are borrowed from a pool when one is given or configured in the [pool] section
+        self.owns_pool = False
+        if pool is None:
+            pool_params = read_config(filename=config_filename, section="pool", required=False)
+            if pool_params:
+                pool = create_pool(self.db_conn_params, pool_params)
+                self.owns_pool = True
+        self.pool = pool
+        if pool is not None:
+            pool.on_close(STATEMENTS.invalidate)
+
+        # plans and product metadata are cached when a cache is given or configured in the [cache] section
+        self.owns_cache = False
+        if cache is None:
+            cache_params = read_config(filename=config_filename, section="cache", required=False)
+            if cache_params:
+                cache = create_cache(self.db_conn_params, cache_params)
+                self.owns_cache = True
+        self.cache = cache
+
+        # 'CREATED' carts are kept in memory and written behind when a store is given or configured in the [cart_store] section
+        self.owns_cart_store = False
+        if cart_store is None:
+            cart_store_params = read_config(filename=config_filename, section="cart_store", required=False)
+            if cart_store_params:
+                cart_store = create_cart_store(cart_store_params)
+                self.owns_cart_store = True
+        self.cart_store = cart_store
+        if cart_store is not None:
+            cart_store.start(lambda: psycopg2.connect(**self.db_conn_params), self._flush_cart)
+
+        session_params = read_config(filename=config_filename, section="sessions", required=False)
+        self.session_ttl = float(session_params.get("ttl", SESSION_TTL))
+        self.heartbeat_interval = float(session_params.get("heartbeat_interval", SESSION_HEARTBEAT_INTERVAL))
+
+        # result sets are written as text, csv or jsonl in chunks; large queries are streamed with server-side cursors
+        output_params = read_config(filename=config_filename, section="output", required=False)
+        self.output_format = output_params.get("format", "text")
+        if self.output_format not in FORMATS:
+            raise ValueError("unknown output format: %s" % self.output_format)
+        self.itersize = int(output_params.get("itersize", DEFAULT_ITERSIZE))
+        self.chunk_size = int(output_params.get("chunk_size", DEFAULT_CHUNK_SIZE))
+
+        # operations and their SQL are measured when a registry is given or a [metrics] section is configured
+        metrics_params = read_config(filename=config_filename, section="metrics", required=False)
+        if metrics is None and metrics_params:
+            metrics = REGISTRY
+        self.metrics = metrics
+        if metrics is not None:
+            slow_threshold = metrics_params.get("slow_threshold", "")
+            if slow_threshold:
+                configure_slow_log(metrics_params.get("slow_log", ""))
+            instrument_client(self, metrics, slow_threshold=float(slow_threshold) if slow_threshold else None)
+
     """
         Connects to PostgreSQL database and returns connection object.
+        In pooled mode the connection is checked out from the pool instead of being opened.
     """
     def connect(self):
-        self.conn = psycopg2.connect(**self.db_conn_params)
-        self.conn.autocommit = False
+        if self.conn is not None and not self.conn.closed:
+            return self.conn
+
+        if self.pool is not None:
+            self.conn = self.pool.getconn()
+        else:
+            self.conn = psycopg2.connect(**self.db_conn_params)
+            self.conn.autocommit = False
+        if self.metrics is not None:
+            self.conn.cursor_factory = self.metrics.cursor_class()
+        if self.runner.isolation_level is not None and self.conn.isolation_level != ISOLATION_LEVELS[self.runner.isolation_level]:
+            self.conn.rollback()
+            self.conn.isolation_level = ISOLATION_LEVELS[self.runner.isolation_level]
+        return self.conn
 
     """
         Disconnects from PostgreSQL database.
+        In pooled mode the connection is returned to the pool instead of being closed.
     """
     def disconnect(self):
-        self.conn.close()
+        if self.conn is None:
+            return
+
+        if self.pool is not None:
+            # pooled connections may be handed to clients without metrics or with another isolation level
+            self.conn.cursor_factory = psycopg2.extensions.cursor
+            if self.runner.isolation_level is not None:
+                self.conn.rollback()
+                self.conn.isolation_level = psycopg2.extensions.ISOLATION_LEVEL_DEFAULT
+            self.pool.putconn(self.conn)
+        else:
+            STATEMENTS.invalidate(self.conn)
+            self.conn.close()
+        self.conn = None
+
+    """
+        Context manager that holds a connection for the duration of the block.
+        - If the client already holds a connection, it is reused and kept after the block.
+        - Otherwise a connection is borrowed (or opened) and released when the block exits.
+    """
+    @contextmanager
+    def borrow(self):
+        if self.conn is not None and not self.conn.closed:
+            yield self.conn
+            return
+
+        self.connect()
+        try:
+            yield self.conn
+        finally:
+            self.disconnect()
+
+    """
+        Returns connection pool counters (checkouts, waits, created, ...) or None when pooling is disabled.
+    """
+    def pool_stats(self):
+        if self.pool is None:
+            return None
+        return self.pool.stats()
+
+    """
+        Returns call counts and timings of the prepared hot queries, keyed by statement name.
+    """
+    def statement_stats(self):
+        return STATEMENTS.stats()
+
+    """
+        Returns hit/miss counters of the plan and product caches or None when caching is disabled.
+    """
+    def cache_stats(self):
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    """
+        Returns hit/miss/eviction/flush counters of the cart store or None when it is disabled.
+    """
+    def cart_store_stats(self):
+        if self.cart_store is None:
+            return None
+        return self.cart_store.stats()
+
+    """
+        Returns the operation and SQL metrics in the Prometheus text format or None when metrics are disabled.
+    """
+    def metrics_text(self):
+        if self.metrics is None:
+            return None
+        return self.metrics.prometheus_text()
+
+    """
+        Releases the held connection and closes the pool, cache and cart store if this client created them.
+        Closing the cart store writes its dirty carts.
+    """
+    def close(self):
+        self.disconnect()
+        if self.owns_cart_store:
+            self.cart_store.close()
+        if self.owns_pool:
+            self.pool.closeall()
+        if self.owns_cache:
+            self.cache.close()
+
+    """
+        Starts batch mode on the held connection: commit and rollback of the commands only release or roll back
+        to their savepoint, the transaction itself is committed by commit_batch().
+    """
+    def begin_batch(self):
+        self.in_batch = True
+        self._savepoint = False
+
+    """
+        Opens the savepoint of the next command in batch mode.
+    """
+    def begin_command(self):
+        if self.in_batch:
+            with self.conn.cursor() as cursor:
+                cursor.execute("SAVEPOINT mp2_command")
+            self._savepoint = True
+
+    """
+        Releases the savepoint of the finished command in batch mode.
+    """
+    def end_command(self):
+        if self.in_batch and self._savepoint:
+            with self.conn.cursor() as cursor:
+                cursor.execute("RELEASE SAVEPOINT mp2_command")
+            self._savepoint = False
+
+    """
+        Commits the commands of the batch run so far.
+    """
+    def commit_batch(self):
+        if self._savepoint:
+            self.end_command()
+        self.conn.commit()
+
+    def end_batch(self):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.rollback()
+        self.in_batch = False
+        self._savepoint = False
+
+    """
+        Commits the current command, or only releases its savepoint in batch mode.
+        The savepoint is opened again right away: a command may run several transactions (heartbeat, cart
+        store flushes) and the ones after the first must still be undone by _rollback().
+    """
+    def _commit(self):
+        if not self.in_batch:
+            self.conn.commit()
+        elif self._savepoint:
+            with self.conn.cursor() as cursor:
+                cursor.execute("RELEASE SAVEPOINT mp2_command")
+                cursor.execute("SAVEPOINT mp2_command")
+
+    """
+        Rolls back the current command, or only rolls back to its savepoint in batch mode.
+        The savepoint is kept so that a retried command is still undone as a whole.
+    """
+    def _rollback(self):
+        if not self.in_batch:
+            self.conn.rollback()
+        elif self._savepoint:
+            with self.conn.cursor() as cursor:
+                cursor.execute("ROLLBACK TO SAVEPOINT mp2_command")
+
+    """
+        Returns (plan_id, name, max_parallel_sessions) of a plan, from the cache if enabled.
+    """
+    def _plan(self, cursor, plan_id):
+        def load():
+            STATEMENTS.execute(cursor, "plan_by_id", (plan_id,))
+            return cursor.fetchone()
+
+        if self.cache is None:
+            return load()
+        return self.cache.plan(plan_id, load)
+
+    """
+        Returns all plans, from the cache if enabled.
+    """
+    def _all_plans(self, cursor):
+        def load():
+            STATEMENTS.execute(cursor, "all_plans")
+            return cursor.fetchall()
+
+        if self.cache is None:
+            return load()
+        return self.cache.all_plans(load)
+
+    """
+        Returns (weight, price) of a product or None if it does not exist, from the cache if enabled.
+    """
+    def _product(self, cursor, product_id):
+        def load():
+            STATEMENTS.execute(cursor, "product_metadata", (product_id,))
+            return cursor.fetchone()
+
+        if self.cache is None:
+            return load()
+        return self.cache.product(product_id, load)
+
+    """
+        Returns the cart of the customer from the cart store, loading the cart from the database on a miss.
+        Evicted dirty carts are added to the evicted list; the caller writes them with _flush_evicted() after its
+        transaction, also when the transaction failed.
+    """
+    def _cached_cart(self, cursor, customer_id, evicted):
+        def load(customer_id):
+            STATEMENTS.execute(cursor, "cart_state", (customer_id,))
+            rows = cursor.fetchall()
+            if not rows:
+                return None
+            lines = {(product_id, seller_id): amount for _, _, product_id, seller_id, amount in rows if product_id is not None}
+            return Cart(customer_id, order_id=rows[0][0], lines=lines, weight=float(rows[0][1] or 0), persisted=True)
+
+        cart, newly_evicted = self.cart_store.get(customer_id, load)
+        evicted.extend(newly_evicted)
+        return cart
+
+    """
+        Writes evicted dirty carts on the held connection; a cart that could not be written stays pending in the
+        store and is written by its background flusher.
+    """
+    def _flush_evicted(self, evicted):
+        for cart in evicted:
+            self.cart_store.flush(cart, lambda *args: self._flush_cart(self.conn, *args))
+
+    """
+        Writes a cart of the cart store on conn in its own transaction. Returns its order_id or None on failure.
+    """
+    def _flush_cart(self, conn, customer_id, order_id, lines):
+        def body(cursor):
+            return write_cart(cursor, customer_id, order_id, lines)[0], CMD_EXECUTION_SUCCESS
+
+        if conn is self.conn:
+            return self._run_transaction(body, failure=(None, CMD_EXECUTION_FAILED))[0]
+        return self.runner.run(conn, body, failure=(None, CMD_EXECUTION_FAILED))[0]
+
+    """
+        Writes rows in the client's output format to stdout, in chunks of chunk_size rows.
+    """
+    def _write_rows(self, rows, columns):
+        return write_rows(rows, columns, fmt=self.output_format, chunk_size=self.chunk_size)
+
+    """
+        Streams the result of a query (e.g. SELECT * FROM order_history) through a server-side cursor
+        in the client's output format. Returns tuple (row count, message) or (None, CMD_EXECUTION_FAILED).
+    """
+    def stream(self, query, params=None, out=None):
+        try:
+            count = stream_query(self.conn, query, params, fmt=self.output_format, out=out,
+                                 itersize=self.itersize, chunk_size=self.chunk_size)
+            self._rollback()
+            return count, CMD_EXECUTION_SUCCESS
+        except Exception as e:
+            record_failure(e)
+            self._rollback()
+            return None, CMD_EXECUTION_FAILED
+
+    """
+        Runs body(cursor) as one transaction with the client's TransactionRunner and returns its result tuple.
+        - In batch mode commit and rollback only release or roll back to the command's savepoint.
+        - In batch mode above read committed, serialization failures and deadlocks are not retried but raised:
+          a retry after ROLLBACK TO SAVEPOINT would run on the snapshot of the batch transaction and fail again
+          (under serializable the transaction can not commit anymore), so the whole batch has to be rolled back.
+    """
+    def _run_transaction(self, body, failure):
+        retry = not self.in_batch or self.runner.isolation_level in (None, "read_committed")
+        return self.runner.run(self.conn, body, failure, commit=self._commit, rollback=self._rollback, retry=retry)
+
+    """
+        Returns transaction, commit, rollback and retry counters of the transaction runner.
+    """
+    def retry_stats(self):
+        return self.runner.stats()
 
     """
         Prints list of available commands of the software.
@@ -47,6 +807,7 @@ class Mp2Client:
         print("> change_stock <product_id> <add or remove> <amount>")
         print("> subscribe <plan_id>")
         print("> ship <order_id>")
+        print("> ship_partial <order_id>")
         print("> show_cart <customer_id>")
         print("> change_cart <customer_id> <product_id> <seller_id> <add or remove> <amount>")
         print("> purchase_cart <customer_id>")
@@ -62,82 +823,103 @@ class Mp2Client:
         try:
             with self.conn.cursor() as cursor:
                 # Insert the new seller into the database
-                cursor.execute(
-                    "INSERT INTO sellers (seller_id, password, session_count, plan_id) VALUES (%s, %s, 0, %s)",
-                    (seller_id, password, plan_id)
-                )
-            self.conn.commit()
+                STATEMENTS.execute(cursor, "insert_seller", (seller_id, password, plan_id))
+            self._commit()
             return True, CMD_EXECUTION_SUCCESS
         except psycopg2.errors.UniqueViolation:
-            self.conn.rollback()
+            self._rollback()
             return False, CMD_EXECUTION_FAILED
         except Exception as e:
-            self.conn.rollback()
+            record_failure(e)
+            self._rollback()
             return False, CMD_EXECUTION_FAILED
 
     """
-        Retrieves seller information if seller_id and password is correct and seller's session_count < max_parallel_sessions.
+        Retrieves seller information if seller_id and password is correct and a session slot of the seller's plan is free.
         - Return type is a tuple, 1st element is a Seller object and 2nd element is the response message from messages.py.
         - If seller_id or password is wrong, return tuple (None, USER_SIGNIN_FAILED).
-        - If session_count < max_parallel_sessions, commit changes (increment session_count) and return tuple (seller, CMD_EXECUTION_SUCCESS).
-        - If session_count >= max_parallel_sessions, return tuple (None, USER_ALL_SESSIONS_ARE_USED).
+        - The session is admitted by a single conditional INSERT into seller_sessions (migration 0004) that takes
+          the first free or expired slot 1..max_parallel_sessions. The slot primary key keeps parallel sign_ins
+          within the plan's limit; the sellers row is only read.
+        - If a slot is taken, commit changes and return tuple (seller, CMD_EXECUTION_SUCCESS); the seller carries the session token.
+        - If every slot is held by a live session, return tuple (None, USER_ALL_SESSIONS_ARE_USED).
         - If any exception occurs; rollback, do nothing on the database and return tuple (None, USER_SIGNIN_FAILED).
     """
     def sign_in(self, seller_id, password):
-        #First check if the seller_id and password is correct
-        try:
-            with self.conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT * FROM sellers WHERE seller_id = %s AND password = %s",
-                    (seller_id, password)
-                )
-                seller = cursor.fetchone()
-                
-                if seller is None:
-                    return None, USER_SIGNIN_FAILED
-                
-                #Get the plan of the seller
-                cursor.execute(
-                    "SELECT * FROM plans WHERE plan_id = %s",
-                    (seller[3],)
-                )
-                plan = cursor.fetchone()
-                #Check if the session count is less than the max_parallel_sessions
-                if seller[2] < plan[2]:
-                    cursor.execute(
-                        "UPDATE sellers SET session_count = session_count + 1 WHERE seller_id = %s",
-                        (seller_id,)
-                    )
-                    self.conn.commit()
-                    return Seller(seller[0], seller[2] + 1, seller[3]), CMD_EXECUTION_SUCCESS
-                else:
-                    return None, USER_ALL_SESSIONS_ARE_USED
-        except Exception as e:
-            self.conn.rollback()
-            return None, USER_SIGNIN_FAILED
+        def body(cursor):
+            STATEMENTS.execute(cursor, "seller_by_credentials", (seller_id, password))
+            seller = cursor.fetchone()
+            if seller is None:
+                return None, USER_SIGNIN_FAILED
+
+            session_token = str(uuid.uuid4())
+            for _ in range(SESSION_ADMISSION_ATTEMPTS):
+                STATEMENTS.execute(cursor, "open_session", (seller_id, self.session_ttl, session_token))
+                slot = cursor.fetchone()
+                if slot is not None:
+                    return Seller(seller[0], slot[0], seller[3], session_token=session_token), CMD_EXECUTION_SUCCESS
+            return None, USER_ALL_SESSIONS_ARE_USED
+
+        return self._run_transaction(body, failure=(None, USER_SIGNIN_FAILED))
 
     """
         Signs out from given seller's account.
         - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
-        - Decrement session_count of the seller in the database.
+        - Delete the seller's session from seller_sessions; a session already released by the reaper is signed out as well.
         - If the operation is successful, commit changes and return tuple (True, CMD_EXECUTION_SUCCESS).
         - If any exception occurs; rollback, do nothing on the database and return tuple (False, CMD_EXECUTION_FAILED).
     """
     def sign_out(self, seller):
-        try:
-            with self.conn.cursor() as cursor:
-                if(seller.session_count == 0):
-                    return False, CMD_EXECUTION_FAILED
-                cursor.execute(
-                    "UPDATE sellers SET session_count = session_count - 1 WHERE seller_id = %s",
-                    (seller.seller_id,)
-                )
-            self.conn.commit()
-            return True, CMD_EXECUTION_SUCCESS
-        except Exception as e:
-            self.conn.rollback()
+        if seller.session_token is None:
             return False, CMD_EXECUTION_FAILED
 
+        def body(cursor):
+            STATEMENTS.execute(cursor, "close_session", (seller.session_token,))
+            return True, CMD_EXECUTION_SUCCESS
+
+        return self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
+
+    """
+        Keeps the seller's session alive. At most one heartbeat per heartbeat_interval is sent to the database.
+        In batch mode outside of a command, the heartbeat runs in a savepoint of its own.
+        Returns False if the session expired and its slot was taken over or reaped; the seller must sign in again.
+    """
+    def heartbeat(self, seller):
+        if seller.session_token is None:
+            return False
+        now = time.monotonic()
+        if seller.last_heartbeat is not None and now - seller.last_heartbeat < self.heartbeat_interval:
+            return True
+
+        def body(cursor):
+            STATEMENTS.execute(cursor, "heartbeat_session", (seller.session_token,))
+            return cursor.rowcount > 0, None
+
+        if self.in_batch and not self._savepoint:
+            # between two batch commands: a failed heartbeat must only roll back to its own savepoint,
+            # an aborted batch transaction would fail the next command's SAVEPOINT
+            self.begin_command()
+            try:
+                alive, _ = self._run_transaction(body, failure=(True, None))
+            finally:
+                self.end_command()
+        else:
+            alive, _ = self._run_transaction(body, failure=(True, None))
+        if alive:
+            seller.last_heartbeat = now
+        return alive
+
+    """
+        Releases every session without a heartbeat for session_ttl seconds. Returns the number of released sessions.
+    """
+    def reap_sessions(self):
+        def body(cursor):
+            STATEMENTS.execute(cursor, "reap_sessions", (self.session_ttl,))
+            return True, cursor.fetchone()[0]
+
+        _, released = self._run_transaction(body, failure=(False, 0))
+        return released
+
 
     """
         Quits from program.
@@ -155,10 +937,11 @@ class Mp2Client:
             return False, CMD_EXECUTION_FAILED
 
         try:
-            self.conn.commit()
+            self._commit()
             return True, CMD_EXECUTION_SUCCESS
         except Exception as e:
-            self.conn.rollback()
+            record_failure(e)
+            self._rollback()
             return False, CMD_EXECUTION_FAILED
 
 
@@ -177,16 +960,11 @@ class Mp2Client:
     def show_plans(self):
         try:
             with self.conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT * FROM plans"
-                )
-                plans = cursor.fetchall()
-                print("#|Name|Max Sessions")
-                for i, plan in enumerate(plans):
-                    print(f"{plan[0]}|{plan[1]}|{plan[2]}")
+                self._write_rows(self._all_plans(cursor), PLAN_COLUMNS)
             return True, CMD_EXECUTION_SUCCESS
         except Exception as e:
-            self.conn.rollback()
+            record_failure(e)
+            self._rollback()
             return False, CMD_EXECUTION_FAILED
     
     """
@@ -202,16 +980,13 @@ class Mp2Client:
     def show_subscription(self, seller):
         try:
             with self.conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT * FROM plans WHERE plan_id = %s",
-                    (seller.plan_id,)
-                )
-                plan = cursor.fetchone()
+                plan = self._plan(cursor, seller.plan_id)
                 print("#|Name|Max Sessions")
                 print(f"{plan[0]}|{plan[1]}|{plan[2]}")
             return True, CMD_EXECUTION_SUCCESS
         except Exception as e:
-            self.conn.rollback()
+            record_failure(e)
+            self._rollback()
             return False, CMD_EXECUTION_FAILED
     
     """
@@ -222,27 +997,14 @@ class Mp2Client:
         - If any exception occurs; rollback, do nothing on the database and return tuple (False, CMD_EXECUTION_FAILED).
     """
     def change_stock(self, seller, product_id, change_amount):
-        try:
-            with self.conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT * FROM stocks WHERE product_id = %s AND seller_id = %s",
-                    (product_id, seller.seller_id)
-                )
-                stock = cursor.fetchone()
-                if stock is None:
-                    return False, CMD_EXECUTION_FAILED
-                new_stock = stock[2] + change_amount
-                if new_stock < 0:
-                    return False, CMD_EXECUTION_FAILED
-                cursor.execute(
-                    "UPDATE stocks SET stock_count = %s WHERE product_id = %s AND seller_id = %s",
-                    (new_stock, product_id, seller.seller_id)
-                )
-            self.conn.commit()
+        def body(cursor):
+            # Apply the change on the current value; the row is left untouched if it would become negative
+            STATEMENTS.execute(cursor, "change_stock", (change_amount, product_id, seller.seller_id))
+            if cursor.rowcount == 0:
+                return False, CMD_EXECUTION_FAILED
             return True, CMD_EXECUTION_SUCCESS
-        except Exception as e:
-            self.conn.rollback()
-            return False, CMD_EXECUTION_FAILED
+
+        return self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
 
     """
         Subscribe authenticated seller to new plan.
@@ -252,32 +1014,18 @@ class Mp2Client:
         - If any exception occurs; rollback, do nothing on the database and return tuple (None, CMD_EXECUTION_FAILED).
     """
     def subscribe(self, seller, plan_id):
-        try:
-            with self.conn.cursor() as cursor:
-                #Get the current plan of the seller
-                cursor.execute(
-                    "SELECT * FROM plans WHERE plan_id = %s",
-                    (seller.plan_id,)
-                )
-                current_plan = cursor.fetchone()
-                #Get the new plan
-                cursor.execute(
-                    "SELECT * FROM plans WHERE plan_id = %s",
-                    (plan_id,)
-                )
-                new_plan = cursor.fetchone()
-                #Check if the new plan's max_parallel_sessions is greater than or equal to the current plan's max_parallel_sessions
-                if new_plan[2] < current_plan[2]:
-                    return None, SUBSCRIBE_MAX_PARALLEL_SESSIONS_UNAVAILABLE
-                cursor.execute(
-                    "UPDATE sellers SET plan_id = %s WHERE seller_id = %s",
-                    (plan_id, seller.seller_id)
-                )
-            self.conn.commit()
-            return Seller(seller.seller_id, seller.session_count, plan_id), CMD_EXECUTION_SUCCESS
-        except Exception as e:
-            self.conn.rollback()
-            return None, CMD_EXECUTION_FAILED
+        def body(cursor):
+            #Get the current plan of the seller
+            current_plan = self._plan(cursor, seller.plan_id)
+            #Get the new plan
+            new_plan = self._plan(cursor, plan_id)
+            #Check if the new plan's max_parallel_sessions is greater than or equal to the current plan's max_parallel_sessions
+            if new_plan[2] < current_plan[2]:
+                return None, SUBSCRIBE_MAX_PARALLEL_SESSIONS_UNAVAILABLE
+            STATEMENTS.execute(cursor, "change_plan", (plan_id, seller.seller_id))
+            return Seller(seller.seller_id, seller.session_count, plan_id, session_token=seller.session_token), CMD_EXECUTION_SUCCESS
+
+        return self._run_transaction(body, failure=(None, CMD_EXECUTION_FAILED))
     
     """
         Change stock amounts of sellers of products included in orders.
@@ -287,51 +1035,95 @@ class Mp2Client:
         - If any exception occurs; rollback, do nothing on the database and return tuple (False, CMD_EXECUTION_FAILED).
     """
     def ship(self, order_ids):
+        shipped, _ = self.ship_orders(order_ids, mode=SHIP_ALL_OR_NOTHING)
+        if shipped:
+            return True, CMD_EXECUTION_SUCCESS
+        return False, CMD_EXECUTION_FAILED
+
+    """
+        Ships many orders with a fixed number of set-based statements and reports the outcome of every order.
+        - Return type is a tuple, 1st element is True if every order was shipped and 2nd element is a list of
+          (order_id, result) in order_id order, result being one of the SHIP_* results.
+        - SHIP_ALL_OR_NOTHING: the orders are locked and all their stocks reserved with one conditional UPDATE.
+          If anything is missing the transaction is rolled back; the failing orders are then diagnosed
+          read-only and the others are reported as SHIP_ROLLED_BACK.
+        - SHIP_PER_ORDER: orders and stock rows are locked in canonical order, the lines of all orders are read
+          in one query and allocated in memory (see allocate_stocks), then the stocks of the shippable orders are
+          taken with one UPDATE. Locks make the allocation equivalent to shipping every order in its own
+          savepoint, without a savepoint and its statements per order.
+        - If an exception occurs or retries are exhausted; rollback and report every order as SHIP_FAILED.
+    """
+    def ship_orders(self, order_ids, mode=SHIP_PER_ORDER):
+        order_ids = sorted(set(order_ids))
+        if mode not in (SHIP_ALL_OR_NOTHING, SHIP_PER_ORDER):
+            raise ValueError("unknown ship mode: %r" % mode)
+
+        def all_or_nothing(cursor):
+            # Lock the orders in canonical order, every order must exist
+            STATEMENTS.execute(cursor, "lock_orders", (order_ids,))
+            if cursor.rowcount < len(order_ids):
+                return False, None
+
+            # Every stock row must have enough items for all orders together
+            line_count, reserved_count = reserve_stocks(cursor, "orders", (order_ids,))
+            if reserved_count < line_count:
+                return False, None
+
+            STATEMENTS.execute(cursor, "ship_orders", (order_ids,))
+            return True, [(order_id, SHIP_SHIPPED) for order_id in order_ids]
+
+        def per_order(cursor):
+            STATEMENTS.execute(cursor, "lock_orders", (order_ids,))
+            found = set(row[0] for row in cursor.fetchall())
+            existing = [order_id for order_id in order_ids if order_id in found]
+
+            STATEMENTS.execute(cursor, "lock_orders_stocks", (existing,))
+            STATEMENTS.execute(cursor, "ship_order_lines", (existing,))
+            results, taken = allocate_stocks(existing, cursor.fetchall())
+
+            shippable = [order_id for order_id in existing if results[order_id] == SHIP_SHIPPED]
+            if taken:
+                STATEMENTS.execute(cursor, "take_stocks", tuple(map(list, zip(*taken))))
+            if shippable:
+                STATEMENTS.execute(cursor, "ship_orders", (shippable,))
+
+            report = [(order_id, results.get(order_id, SHIP_NOT_FOUND)) for order_id in order_ids]
+            return len(shippable) > 0, report
+
+        failure = (False, [(order_id, SHIP_FAILED) for order_id in order_ids])
+        if mode == SHIP_PER_ORDER:
+            _, report = self._run_transaction(per_order, failure=failure)
+            return all(result == SHIP_SHIPPED for _, result in report), report
+
+        shipped, report = self._run_transaction(all_or_nothing, failure=failure)
+        if report is None:
+            report = self._diagnose_ship(order_ids)
+        return shipped, report
+
+    """
+        Explains why the given orders can not be shipped together, without changing anything.
+        Orders that could have been shipped on their own are reported as SHIP_ROLLED_BACK.
+    """
+    def _diagnose_ship(self, order_ids):
         try:
             with self.conn.cursor() as cursor:
-                for order_id in order_ids:
-                    # Check if the order exists
-                    cursor.execute(
-                        "SELECT COUNT(*) FROM orders WHERE order_id = %s",
-                        (order_id,)
-                    )
-                    if cursor.fetchone()[0] == 0:
-                        self.conn.rollback()
-                        return False, CMD_EXECUTION_FAILED  
-
-                    cursor.execute(
-                        "SELECT product_id, seller_id, amount FROM shopping_carts WHERE order_id = %s",
-                        (order_id,)
-                    )
-                    items = cursor.fetchall()
-                    
-                    # Check if all items have enough stock
-                    for product_id, seller_id, amount in items:
-                        cursor.execute(
-                            "SELECT stock_count FROM stocks WHERE product_id = %s AND seller_id = %s",
-                            (product_id, seller_id)
-                        )
-                        stock_count = cursor.fetchone()[0]
-                        if stock_count < amount:
-                            self.conn.rollback()
-                            return False, CMD_EXECUTION_FAILED
-
-                    # Decrease stock amounts and update order status
-                    for product_id, seller_id, amount in items:
-                        cursor.execute(
-                            "UPDATE stocks SET stock_count = stock_count - %s WHERE product_id = %s AND seller_id = %s",
-                            (amount, product_id, seller_id)
-                        )
-                    cursor.execute(
-                        "UPDATE orders SET status = 'SHIPPED', shipping_time = NOW() WHERE order_id = %s",
-                        (order_id,)
-                    )
-
-                self.conn.commit()
-                return True, CMD_EXECUTION_SUCCESS
+                STATEMENTS.execute(cursor, "ship_order_lines", (order_ids,))
+                lines = cursor.fetchall()
+                STATEMENTS.execute(cursor, "existing_orders", (order_ids,))
+                found = set(row[0] for row in cursor.fetchall())
+            self._rollback()
         except Exception as e:
-            self.conn.rollback()
-            return False, CMD_EXECUTION_FAILED
+            record_failure(e)
+            self._rollback()
+            return [(order_id, SHIP_FAILED) for order_id in order_ids]
+
+        existing = [order_id for order_id in order_ids if order_id in found]
+        results, _ = allocate_stocks(existing, [line for line in lines if line[0] in found])
+        return [
+            (order_id, SHIP_NOT_FOUND if order_id not in found else
+             SHIP_ROLLED_BACK if results[order_id] == SHIP_SHIPPED else results[order_id])
+            for order_id in order_ids
+        ]
     
     """
         Retrieves items on the customer's temporary shopping cart (order status = 'CREATED')
@@ -346,32 +1138,25 @@ class Mp2Client:
         orderX|sellerY|productZ|4
     """
     def show_cart(self, customer_id):
+        if self.cart_store is not None:
+            return self._show_cached_cart(customer_id)
+
         try:
             with self.conn.cursor() as cursor:
                 # Find the order_id for the customer's current shopping cart
-                cursor.execute(
-                    "SELECT order_id FROM orders WHERE customer_id = %s AND status = 'CREATED'",
-                    (customer_id,)
-                )
+                STATEMENTS.execute(cursor, "find_cart_order", (customer_id,))
                 result = cursor.fetchone()
                 if not result:
                     return False, CMD_EXECUTION_FAILED
                 order_id = result[0]
                 
-                # Retrieve items in the shopping cart
-                cursor.execute(
-                    "SELECT order_id, seller_id, product_id, amount FROM shopping_carts WHERE order_id = %s",
-                    (order_id,)
-                )
-                cart_items = cursor.fetchall()
-                
-                # Display the cart items
-                cart_output = "Order Id|Seller Id|Product Id|Amount\n"
-                for item in cart_items:
-                    cart_output += f"{item[0]}|{item[1]}|{item[2]}|{item[3]}\n"
-                print(cart_output.strip())
+                # Retrieve and display the items in the shopping cart
+                STATEMENTS.execute(cursor, "cart_items", (order_id,))
+                self._write_rows(cursor, CART_COLUMNS)
                 return True, CMD_EXECUTION_SUCCESS
         except Exception as e:
+            record_failure(e)
+            self._rollback()
             return False, CMD_EXECUTION_FAILED
 
         
@@ -385,77 +1170,53 @@ class Mp2Client:
         - If any exception occurs; rollback, do nothing on the database and return tuple (False, CMD_EXECUTION_FAILED).
     """
     def change_cart(self, customer_id, product_id, seller_id, change_amount):
-        try:
-            with self.conn.cursor() as cursor:
-                # Find the order_id for the customer's current shopping cart
-                cursor.execute(
-                    "SELECT order_id FROM orders WHERE customer_id = %s AND status = 'CREATED'",
-                    (customer_id,)
-                )
+        if self.cart_store is not None:
+            return self._change_cached_cart(customer_id, product_id, seller_id, change_amount)
+
+        def body(cursor):
+            # Find and lock the customer's current shopping cart so its running totals can be updated safely
+            STATEMENTS.execute(cursor, "lock_cart_order", (customer_id,))
+            result = cursor.fetchone()
+
+            if not result:
+                # Create a new order if no active cart exists
+                STATEMENTS.execute(cursor, "create_cart_order", (customer_id,))
+                order_id = cursor.fetchone()[0]
+            else:
+                order_id = result[0]
+
+            # Get the weight of the product being added/removed
+            product_weight = self._product(cursor, product_id)[0] or 0
+
+            if change_amount > 0:
+                # Check stock availability
+                STATEMENTS.execute(cursor, "stock_count", (product_id, seller_id))
+                stock_count = cursor.fetchone()[0]
+                if stock_count < change_amount:
+                    return False, STOCK_UNAVAILABLE
+
+                # Add to the running cart weight only if it stays within the weight limit
+                STATEMENTS.execute(cursor, "add_cart_totals", (product_weight * change_amount, change_amount, order_id, MAX_CART_WEIGHT))
+                if cursor.rowcount == 0:
+                    return False, WEIGHT_LIMIT
+
+                # Add item to cart
+                STATEMENTS.execute(cursor, "add_cart_item", (order_id, product_id, seller_id, change_amount))
+
+            elif change_amount < 0:
+                # Remove item from cart
+                STATEMENTS.execute(cursor, "remove_cart_item", (change_amount, order_id, product_id, seller_id))
                 result = cursor.fetchone()
-                
-                if not result:
-                    # Create a new order if no active cart exists
-                    cursor.execute(
-                        "INSERT INTO orders (order_id, customer_id, status) VALUES (gen_random_uuid(), %s, 'CREATED') RETURNING order_id",
-                        (customer_id,)
-                    )
-                    order_id = cursor.fetchone()[0]
-                else:
-                    order_id = result[0]
-
-                # Check the current total weight in the cart
-                cursor.execute(
-                    "SELECT SUM(p.weight * sc.amount) FROM shopping_carts sc JOIN products p ON sc.product_id = p.product_id WHERE sc.order_id = %s",
-                    (order_id,)
-                )
-                current_weight = cursor.fetchone()[0] or 0
-
-                # Get the weight of the product being added/removed
-                cursor.execute(
-                    "SELECT weight FROM products WHERE product_id = %s",
-                    (product_id,)
-                )
-                product_weight = cursor.fetchone()[0]
-
-                if change_amount > 0:
-                    # Check stock availability
-                    cursor.execute(
-                        "SELECT stock_count FROM stocks WHERE product_id = %s AND seller_id = %s",
-                        (product_id, seller_id)
-                    )
-                    stock_count = cursor.fetchone()[0]
-                    if stock_count < change_amount:
-                        return False, STOCK_UNAVAILABLE
-
-                    # Check weight limit
-                    new_weight = current_weight + (product_weight * change_amount)
-                    if new_weight > 15:
-                        return False, WEIGHT_LIMIT
-
-                    # Add item to cart
-                    cursor.execute(
-                        "INSERT INTO shopping_carts (order_id, product_id, seller_id, amount) VALUES (%s, %s, %s, %s) "
-                        "ON CONFLICT (order_id, product_id, seller_id) DO UPDATE SET amount = shopping_carts.amount + EXCLUDED.amount",
-                        (order_id, product_id, seller_id, change_amount)
-                    )
-
-                elif change_amount < 0:
-                    # Remove item from cart
-                    cursor.execute(
-                        "UPDATE shopping_carts SET amount = amount + %s WHERE order_id = %s AND product_id = %s AND seller_id = %s",
-                        (change_amount, order_id, product_id, seller_id)
-                    )
-                    cursor.execute(
-                        "DELETE FROM shopping_carts WHERE amount <= 0 AND order_id = %s AND product_id = %s AND seller_id = %s",
-                        (order_id, product_id, seller_id)
-                    )
-
-                self.conn.commit()
-                return True, CMD_EXECUTION_SUCCESS
-        except Exception as e:
-            self.conn.rollback()
-            return False, CMD_EXECUTION_FAILED
+                if result is not None:
+                    # Only the items that were in the cart are removed from the running totals
+                    new_amount = result[0]
+                    removed_amount = new_amount - change_amount - max(new_amount, 0)
+                    STATEMENTS.execute(cursor, "delete_empty_cart_item", (order_id, product_id, seller_id))
+                    STATEMENTS.execute(cursor, "remove_cart_totals", (product_weight * removed_amount, removed_amount, order_id))
+
+            return True, CMD_EXECUTION_SUCCESS
+
+        return self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
     
     """
         Purchases items on the cart
@@ -470,51 +1231,94 @@ class Mp2Client:
         - Update order with status='CREATED' -> status='RECEIVED' and put order_time with current datetime.
     """
     def purchase_cart(self, customer_id):
-        try:
-            with self.conn.cursor() as cursor:
-                # Find the order_id for the customer's current shopping cart
-                cursor.execute(
-                    "SELECT order_id FROM orders WHERE customer_id = %s AND status = 'CREATED'",
-                    (customer_id,)
-                )
-                result = cursor.fetchone()
-                
-                if not result:
-                    return False, EMPTY_CART
-                order_id = result[0]
+        cart = self.cart_store.peek(customer_id) if self.cart_store is not None else None
 
-                # Retrieve items in the shopping cart
-                cursor.execute(
-                    "SELECT product_id, seller_id, amount FROM shopping_carts WHERE order_id = %s",
-                    (order_id,)
-                )
-                cart_items = cursor.fetchall()
-
-                # Check if all items have enough stock
-                for product_id, seller_id, amount in cart_items:
-                    cursor.execute(
-                        "SELECT stock_count FROM stocks WHERE product_id = %s AND seller_id = %s",
-                        (product_id, seller_id)
-                    )
-                    stock_count = cursor.fetchone()[0]
-                    if stock_count < amount:
-                        return False, STOCK_UNAVAILABLE
-
-                # Decrease stock amounts
-                for product_id, seller_id, amount in cart_items:
-                    cursor.execute(
-                        "UPDATE stocks SET stock_count = stock_count - %s WHERE product_id = %s AND seller_id = %s",
-                        (amount, product_id, seller_id)
-                    )
-
-                # Update order status to 'RECEIVED' and set the order time
-                cursor.execute(
-                    "UPDATE orders SET status = 'RECEIVED', order_time = NOW() WHERE order_id = %s",
-                    (order_id,)
-                )
-
-                self.conn.commit()
-                return True, CMD_EXECUTION_SUCCESS
-        except Exception as e:
-            self.conn.rollback()
-            return False, CMD_EXECUTION_FAILED
\ No newline at end of file
+        def body(cursor):
+            if cart is not None and cart.dirty:
+                # Write the cached cart first; its weight and stock were only checked in memory and are checked again here
+                _, cart_weight = write_cart(cursor, customer_id, cart.order_id, cart.snapshot()[2])
+                if cart_weight > MAX_CART_WEIGHT:
+                    return False, WEIGHT_LIMIT
+
+            # Find and lock the customer's current shopping cart; a concurrent purchase of the
+            # same cart waits here and then sees that the cart is no longer 'CREATED'
+            STATEMENTS.execute(cursor, "lock_cart_order", (customer_id,))
+            result = cursor.fetchone()
+            if not result:
+                return False, EMPTY_CART
+            order_id = result[0]
+
+            line_count, reserved_count = reserve_stocks(cursor, "cart", (order_id,))
+            if line_count == 0:
+                return False, EMPTY_CART
+            if reserved_count < line_count:
+                return False, STOCK_UNAVAILABLE
+
+            # Update order status to 'RECEIVED' and set the order time
+            STATEMENTS.execute(cursor, "receive_order", (order_id,))
+            return True, CMD_EXECUTION_SUCCESS
+
+        if cart is None:
+            return self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
+
+        # a failed purchase keeps the cart in the store, still dirty
+        with cart.lock:
+            result = self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
+            if result[0]:
+                self.cart_store.discard(customer_id)
+                for product_id, seller_id in cart.lines:
+                    self.cart_store.stocks.invalidate((product_id, seller_id))
+        return result
+
+    """
+        show_cart served from the cart store.
+    """
+    def _show_cached_cart(self, customer_id):
+        evicted = []
+
+        def body(cursor):
+            cart = self._cached_cart(cursor, customer_id, evicted)
+            with cart.lock:
+                if not cart.persisted and not cart.dirty:
+                    return False, CMD_EXECUTION_FAILED
+                lines = sorted(cart.lines.items())
+                order_id = cart.order_id
+
+            self._write_rows(((order_id, seller_id, product_id, amount) for (product_id, seller_id), amount in lines), CART_COLUMNS)
+            return True, CMD_EXECUTION_SUCCESS
+
+        result = self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
+        self._flush_evicted(evicted)
+        return result
+
+    """
+        change_cart served from the cart store.
+        - The stock check uses the stock snapshots of the store, product weights come from _product(); purchase_cart checks both again.
+        - Nothing is committed; the cart is written behind by the store's flusher, an eviction or purchase_cart.
+    """
+    def _change_cached_cart(self, customer_id, product_id, seller_id, change_amount):
+        evicted = []
+
+        def body(cursor):
+            cart = self._cached_cart(cursor, customer_id, evicted)
+            # product weights come from the LISTEN/NOTIFY invalidated metadata cache when it is enabled
+            product_weight = float(self._product(cursor, product_id)[0] or 0)
+
+            if change_amount > 0:
+                def load_stock():
+                    STATEMENTS.execute(cursor, "stock_count", (product_id, seller_id))
+                    return cursor.fetchone()
+
+                stock_count = self.cart_store.stocks.get((product_id, seller_id), load_stock)[0]
+                if stock_count < change_amount:
+                    return False, STOCK_UNAVAILABLE
+
+            with cart.lock:
+                if change_amount > 0 and cart.weight + product_weight * change_amount > MAX_CART_WEIGHT:
+                    return False, WEIGHT_LIMIT
+                cart.change(product_id, seller_id, change_amount, product_weight)
+            return True, CMD_EXECUTION_SUCCESS
+
+        result = self._run_transaction(body, failure=(False, CMD_EXECUTION_FAILED))
+        self._flush_evicted(evicted)
+        return result
@@ -0,0 +1,60 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from mp2 import Mp2Client
+
+
+"""
+    Moves orders finished (shipped or cancelled) before the cutoff to orders_archive in batches, each in its
+    own transaction, until no more are left or max_batches batches ran. Returns the number of moved orders.
+    - Short transactions keep the row locks on orders brief; pause seconds are slept between batches.
+"""
+def archive(conn, before, batch_size, pause=0.0, max_batches=None):
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT archive_orders(%s, %s)", (before, batch_size))
+            count = cursor.fetchone()[0]
+        conn.commit()
+        moved += count
+        batches += 1
+        if count < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move finished orders and their cart lines to the partitioned order archive.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--older-than", type=float, default=90, help="archive orders finished more than this many days ago")
+    parser.add_argument("--batch-size", type=int, default=1000, help="orders moved per transaction")
+    parser.add_argument("--pause", type=float, default=0.1, help="seconds between two batches")
+    parser.add_argument("--max-batches", type=int, help="stop after this many batches")
+    parser.add_argument("--interval", type=float, default=3600, help="seconds between two archiver runs")
+    parser.add_argument("--once", action="store_true", help="archive once and exit")
+    args = parser.parse_args()
+
+    client = Mp2Client(config_filename=args.config)
+    try:
+        while True:
+            before = datetime.now() - timedelta(days=args.older_than)
+            started = time.perf_counter()
+            with client.borrow() as conn:
+                moved = archive(conn, before, args.batch_size, args.pause, args.max_batches)
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}|archived {moved} orders finished before {before:%Y-%m-%d %H:%M:%S} "
+                  f"in {time.perf_counter() - started:.2f} s", flush=True)
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import time
+
+import psycopg2
+
+from config import read_config
+
+
+"""
+    Recomputes cart_weight and item_count of a batch of 'CREATED' orders with order_id > after_order_id.
+    The batch is locked first, so change_cart calls on these carts wait and the totals are computed
+    from the cart lines committed before the lock was taken.
+    Returns the last order_id of the batch, or None when no orders are left.
+"""
+def backfill_batch(conn, after_order_id, batch_size):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT order_id FROM orders WHERE status = 'CREATED' AND order_id > %s "
+            "ORDER BY order_id LIMIT %s FOR UPDATE",
+            (after_order_id, batch_size)
+        )
+        order_ids = [row[0] for row in cursor.fetchall()]
+        if not order_ids:
+            conn.rollback()
+            return None
+
+        cursor.execute(
+            "WITH totals AS ("
+            "    SELECT o.order_id, COALESCE(SUM(p.weight * sc.amount), 0) AS weight, COALESCE(SUM(sc.amount), 0) AS items"
+            "    FROM orders o"
+            "    LEFT JOIN shopping_carts sc ON sc.order_id = o.order_id"
+            "    LEFT JOIN products p ON p.product_id = sc.product_id"
+            "    WHERE o.order_id = ANY(%s)"
+            "    GROUP BY o.order_id"
+            ") "
+            "UPDATE orders o SET cart_weight = t.weight, item_count = t.items "
+            "FROM totals t WHERE o.order_id = t.order_id",
+            (order_ids,)
+        )
+    conn.commit()
+    return order_ids[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Populate cart_weight and item_count of existing 'CREATED' orders.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    started = time.perf_counter()
+    batches = 0
+    try:
+        last_order_id = ""
+        while True:
+            last_order_id = backfill_batch(conn, last_order_id, args.batch_size)
+            if last_order_id is None:
+                break
+            batches += 1
+    finally:
+        conn.close()
+    print(f"backfilled {batches} batch(es) in {time.perf_counter() - started:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import io
+import sys
+
+from psycopg2 import sql
+
+import fixtures
+import main as cli
+from mp2 import Mp2Client
+
+
+"""
+    Batch mixing failing commands with successful ones, all in one transaction:
+    - sign_up of an existing seller fails with an SQL error, the commands after it must still run.
+    - purchase_cart of customer 1 takes product 0 and then finds product 1 sold out; the product 0
+      decrement must be rolled back to the command's savepoint.
+    - sign_in, heartbeats and sign_out commit more than once inside a command.
+    - Every heartbeat is sent and fails (fail_heartbeats), between the commands; the batch must go on.
+"""
+BATCH = """\
+sign_up {s0} password {plan_id}
+sign_in {s0} password
+change_cart {c0} {p1} {s0} add 2
+change_cart {c1} {p0} {s0} add 2
+change_cart {c1} {p1} {s0} add 2
+purchase_cart {c0}
+purchase_cart {c1}
+change_cart {c1} {p0} {s0} remove 1
+sign_out
+"""
+
+
+"""
+    Makes every heartbeat of the seller fail like a lock_timeout, with a trigger on seller_sessions.
+    Returns the statement dropping the trigger and its function again.
+"""
+def fail_heartbeats(conn, prefix, seller_id):
+    name = sql.Identifier(prefix.replace("-", "_") + "_fail_heartbeat")
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL(
+            "CREATE FUNCTION {}() RETURNS TRIGGER AS $$ BEGIN "
+            "RAISE EXCEPTION 'heartbeat failed' USING ERRCODE = 'lock_not_available'; "
+            "END; $$ LANGUAGE plpgsql"
+        ).format(name))
+        cursor.execute(sql.SQL(
+            "CREATE TRIGGER {} BEFORE UPDATE OF heartbeat_at ON seller_sessions FOR EACH ROW "
+            "WHEN (NEW.seller_id = {}) EXECUTE FUNCTION {}()"
+        ).format(name, sql.Literal(seller_id), name))
+    conn.commit()
+    return sql.SQL("DROP TRIGGER IF EXISTS {} ON seller_sessions; DROP FUNCTION IF EXISTS {}()").format(name, name)
+
+
+"""
+    Returns list of (what, actual, expected) mismatches of the state the batch must leave behind.
+"""
+def verify(conn, catalog, initial_stock):
+    s0 = catalog["sellers"][0]
+    p0, p1 = catalog["products"]
+    c0, c1 = catalog["customers"]
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT product_id, stock_count FROM stocks WHERE seller_id = %s", (s0,))
+        stocks = dict(cursor.fetchall())
+        cursor.execute(
+            "SELECT o.customer_id, o.status, sc.product_id, sc.amount FROM orders o "
+            "JOIN shopping_carts sc ON sc.order_id = o.order_id WHERE o.customer_id IN (%s, %s)",
+            (c0, c1)
+        )
+        lines = {(customer_id, status, product_id): amount for customer_id, status, product_id, amount in cursor.fetchall()}
+    conn.rollback()
+
+    expected_lines = {(c0, "RECEIVED", p1): 2, (c1, "CREATED", p0): 1, (c1, "CREATED", p1): 2}
+    mismatches = []
+    for what, actual, expected in (
+        ("stock of " + p0, stocks.get(p0), initial_stock),
+        ("stock of " + p1, stocks.get(p1), 0),
+        ("cart lines", lines, expected_lines),
+    ):
+        if actual != expected:
+            mismatches.append((what, actual, expected))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that failing commands in batch mode only undo themselves.")
+    parser.add_argument("--config", default="database.cfg")
+    args = parser.parse_args()
+
+    setup = Mp2Client(config_filename=args.config)
+    setup.connect()
+    prefix = fixtures.new_prefix("batch")
+    initial_stock = 2
+    catalog = fixtures.seed_catalog(setup.conn, prefix, product_count=2, customer_count=2, stock_count=initial_stock, product_weight=1)
+    drop_fault = fail_heartbeats(setup.conn, prefix, catalog["sellers"][0])
+    try:
+        script = BATCH.format(
+            s0=catalog["sellers"][0], p0=catalog["products"][0], p1=catalog["products"][1],
+            c0=catalog["customers"][0], c1=catalog["customers"][1], plan_id=fixtures.FIXTURE_PLAN_ID
+        )
+        client = Mp2Client(config_filename=args.config)
+        client.heartbeat_interval = 0
+        try:
+            cli.run_batch(client, io.StringIO(script), batch_size=100)
+        finally:
+            client.close()
+
+        mismatches = verify(setup.conn, catalog, initial_stock)
+        for what, actual, expected in mismatches:
+            print(f"MISMATCH {what}|{actual}|expected {expected}")
+        print("batch savepoint check: %s" % ("FAILED" if mismatches else "OK"))
+    finally:
+        setup.conn.rollback()
+        with setup.conn.cursor() as cursor:
+            cursor.execute(drop_fault)
+        setup.conn.commit()
+        fixtures.cleanup(setup.conn, prefix)
+        setup.close()
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
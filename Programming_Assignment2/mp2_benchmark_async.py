@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fixtures
+from async_mp2 import AsyncMp2Client
+from config import read_config
+from mp2 import Mp2Client
+from pool import create_pool
+
+
+"""
+    One customer session: a few change_cart calls followed by purchase_cart, repeated rounds times.
+    Returns the number of operations executed.
+"""
+def sync_session(config_filename, pool, catalog, customer_id, rounds):
+    client = Mp2Client(config_filename=config_filename, pool=pool)
+    seller_id = catalog["sellers"][0]
+    operations = 0
+    for _ in range(rounds):
+        for product_id in catalog["products"][:3]:
+            with client.borrow():
+                client.change_cart(customer_id, product_id, seller_id, 1)
+            operations += 1
+        with client.borrow():
+            client.purchase_cart(customer_id)
+        operations += 1
+    return operations
+
+
+async def async_session(client, catalog, customer_id, rounds):
+    seller_id = catalog["sellers"][0]
+    operations = 0
+    for _ in range(rounds):
+        for product_id in catalog["products"][:3]:
+            await client.change_cart(customer_id, product_id, seller_id, 1)
+            operations += 1
+        await client.purchase_cart(customer_id)
+        operations += 1
+    return operations
+
+
+def run_sync(args, catalog, customers):
+    pool = create_pool(
+        read_config(filename=args.config, section="postgresql"),
+        read_config(filename=args.config, section="pool", required=False)
+    )
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            futures = [
+                executor.submit(sync_session, args.config, pool, catalog, customer_id, args.rounds)
+                for customer_id in customers
+            ]
+            operations = sum(future.result() for future in futures)
+        return operations, time.perf_counter() - started
+    finally:
+        pool.closeall()
+
+
+async def run_async(args, catalog, customers):
+    client = await AsyncMp2Client.create(args.config)
+    try:
+        started = time.perf_counter()
+        results = await asyncio.gather(*[
+            async_session(client, catalog, customer_id, args.rounds) for customer_id in customers
+        ])
+        return sum(results), time.perf_counter() - started
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator comparing Mp2Client (threads) with AsyncMp2Client (asyncio).")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--sessions", type=int, default=1000, help="concurrent customer sessions per client")
+    parser.add_argument("--rounds", type=int, default=3, help="cart rounds per session")
+    parser.add_argument("--threads", type=int, default=32, help="worker threads of the sync client")
+    args = parser.parse_args()
+
+    setup = Mp2Client(config_filename=args.config)
+    setup.connect()
+    prefix = fixtures.new_prefix("asyncbench")
+    catalog = fixtures.seed_catalog(setup.conn, prefix, product_count=3, customer_count=args.sessions * 2)
+
+    try:
+        sync_customers = catalog["customers"][:args.sessions]
+        async_customers = catalog["customers"][args.sessions:]
+
+        print("Client|Sessions|Operations|Seconds|Ops/s")
+        operations, elapsed = run_sync(args, catalog, sync_customers)
+        print(f"Mp2Client ({args.threads} threads)|{args.sessions}|{operations}|{elapsed:.2f}|{operations / elapsed:.1f}")
+        operations, elapsed = asyncio.run(run_async(args, catalog, async_customers))
+        print(f"AsyncMp2Client|{args.sessions}|{operations}|{elapsed:.2f}|{operations / elapsed:.1f}")
+    finally:
+        fixtures.cleanup(setup.conn, prefix)
+        setup.close()
+
+
+if __name__ == "__main__":
+    main()
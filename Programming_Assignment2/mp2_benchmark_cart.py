@@ -0,0 +1,156 @@
+import argparse
+import statistics
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import fixtures
+from mp2 import Mp2Client
+
+
+"""
+    Cursor that counts every statement sent to the server.
+"""
+class CountingCursor(psycopg2.extensions.cursor):
+    round_trips = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.round_trips += 1
+        return super().execute(query, vars)
+
+
+"""
+    Per-line purchase_cart as it was before the set-based rewrite, kept for comparison.
+"""
+def legacy_purchase_cart(conn, customer_id):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT order_id FROM orders WHERE customer_id = %s AND status = 'CREATED'",
+            (customer_id,)
+        )
+        order_id = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT product_id, seller_id, amount FROM shopping_carts WHERE order_id = %s",
+            (order_id,)
+        )
+        cart_items = cursor.fetchall()
+        for product_id, seller_id, amount in cart_items:
+            cursor.execute(
+                "SELECT stock_count FROM stocks WHERE product_id = %s AND seller_id = %s",
+                (product_id, seller_id)
+            )
+            if cursor.fetchone()[0] < amount:
+                conn.rollback()
+                return False
+        for product_id, seller_id, amount in cart_items:
+            cursor.execute(
+                "UPDATE stocks SET stock_count = stock_count - %s WHERE product_id = %s AND seller_id = %s",
+                (amount, product_id, seller_id)
+            )
+        cursor.execute(
+            "UPDATE orders SET status = 'RECEIVED', order_time = NOW() WHERE order_id = %s",
+            (order_id,)
+        )
+    conn.commit()
+    return True
+
+
+"""
+    Per-order, per-line ship as it was before the set-based rewrite, kept for comparison.
+"""
+def legacy_ship(conn, order_ids):
+    with conn.cursor() as cursor:
+        for order_id in order_ids:
+            cursor.execute("SELECT COUNT(*) FROM orders WHERE order_id = %s", (order_id,))
+            if cursor.fetchone()[0] == 0:
+                conn.rollback()
+                return False
+            cursor.execute(
+                "SELECT product_id, seller_id, amount FROM shopping_carts WHERE order_id = %s",
+                (order_id,)
+            )
+            items = cursor.fetchall()
+            for product_id, seller_id, amount in items:
+                cursor.execute(
+                    "SELECT stock_count FROM stocks WHERE product_id = %s AND seller_id = %s",
+                    (product_id, seller_id)
+                )
+                if cursor.fetchone()[0] < amount:
+                    conn.rollback()
+                    return False
+            for product_id, seller_id, amount in items:
+                cursor.execute(
+                    "UPDATE stocks SET stock_count = stock_count - %s WHERE product_id = %s AND seller_id = %s",
+                    (amount, product_id, seller_id)
+                )
+            cursor.execute(
+                "UPDATE orders SET status = 'SHIPPED', shipping_time = NOW() WHERE order_id = %s",
+                (order_id,)
+            )
+    conn.commit()
+    return True
+
+
+"""
+    Runs operation(args) for every prepared input and returns (latencies in ms, statements per call).
+"""
+def measure(operation, inputs):
+    latencies = []
+    CountingCursor.round_trips = 0
+    for args in inputs:
+        started = time.perf_counter()
+        operation(args)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies, CountingCursor.round_trips / len(inputs)
+
+
+def print_result(name, latencies, round_trips):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{name}|{round_trips:.1f}|{statistics.mean(latencies):.3f}|{statistics.median(latencies):.3f}|{p95:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-line and set-based purchase_cart/ship.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--lines", type=int, default=30, help="cart lines per order")
+    parser.add_argument("--orders", type=int, default=10, help="orders per ship command")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    client = Mp2Client(config_filename=args.config)
+    client.connect()
+    conn = client.conn
+    conn.cursor_factory = CountingCursor
+
+    prefix = fixtures.new_prefix("cartbench")
+    catalog = fixtures.seed_catalog(conn, prefix, product_count=args.lines, customer_count=args.iterations * 2 + 1)
+    seller_id = catalog["sellers"][0]
+    items = [(product_id, seller_id, 1) for product_id in catalog["products"]]
+
+    try:
+        legacy_customers = catalog["customers"][:args.iterations]
+        set_customers = catalog["customers"][args.iterations:-1]
+        for customer_id in legacy_customers + set_customers:
+            fixtures.create_cart(conn, customer_id, items)
+
+        # shipped orders belong to a customer whose carts are not purchased above
+        ship_customer = catalog["customers"][-1]
+        ship_batches = []
+        for _ in range(args.iterations * 2):
+            ship_batches.append([fixtures.create_cart(conn, ship_customer, items) for _ in range(args.orders)])
+
+        print("Operation|Statements/Call|Mean ms|Median ms|P95 ms")
+        print_result("purchase_cart (per line)", *measure(lambda c: legacy_purchase_cart(conn, c), legacy_customers))
+        print_result("purchase_cart (set-based)", *measure(lambda c: client.purchase_cart(c), set_customers))
+        print_result("ship (per line)", *measure(lambda o: legacy_ship(conn, o), ship_batches[:args.iterations]))
+        print_result("ship (set-based)", *measure(lambda o: client.ship(o), ship_batches[args.iterations:]))
+    finally:
+        conn.cursor_factory = psycopg2.extensions.cursor
+        fixtures.cleanup(conn, prefix)
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import time
+from collections import Counter
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+
+import fixtures
+from mp2 import SHIP_ALL_OR_NOTHING, SHIP_FAILED, SHIP_PER_ORDER, SHIP_SHIPPED, Mp2Client
+from mp2_benchmark_cart import CountingCursor, legacy_ship
+
+
+"""
+    Creates a wave of CREATED orders. Every scarce_every-th order also needs one item of the scarce product,
+    whose stock only covers half of those orders.
+    Returns the order ids.
+"""
+def create_wave(conn, customer_id, items, scarce_item, orders, scarce_every):
+    order_ids = fixtures.create_carts(conn, customer_id, items, orders)
+    if scarce_every <= 0:
+        return order_ids
+
+    scarce_orders = order_ids[::scarce_every]
+    product_id, seller_id = scarce_item
+    with conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            "INSERT INTO shopping_carts (order_id, product_id, seller_id, amount) VALUES %s",
+            [(order_id, product_id, seller_id, 1) for order_id in scarce_orders],
+            page_size=1000
+        )
+        cursor.execute(
+            "UPDATE stocks SET stock_count = %s WHERE product_id = %s AND seller_id = %s",
+            (len(scarce_orders) // 2, product_id, seller_id)
+        )
+    conn.commit()
+    return order_ids
+
+
+def legacy_report(conn, order_ids):
+    result = SHIP_SHIPPED if legacy_ship(conn, order_ids) else SHIP_FAILED
+    return [(order_id, result) for order_id in order_ids]
+
+
+def measure(name, operation, order_ids):
+    CountingCursor.round_trips = 0
+    started = time.perf_counter()
+    report = operation(order_ids)
+    elapsed = time.perf_counter() - started
+
+    results = Counter(result for _, result in report)
+    not_shipped = ",".join("%s=%d" % (result, count) for result, count in sorted(results.items()) if result != SHIP_SHIPPED)
+    print(f"{name}|{len(order_ids)}|{CountingCursor.round_trips}|{elapsed:.3f}|{len(order_ids) / elapsed:.0f}|"
+          f"{results[SHIP_SHIPPED]}|{not_shipped or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-order ship with the bulk ship engine on large waves.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--orders", type=int, default=10000, help="orders per wave")
+    parser.add_argument("--lines", type=int, default=3, help="cart lines per order")
+    parser.add_argument("--scarce-every", type=int, default=10,
+                        help="every n-th order of the partial waves needs a product stocked for only half of them")
+    parser.add_argument("--skip-legacy", action="store_true", help="do not run the per-order, per-line ship")
+    args = parser.parse_args()
+
+    client = Mp2Client(config_filename=args.config)
+    client.connect()
+    conn = client.conn
+    conn.cursor_factory = CountingCursor
+
+    prefix = fixtures.new_prefix("shipbench")
+    catalog = fixtures.seed_catalog(conn, prefix, product_count=args.lines + 2, customer_count=1)
+    seller_id = catalog["sellers"][0]
+    customer_id = catalog["customers"][0]
+    items = [(product_id, seller_id, 1) for product_id in catalog["products"][:args.lines]]
+    scarce_items = [(product_id, seller_id) for product_id in catalog["products"][args.lines:]]
+
+    try:
+        print("Operation|Orders|Statements|Seconds|Orders/s|Shipped|Not shipped")
+
+        if not args.skip_legacy:
+            order_ids = create_wave(conn, customer_id, items, None, args.orders, 0)
+            measure("ship (per order, per line)", lambda o: legacy_report(conn, o), order_ids)
+
+        order_ids = create_wave(conn, customer_id, items, None, args.orders, 0)
+        measure("ship_orders all_or_nothing", lambda o: client.ship_orders(o, mode=SHIP_ALL_OR_NOTHING)[1], order_ids)
+
+        order_ids = create_wave(conn, customer_id, items, scarce_items[0], args.orders, args.scarce_every)
+        measure("ship_orders all_or_nothing, scarce stock", lambda o: client.ship_orders(o, mode=SHIP_ALL_OR_NOTHING)[1], order_ids)
+
+        order_ids = create_wave(conn, customer_id, items, scarce_items[1], args.orders, args.scarce_every)
+        measure("ship_orders per_order, scarce stock", lambda o: client.ship_orders(o, mode=SHIP_PER_ORDER)[1], order_ids)
+    finally:
+        conn.cursor_factory = psycopg2.extensions.cursor
+        fixtures.cleanup(conn, prefix)
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import json
+import sys
+
+import psycopg2
+
+from config import read_config
+from mp2 import STATEMENTS
+
+
+"""
+    Yields every node of an EXPLAIN (FORMAT JSON) plan tree.
+"""
+def walk_plan(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk_plan(child)
+
+
+"""
+    Returns the estimated row count of every ordinary table, keyed by table name.
+"""
+def table_sizes(cursor):
+    cursor.execute(
+        "SELECT c.relname, c.reltuples FROM pg_class c "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relkind IN ('r', 'p') AND n.nspname = current_schema()"
+    )
+    return {name: rows for name, rows in cursor.fetchall()}
+
+
+"""
+    Returns the generic plan of a registered statement as used by repeated EXECUTEs.
+    plan_cache_mode = force_generic_plan makes the planner ignore parameter values, so NULL is passed for all of them.
+"""
+def generic_plan(cursor, name):
+    STATEMENTS.prepare(cursor, name)
+    cursor.execute(
+        "SELECT COALESCE(array_length(parameter_types, 1), 0) FROM pg_prepared_statements WHERE name = %s",
+        (name.lower(),)
+    )
+    param_count = cursor.fetchone()[0]
+
+    cursor.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+    if param_count:
+        cursor.execute("EXPLAIN (FORMAT JSON) EXECUTE %s (%s)" % (name, ", ".join(["NULL"] * param_count)))
+    else:
+        cursor.execute("EXPLAIN (FORMAT JSON) EXECUTE %s" % name)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+"""
+    Checks the plans of all registered Mp2Client statements.
+    Returns list of (statement name, table name, estimated rows) for sequential scans of tables with more than min_rows rows.
+"""
+def check_statements(conn, min_rows, allowed=()):
+    violations = []
+    with conn.cursor() as cursor:
+        sizes = table_sizes(cursor)
+        for name in STATEMENTS.names():
+            if name in allowed:
+                continue
+            for node in walk_plan(generic_plan(cursor, name)):
+                if node["Node Type"] != "Seq Scan":
+                    continue
+                table = node["Relation Name"]
+                if sizes.get(table, 0) > min_rows:
+                    violations.append((name, table, int(sizes[table])))
+    conn.rollback()
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if any Mp2Client statement plans a sequential scan on a large table.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--min-rows", type=int, default=1000, help="tables above this row estimate must not be seq scanned")
+    parser.add_argument("--allow", default="all_plans", help="comma separated statements that may scan whole tables")
+    parser.add_argument("--analyze", action="store_true", help="refresh table statistics first")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    try:
+        if args.analyze:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            conn.autocommit = False
+
+        violations = check_statements(conn, args.min_rows, allowed=set(filter(None, args.allow.split(","))))
+    finally:
+        conn.close()
+
+    for name, table, rows in violations:
+        print(f"SEQ SCAN {name}|{table}|~{rows} rows")
+    print(f"{len(violations)} sequential scan(s) on tables above {args.min_rows} rows")
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import sys
+
+from psycopg2 import sql
+
+from mp2 import Mp2Client
+from streaming import FORMATS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a view or query result through a server-side cursor as text, csv or jsonl.")
+    parser.add_argument("--config", default="database.cfg")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--view", help="view or table to export, e.g. orders or order_history")
+    source.add_argument("--query", help="SELECT statement to export instead of a view")
+    parser.add_argument("--format", choices=sorted(FORMATS), help="output format, defaults to [output] format of the config")
+    parser.add_argument("--itersize", type=int, help="rows fetched per round trip")
+    parser.add_argument("--chunk-size", type=int, help="rows written per output chunk")
+    parser.add_argument("--output", metavar="FILE", help="write to FILE instead of stdout")
+    args = parser.parse_args()
+
+    client = Mp2Client(config_filename=args.config)
+    if args.format:
+        client.output_format = args.format
+    if args.itersize:
+        client.itersize = args.itersize
+    if args.chunk_size:
+        client.chunk_size = args.chunk_size
+
+    query = args.query or sql.SQL("SELECT * FROM {}").format(sql.Identifier(*args.view.split(".")))
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        with client.borrow():
+            count, message = client.stream(query, out=out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        client.close()
+
+    if count is None:
+        print(message, file=sys.stderr)
+        sys.exit(1)
+    print(f"{count} rows exported", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
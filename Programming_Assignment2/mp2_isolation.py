@@ -0,0 +1,377 @@
+import argparse
+import threading
+import time
+from collections import Counter
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import errorcodes
+
+import fixtures
+from config import read_config
+from mp2_transaction_reader import read_plans
+from mp2_transaction_writer import write_plan
+
+
+"""
+    Isolation levels from the cheapest to the strictest.
+"""
+LEVELS = {
+    "read_committed": psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED,
+    "repeatable_read": psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ,
+    "serializable": psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE,
+}
+
+# plans created by the scenarios use ids from this range
+PLAN_ID_BASE = 353000
+PLAN_ID_COUNT = 1000
+
+"""
+    Scenarios each Mp2Client operation is exposed to; an operation needs the cheapest level that shows none of them.
+    - show_cart finds the cart, then reads its lines with a second statement.
+    - subscribe compares two plans read in separate statements before changing the seller.
+    - change_stock and purchase_cart check the stocks of a seller and then decrement them; two of them running
+      side by side on different stock rows of one seller are the write_skew scenario.
+    - The other operations read or write with a single statement and are not exposed to any scenario; they are
+      reported as not measured instead of being recommended a level.
+"""
+OPERATION_SCENARIOS = {
+    "show_cart": ["non_repeatable_read", "phantom"],
+    "subscribe": ["non_repeatable_read"],
+    "change_stock": ["write_skew"],
+    "purchase_cart": ["write_skew"],
+    "show_plans": [],
+    "show_subscription": [],
+    "sign_in": [],
+    "change_cart": [],
+    "ship": [],
+}
+
+
+"""
+    Runs the steps of several threads in a fixed global order.
+    - order lists "actor:step" names. step(name) blocks until every earlier step in the order is complete;
+      a step is complete when its actor reaches its next step or finishes.
+    - finish(actor) completes the actor's current step and skips its remaining ones, so an actor that fails
+      halfway (e.g. with a serialization failure) does not block the others.
+"""
+class Schedule:
+    def __init__(self, order, timeout=30.0):
+        self.order = list(order)
+        self.timeout = timeout
+        self.position = 0
+        self.running = {}
+        self.finished = set()
+        self._condition = threading.Condition()
+
+    def step(self, name):
+        actor = name.split(":", 1)[0]
+        index = self.order.index(name)
+        with self._condition:
+            self._complete(actor)
+            if not self._condition.wait_for(lambda: self.position >= index, self.timeout):
+                raise TimeoutError("step %s did not get its turn" % name)
+            self.running[actor] = index
+
+    def finish(self, actor):
+        with self._condition:
+            self.running.pop(actor, None)
+            self.finished.update(i for i, name in enumerate(self.order) if name.split(":", 1)[0] == actor)
+            self._advance()
+
+    def _complete(self, actor):
+        index = self.running.pop(actor, None)
+        if index is not None:
+            self.finished.add(index)
+            self._advance()
+
+    def _advance(self):
+        while self.position < len(self.order) and self.position in self.finished:
+            self.position += 1
+        self._condition.notify_all()
+
+
+"""
+    Base class of the scenarios. Subclasses define the actors' steps, the default interleaving and the anomaly check.
+    - actors maps an actor name to a method called as method(conn, schedule, state) in its own thread.
+    - Actor methods call schedule.step("actor:step") before every step, including the commit.
+"""
+class Scenario:
+    name = None
+    order = []
+    actors = {}
+
+    def setup(self, conn, prefix):
+        pass
+
+    def cleanup(self, conn, prefix):
+        pass
+
+    """
+        Returns True if the finished run shows the anomaly.
+    """
+    def anomaly(self, state):
+        raise NotImplementedError
+
+
+"""
+    A row read twice by one transaction changes because another transaction updated it in between.
+"""
+class NonRepeatableRead(Scenario):
+    name = "non_repeatable_read"
+    order = ["reader:read_1", "writer:update", "writer:commit", "reader:read_2", "reader:commit"]
+
+    def setup(self, conn, prefix):
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO plans (plan_id, name, max_parallel_sessions) VALUES (%s, 'isolation', 10) "
+                "ON CONFLICT (plan_id) DO UPDATE SET max_parallel_sessions = 10",
+                (PLAN_ID_BASE,)
+            )
+        conn.commit()
+
+    def reader(self, conn, schedule, state):
+        with conn.cursor() as cursor:
+            schedule.step("reader:read_1")
+            cursor.execute("SELECT max_parallel_sessions FROM plans WHERE plan_id = %s", (PLAN_ID_BASE,))
+            state["read_1"] = cursor.fetchone()[0]
+            schedule.step("reader:read_2")
+            cursor.execute("SELECT max_parallel_sessions FROM plans WHERE plan_id = %s", (PLAN_ID_BASE,))
+            state["read_2"] = cursor.fetchone()[0]
+        schedule.step("reader:commit")
+        conn.commit()
+
+    def writer(self, conn, schedule, state):
+        with conn.cursor() as cursor:
+            schedule.step("writer:update")
+            cursor.execute("UPDATE plans SET max_parallel_sessions = max_parallel_sessions + 1 WHERE plan_id = %s", (PLAN_ID_BASE,))
+        schedule.step("writer:commit")
+        conn.commit()
+
+    actors = {"reader": reader, "writer": writer}
+
+    def anomaly(self, state):
+        return "read_2" in state and state["read_1"] != state["read_2"]
+
+
+"""
+    A query run twice by one transaction returns a new row inserted by another transaction in between.
+    The two sides are the reader and writer scripts of the assignment, driven through their pause callbacks.
+"""
+class Phantom(Scenario):
+    name = "phantom"
+    order = ["reader:read_1", "writer:insert", "writer:commit", "reader:read_2", "writer:done", "reader:done"]
+
+    def reader(self, conn, schedule, state):
+        conn.close()
+        steps = iter(["reader:read_2", "reader:done"])
+        schedule.step("reader:read_1")
+        state["before"], state["after"] = read_plans(
+            state["level"], state["config"], pause=lambda prompt: schedule.step(next(steps)), verbose=False
+        )
+
+    def writer(self, conn, schedule, state):
+        conn.close()
+        steps = iter(["writer:commit", "writer:done"])
+        schedule.step("writer:insert")
+        state["plan_id"] = write_plan(
+            state["level"], state["config"], pause=lambda prompt: schedule.step(next(steps)), verbose=False,
+            plan_id=PLAN_ID_BASE + 1 + state["run"] % (PLAN_ID_COUNT - 1)
+        )
+
+    actors = {"reader": reader, "writer": writer}
+
+    def cleanup(self, conn, prefix):
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM plans WHERE plan_id > %s AND plan_id < %s", (PLAN_ID_BASE, PLAN_ID_BASE + PLAN_ID_COUNT))
+        conn.commit()
+
+    def anomaly(self, state):
+        return "after" in state and set(state["before"]) != set(state["after"])
+
+
+"""
+    Two transactions each check that a seller keeps at least one item over two stock rows, then each takes the
+    last item of a different row. Both checks pass on their own snapshot and together they break the invariant.
+"""
+class WriteSkew(Scenario):
+    name = "write_skew"
+    order = ["first:check", "second:check", "first:take", "second:take", "first:commit", "second:commit"]
+
+    def setup(self, conn, prefix):
+        self.catalog = fixtures.seed_catalog(conn, prefix, product_count=2, stock_count=1)
+
+    def reset(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE stocks SET stock_count = 1 WHERE seller_id = %s", (self.catalog["sellers"][0],))
+        conn.commit()
+
+    def take(self, conn, schedule, actor, product_id, state):
+        seller_id = self.catalog["sellers"][0]
+        with conn.cursor() as cursor:
+            schedule.step(actor + ":check")
+            cursor.execute("SELECT SUM(stock_count) FROM stocks WHERE seller_id = %s", (seller_id,))
+            total = cursor.fetchone()[0]
+            schedule.step(actor + ":take")
+            if total - 1 >= 1:
+                cursor.execute(
+                    "UPDATE stocks SET stock_count = stock_count - 1 WHERE product_id = %s AND seller_id = %s",
+                    (product_id, seller_id)
+                )
+        schedule.step(actor + ":commit")
+        conn.commit()
+
+    def first(self, conn, schedule, state):
+        self.take(conn, schedule, "first", self.catalog["products"][0], state)
+
+    def second(self, conn, schedule, state):
+        self.take(conn, schedule, "second", self.catalog["products"][1], state)
+
+    actors = {"first": first, "second": second}
+
+    def anomaly(self, state):
+        return state["final_total"] < 1
+
+    def check(self, conn, state):
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT SUM(stock_count) FROM stocks WHERE seller_id = %s", (self.catalog["sellers"][0],))
+            state["final_total"] = cursor.fetchone()[0]
+        conn.rollback()
+        self.reset(conn)
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (NonRepeatableRead, Phantom, WriteSkew)}
+
+
+"""
+    Runs one interleaving of the scenario under the isolation level.
+    Returns (anomaly, dict of actor -> failure cause or None).
+"""
+def run_once(scenario, conn_params, config_filename, level, order, run):
+    schedule = Schedule(order)
+    state = {"level": LEVELS[level], "config": config_filename, "run": run}
+    failures = {}
+
+    def run_actor(actor, method):
+        conn = psycopg2.connect(**conn_params)
+        try:
+            conn.set_session(isolation_level=LEVELS[level])
+            with conn.cursor() as cursor:
+                cursor.execute("SET lock_timeout = '5s'")
+            conn.commit()
+            method(scenario, conn, schedule, state)
+            failures[actor] = None
+        except psycopg2.Error as e:
+            failures[actor] = errorcodes.lookup(e.pgcode).lower() if e.pgcode else type(e).__name__
+        finally:
+            schedule.finish(actor)
+            if not conn.closed:
+                conn.rollback()
+                conn.close()
+
+    threads = [threading.Thread(target=run_actor, args=item) for item in scenario.actors.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return state, failures
+
+
+"""
+    Runs the scenario runs times under the level. Returns a dict of counts and timings.
+"""
+def run_scenario(scenario, conn, conn_params, config_filename, level, order, runs):
+    anomalies = 0
+    causes = Counter()
+    started = time.perf_counter()
+    for run in range(runs):
+        state, failures = run_once(scenario, conn_params, config_filename, level, order, run)
+        if hasattr(scenario, "check"):
+            scenario.check(conn, state)
+        if scenario.anomaly(state):
+            anomalies += 1
+        causes.update(cause for cause in failures.values() if cause)
+        scenario.cleanup(conn, None)
+    elapsed = time.perf_counter() - started
+    return {
+        "runs": runs,
+        "anomalies": anomalies,
+        "serialization_failures": causes["serialization_failure"],
+        "causes": causes,
+        "runs_per_second": runs / elapsed,
+    }
+
+
+"""
+    Returns the cheapest level of every Mp2Client operation that showed no anomaly in the scenarios it is exposed to.
+    - A level is only considered if all of the operation's scenarios ran under it.
+    - Operations without scenarios, or whose scenarios did not run, are left out; None means that every level
+      that ran showed an anomaly.
+"""
+def recommend(results):
+    recommendations = {}
+    for operation, scenarios in OPERATION_SCENARIOS.items():
+        if not scenarios:
+            continue
+        measured = [level for level in LEVELS if all((scenario, level) in results for scenario in scenarios)]
+        if not measured:
+            continue
+        recommendations[operation] = next(
+            (level for level in measured if all(results[(scenario, level)]["anomalies"] == 0 for scenario in scenarios)),
+            None
+        )
+    return recommendations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scripted reader/writer interleavings under each isolation level.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--levels", default=",".join(LEVELS))
+    parser.add_argument("--runs", type=int, default=20, help="runs per scenario and level")
+    parser.add_argument("--interleaving", default=None,
+                        help="comma separated actor:step order replacing the default one, only with a single scenario")
+    args = parser.parse_args()
+
+    scenario_names = args.scenarios.split(",")
+    if args.interleaving and len(scenario_names) != 1:
+        parser.error("--interleaving needs exactly one scenario")
+
+    conn_params = read_config(filename=args.config, section="postgresql")
+    conn = psycopg2.connect(**conn_params)
+    prefix = fixtures.new_prefix("isolation")
+    results = {}
+    try:
+        print("Scenario|Level|Runs|Anomalies|Serialization failures|Runs/s|Other failures")
+        for name in scenario_names:
+            scenario = SCENARIOS[name]()
+            order = args.interleaving.split(",") if args.interleaving else scenario.order
+            if sorted(order) != sorted(scenario.order):
+                parser.error("interleaving of %s must order exactly: %s" % (name, ",".join(scenario.order)))
+            scenario.setup(conn, prefix)
+            try:
+                for level in args.levels.split(","):
+                    result = results[(name, level)] = run_scenario(scenario, conn, conn_params, args.config, level, order, args.runs)
+                    other = ",".join("%s=%d" % item for item in sorted(result["causes"].items()) if item[0] != "serialization_failure")
+                    print(f"{name}|{level}|{result['runs']}|{result['anomalies']}|{result['serialization_failures']}|"
+                          f"{result['runs_per_second']:.1f}|{other or '-'}")
+            finally:
+                scenario.cleanup(conn, prefix)
+
+        print("Operation|Cheapest correct level")
+        recommendations = recommend(results)
+        for operation in OPERATION_SCENARIOS:
+            if operation not in recommendations:
+                print(f"{operation}|not measured")
+            else:
+                print(f"{operation}|{recommendations[operation] or 'none'}")
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM plans WHERE plan_id >= %s AND plan_id < %s", (PLAN_ID_BASE, PLAN_ID_BASE + PLAN_ID_COUNT))
+        conn.commit()
+        fixtures.cleanup(conn, prefix)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import argparse
+import time
+
+from mp2 import Mp2Client
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Release seller sessions of crashed clients whose heartbeat expired.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--interval", type=float, default=60, help="seconds between two reaper runs")
+    parser.add_argument("--once", action="store_true", help="reap once and exit")
+    args = parser.parse_args()
+
+    client = Mp2Client(config_filename=args.config)
+    try:
+        while True:
+            with client.borrow():
+                released = client.reap_sessions()
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')}|released {released} sessions older than {client.session_ttl:g} s", flush=True)
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
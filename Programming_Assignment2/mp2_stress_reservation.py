@@ -0,0 +1,133 @@
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+from collections import Counter
+
+import fixtures
+from mp2 import Mp2Client
+from seller import Seller
+
+
+"""
+    Worker process: every iteration either buys a random cart of hot products or lets a seller change a stock.
+    Cart items are created in random order so that naive locking would deadlock.
+    Returns (outcome counts, applied stock deltas per (product_id, seller_id)).
+"""
+def worker(config_filename, catalog, customer_id, iterations, max_cart_lines, seed):
+    rng = random.Random(seed)
+    client = Mp2Client(config_filename=config_filename)
+    client.connect()
+
+    outcomes = Counter()
+    applied = Counter()
+    try:
+        for _ in range(iterations):
+            if rng.random() < 0.2:
+                product_id = rng.choice(catalog["products"])
+                seller = Seller(rng.choice(catalog["sellers"]))
+                change = rng.choice((-2, -1, 1, 2, 3))
+                success, message = client.change_stock(seller=seller, product_id=product_id, change_amount=change)
+                outcomes["change_stock " + ("OK" if success else message)] += 1
+                if success:
+                    applied[(product_id, seller.seller_id)] += change
+                continue
+
+            lines = rng.sample(
+                [(p, s) for p in catalog["products"] for s in catalog["sellers"]],
+                rng.randint(1, max_cart_lines)
+            )
+            items = [(product_id, seller_id, rng.randint(1, 3)) for product_id, seller_id in lines]
+            fixtures.create_cart(client.conn, customer_id, items)
+            success, message = client.purchase_cart(customer_id)
+            outcomes["purchase_cart " + ("OK" if success else message)] += 1
+            if not success:
+                # drop the unpurchased cart so the next iteration starts with a new one
+                with client.conn.cursor() as cursor:
+                    cursor.execute("DELETE FROM orders WHERE customer_id = %s AND status = 'CREATED'", (customer_id,))
+                client.conn.commit()
+    finally:
+        client.close()
+    return outcomes, applied
+
+
+"""
+    Compares final stocks with initial stock + applied changes - purchased amounts. Returns list of violations.
+"""
+def verify(conn, prefix, initial_stock, applied):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT s.product_id, s.seller_id, s.stock_count, "
+            "       COALESCE(SUM(sc.amount) FILTER (WHERE o.status = 'RECEIVED'), 0) "
+            "FROM stocks s "
+            "LEFT JOIN shopping_carts sc ON sc.product_id = s.product_id AND sc.seller_id = s.seller_id "
+            "LEFT JOIN orders o ON o.order_id = sc.order_id "
+            "WHERE s.seller_id LIKE %s "
+            "GROUP BY s.product_id, s.seller_id, s.stock_count",
+            (prefix + "-%",)
+        )
+        rows = cursor.fetchall()
+    conn.rollback()
+
+    violations = []
+    for product_id, seller_id, stock_count, purchased in rows:
+        expected = initial_stock + applied[(product_id, seller_id)] - purchased
+        if stock_count < 0 or stock_count != expected:
+            violations.append((product_id, seller_id, stock_count, expected))
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent purchase_cart/change_stock stress test that checks for oversell.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=200, help="operations per process")
+    parser.add_argument("--products", type=int, default=4)
+    parser.add_argument("--sellers", type=int, default=2)
+    parser.add_argument("--stock", type=int, default=100, help="initial stock per stock row")
+    parser.add_argument("--max-cart-lines", type=int, default=4)
+    args = parser.parse_args()
+
+    setup = Mp2Client(config_filename=args.config)
+    setup.connect()
+    prefix = fixtures.new_prefix("stress")
+    catalog = fixtures.seed_catalog(
+        setup.conn, prefix,
+        seller_count=args.sellers, product_count=args.products,
+        customer_count=args.processes, stock_count=args.stock
+    )
+
+    try:
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as workers:
+            results = workers.starmap(worker, [
+                (args.config, catalog, customer_id, args.iterations, args.max_cart_lines, seed)
+                for seed, customer_id in enumerate(catalog["customers"])
+            ])
+        elapsed = time.perf_counter() - started
+
+        outcomes = Counter()
+        applied = Counter()
+        for worker_outcomes, worker_applied in results:
+            outcomes.update(worker_outcomes)
+            applied.update(worker_applied)
+
+        total = sum(outcomes.values())
+        print(f"{total} operations in {elapsed:.2f} s ({total / elapsed:.1f} ops/s)")
+        for outcome, count in sorted(outcomes.items()):
+            print(f"{outcome}|{count}")
+
+        violations = verify(setup.conn, prefix, args.stock, applied)
+        for product_id, seller_id, stock_count, expected in violations:
+            print(f"VIOLATION {product_id}|{seller_id}|stock={stock_count}|expected={expected}")
+        print("oversell violations: %d" % len(violations))
+    finally:
+        fixtures.cleanup(setup.conn, prefix)
+        setup.close()
+
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import fixtures
+from mp2 import Mp2Client
+
+
+"""
+    Worker thread: in every round all workers sign in to the same seller at once, the main thread checks the
+    sessions, then the workers sign out again. A worker "crashes" with probability crash_rate: it keeps its
+    session without heartbeats, which must expire after the session ttl and free its slot again.
+"""
+def worker(client, seller_id, rounds, crash_rate, barrier, lock, admitted, outcomes, seed):
+    rng = random.Random(seed)
+    client.connect()
+    try:
+        for round_number in range(rounds):
+            barrier.wait()
+            seller, message = client.sign_in(seller_id=seller_id, password="password")
+            with lock:
+                outcomes["sign_in " + ("OK" if seller else message)] += 1
+                if seller:
+                    admitted[round_number] += 1
+
+            # the main thread counts sessions between these barriers
+            barrier.wait()
+            barrier.wait()
+
+            if seller and rng.random() >= crash_rate:
+                success, message = client.sign_out(seller=seller)
+                with lock:
+                    outcomes["sign_out " + ("OK" if success else message)] += 1
+            elif seller:
+                with lock:
+                    outcomes["crashed"] += 1
+            barrier.wait()
+    finally:
+        client.close()
+
+
+"""
+    Returns the number of live (not expired) sessions of the seller.
+"""
+def live_sessions(conn, seller_id, ttl):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM seller_sessions "
+            "WHERE seller_id = %s AND heartbeat_at >= NOW() - make_interval(secs => %s)",
+            (seller_id, ttl)
+        )
+        count = cursor.fetchone()[0]
+    conn.rollback()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel sign_in stress test that checks the max_parallel_sessions limit.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--threads", type=int, default=32, help="parallel sign_in calls per round")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=5, help="max_parallel_sessions of the seller's plan")
+    parser.add_argument("--crash-rate", type=float, default=0.1, help="probability that a signed in worker never signs out")
+    parser.add_argument("--ttl", type=float, default=1.0, help="session ttl in seconds, crashed sessions expire after it")
+    args = parser.parse_args()
+
+    setup = Mp2Client(config_filename=args.config)
+    setup.connect()
+    setup.session_ttl = args.ttl
+    prefix = fixtures.new_prefix("sessions")
+    catalog = fixtures.seed_catalog(setup.conn, prefix, product_count=1, max_parallel_sessions=args.limit)
+    seller_id = catalog["sellers"][0]
+
+    barrier = threading.Barrier(args.threads + 1)
+    lock = threading.Lock()
+    admitted = Counter()
+    outcomes = Counter()
+    violations = []
+    threads = []
+    for seed in range(args.threads):
+        client = Mp2Client(config_filename=args.config)
+        client.session_ttl = args.ttl
+        threads.append(threading.Thread(
+            target=worker, args=(client, seller_id, args.rounds, args.crash_rate, barrier, lock, admitted, outcomes, seed)
+        ))
+
+    try:
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        for round_number in range(args.rounds):
+            barrier.wait()
+            barrier.wait()
+            sessions = live_sessions(setup.conn, seller_id, args.ttl)
+            if sessions > args.limit or admitted[round_number] > args.limit:
+                violations.append((round_number, admitted[round_number], sessions))
+            barrier.wait()
+            barrier.wait()
+
+            # let crashed sessions expire, then the reaper releases them
+            time.sleep(args.ttl)
+            outcomes["reaped"] += setup.reap_sessions()
+
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        print(f"{args.rounds} rounds of {args.threads} parallel sign_ins in {elapsed:.2f} s")
+        for outcome, count in sorted(outcomes.items()):
+            print(f"{outcome}|{count}")
+        print("Round|Admitted|Live sessions")
+        for round_number, round_admitted, sessions in violations:
+            print(f"VIOLATION {round_number}|{round_admitted}|{sessions}")
+        print("session limit violations: %d" % len(violations))
+    finally:
+        barrier.abort()
+        fixtures.cleanup(setup.conn, prefix)
+        setup.close()
+
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,26 +18,36 @@ def read_config(filename='database.cfg', section='postgresql'):
 
 
 
-def read_plans(isolation_level, config_filename):
+"""
+    Reads all plans twice in one transaction and prints both results.
+    - pause is called after each read with a prompt; by default it waits for enter, mp2_isolation.py passes
+      callbacks that synchronize with a scripted writer instead.
+    - Returns (plans before, plans after).
+"""
+def read_plans(isolation_level, config_filename, pause=input, verbose=True):
     db_params = read_config(filename=config_filename)
     with psycopg2.connect(**db_params) as conn:
         conn.set_isolation_level(isolation_level)
         with conn.cursor() as cursor:
             cursor.execute("SELECT * FROM plans")
             plans_before = cursor.fetchall()
-            print(f"Plans before commit (Isolation Level: {isolation_level}):")
-            for plan in plans_before:
-                print(plan)
+            if verbose:
+                print(f"Plans before commit (Isolation Level: {isolation_level}):")
+                for plan in plans_before:
+                    print(plan)
             
-            input("Hit enter to continue...\n") 
+            pause("Hit enter to continue...\n") 
 
             cursor.execute("SELECT * FROM plans")
             plans_after = cursor.fetchall()
-            print(f"Plans after commit (Isolation Level: {isolation_level}):")
-            for plan in plans_after:
-                print(plan)
-
-            input("Hit enter to continue...") 
+            if verbose:
+                print(f"Plans after commit (Isolation Level: {isolation_level}):")
+                for plan in plans_after:
+                    print(plan)
+
+            pause("Hit enter to continue...") 
+    conn.close()
+    return plans_before, plans_after
 
 if __name__ == "__main__":
     config_filename = 'database.cfg'
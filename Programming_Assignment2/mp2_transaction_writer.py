@@ -18,9 +18,17 @@ def read_config(filename='database.cfg', section='postgresql'):
     return db_params
 
 
-def write_plan(isolation_level, config_filename):
+"""
+    Inserts a random plan and commits it.
+    - pause is called before and after the commit with a prompt; by default it waits for enter, mp2_isolation.py
+      passes callbacks that synchronize with a scripted reader instead.
+    - Returns the id of the committed plan, or None if an error occurred. With a pause callback the error is
+      raised instead, so that the caller can tell serialization failures from other errors.
+"""
+def write_plan(isolation_level, config_filename, pause=input, verbose=True, plan_id=None):
     db_params = read_config(filename=config_filename)
     conn = psycopg2.connect(**db_params)
+    committed_plan_id = None
     try:
         conn.set_isolation_level(isolation_level)
         cursor = conn.cursor()
@@ -28,24 +36,32 @@ def write_plan(isolation_level, config_filename):
             # Generate random name and max_parallel_sessions
             plan_name = f"Plan_{random.randint(1000, 9999)}"
             max_parallel_sessions = random.randint(6, 20)
-            plan_id = random.randint(1000, 9999)
+            if plan_id is None:
+                plan_id = random.randint(1000, 9999)
 
             cursor.execute(
                 "INSERT INTO plans (plan_id, name, max_parallel_sessions) VALUES (%s, %s, %s)",
                 (plan_id, plan_name, max_parallel_sessions)
             )
-            input("Hit enter to commit a new plan...")  # Wait for reader script to read initial plans
+            pause("Hit enter to commit a new plan...")  # Wait for reader script to read initial plans
             conn.commit()
-            print(f"Commited new plan: {plan_name} with max_parallel_sessions: {max_parallel_sessions}")
-            input("Hit enter to continue...")  # Wait for reader script to read updated plans
+            committed_plan_id = plan_id
+            if verbose:
+                print(f"Commited new plan: {plan_name} with max_parallel_sessions: {max_parallel_sessions}")
+            pause("Hit enter to continue...")  # Wait for reader script to read updated plans
         except Exception as e:
+            if pause is not input:
+                raise
             print("An error occurred:", e)
         finally:
             cursor.close()
     except Exception as e:
+        if pause is not input:
+            raise
         print("An error occurred:", e)
     finally:
         conn.close()
+    return committed_plan_id
 
 
 if __name__ == "__main__":
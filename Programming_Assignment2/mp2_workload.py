@@ -0,0 +1,291 @@
+import argparse
+import bisect
+import json
+import multiprocessing
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import fixtures
+from instrumentation import MetricsRegistry
+from mp2 import Mp2Client
+from seller import Seller
+
+
+"""
+    Default operation mix, relative weights.
+"""
+DEFAULT_MIX = "change_cart=50,purchase_cart=15,ship=10,change_stock=15,sign_in=10"
+
+# failure causes counted as aborts: the transaction was rolled back by the server
+ABORT_CAUSES = ("serialization_failure", "deadlock_detected", "lock_not_available", "query_canceled")
+
+
+"""
+    Samples ranks 0..n-1 with probability proportional to 1 / (rank + 1)^exponent.
+    Rank 0 is the most popular one; exponent 0 gives a uniform distribution.
+"""
+class ZipfSampler:
+    def __init__(self, n, exponent=1.0):
+        self.cumulative = []
+        total = 0.0
+        for rank in range(n):
+            total += 1.0 / (rank + 1) ** exponent
+            self.cumulative.append(total)
+        self.total = total
+
+    def sample(self, rng):
+        return min(bisect.bisect_left(self.cumulative, rng.random() * self.total), len(self.cumulative) - 1)
+
+
+"""
+    Parses "name=weight,..." into (names, cumulative weights) for random.choices.
+"""
+def parse_mix(mix):
+    names = []
+    cumulative = []
+    total = 0.0
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        total += float(weight)
+        names.append(name.strip())
+        cumulative.append(total)
+    return names, cumulative
+
+
+"""
+    Returns up to limit 'RECEIVED' orders of the customers, for ship.
+"""
+def received_orders(conn, customers, limit):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT order_id FROM orders WHERE customer_id = ANY(%s) AND status = 'RECEIVED' LIMIT %s",
+            (customers, limit)
+        )
+        order_ids = [row[0] for row in cursor.fetchall()]
+    conn.rollback()
+    return order_ids
+
+
+"""
+    Runs operations random operations of the mix on one client.
+    - Customers are owned by the worker, products are drawn from the zipf distribution, sellers uniformly.
+    - Returns a dict with latencies and outcomes per operation, retries and failure causes from the client's
+      metrics, and the applied change_stock deltas per (product_id, seller_id).
+"""
+def worker(config_filename, catalog, customers, mix, zipf_exponent, operations, ship_batch, seed):
+    rng = random.Random(seed)
+    names, cumulative = parse_mix(mix)
+    products = catalog["products"]
+    sellers = catalog["sellers"]
+    zipf = ZipfSampler(len(products), zipf_exponent)
+
+    registry = MetricsRegistry()
+    client = Mp2Client(config_filename=config_filename, metrics=registry)
+    client.connect()
+
+    latencies = defaultdict(list)
+    outcomes = Counter()
+    applied = Counter()
+    try:
+        for _ in range(operations):
+            operation = rng.choices(names, cum_weights=cumulative)[0]
+            customer_id = rng.choice(customers)
+
+            if operation == "change_cart":
+                args = (customer_id, products[zipf.sample(rng)], rng.choice(sellers), rng.randint(1, 3))
+                run = lambda: client.change_cart(*args)
+            elif operation == "purchase_cart":
+                run = lambda: client.purchase_cart(customer_id)
+            elif operation == "ship":
+                order_ids = received_orders(client.conn, customers, ship_batch)
+                if not order_ids:
+                    outcomes[(operation, "no orders")] += 1
+                    continue
+                run = lambda: client.ship(order_ids)
+            elif operation == "change_stock":
+                product_id = products[zipf.sample(rng)]
+                seller = Seller(rng.choice(sellers))
+                change = rng.choice((-3, -1, 1, 2, 5))
+                run = lambda: client.change_stock(seller=seller, product_id=product_id, change_amount=change)
+            elif operation == "sign_in":
+                def run():
+                    seller, message = client.sign_in(seller_id=rng.choice(sellers), password="password")
+                    if seller:
+                        client.sign_out(seller=seller)
+                    return seller, message
+            else:
+                raise ValueError("unknown operation in mix: %s" % operation)
+
+            started = time.perf_counter()
+            result, message = run()
+            latencies[operation].append(time.perf_counter() - started)
+            outcomes[(operation, "OK" if result else message)] += 1
+            if operation == "change_stock" and result:
+                applied[(product_id, seller.seller_id)] += change
+    finally:
+        client.close()
+
+    snapshot = registry.snapshot()["counters"]
+    return {
+        "latencies": dict(latencies),
+        "outcomes": outcomes,
+        "applied": applied,
+        "retries": Counter({dict(labels)["operation"]: value for (name, labels), value in snapshot.items()
+                            if name == "mp2_operation_retries_total"}),
+        "causes": Counter({(dict(labels)["operation"], dict(labels)["cause"]): value for (name, labels), value in snapshot.items()
+                           if name == "mp2_operation_failures_total"}),
+    }
+
+
+"""
+    Compares every stock row with initial stock + applied changes - purchased amounts - shipped amounts;
+    purchase_cart and ship both take the ordered items from the stock.
+    Returns list of (product_id, seller_id, stock_count, expected) violations.
+"""
+def verify(conn, prefix, initial_stock, applied):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT s.product_id, s.seller_id, s.stock_count, "
+            "       COALESCE(SUM(sc.amount) FILTER (WHERE o.status IN ('RECEIVED', 'SHIPPED')), 0), "
+            "       COALESCE(SUM(sc.amount) FILTER (WHERE o.status = 'SHIPPED'), 0) "
+            "FROM stocks s "
+            "LEFT JOIN shopping_carts sc ON sc.product_id = s.product_id AND sc.seller_id = s.seller_id "
+            "LEFT JOIN orders o ON o.order_id = sc.order_id "
+            "WHERE s.seller_id LIKE %s "
+            "GROUP BY s.product_id, s.seller_id, s.stock_count",
+            (prefix + "-%",)
+        )
+        rows = cursor.fetchall()
+    conn.rollback()
+
+    violations = []
+    for product_id, seller_id, stock_count, purchased, shipped in rows:
+        expected = initial_stock + applied[(product_id, seller_id)] - purchased - shipped
+        if stock_count < 0 or stock_count != expected:
+            violations.append((product_id, seller_id, stock_count, expected))
+    return violations
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+"""
+    Merges the worker results and returns the report dict.
+"""
+def summarize(results, elapsed, violations):
+    latencies = defaultdict(list)
+    outcomes = Counter()
+    retries = Counter()
+    causes = Counter()
+    for result in results:
+        for operation, values in result["latencies"].items():
+            latencies[operation].extend(values)
+        outcomes.update(result["outcomes"])
+        retries.update(result["retries"])
+        causes.update(result["causes"])
+
+    report = {"elapsed": elapsed, "operations": {}, "oversell_violations": len(violations)}
+    for operation, values in sorted(latencies.items()):
+        values.sort()
+        count = len(values)
+        failures = sum(n for (name, outcome), n in outcomes.items() if name == operation and outcome != "OK")
+        aborts = sum(n for (name, cause), n in causes.items() if name == operation and cause in ABORT_CAUSES)
+        report["operations"][operation] = {
+            "count": count,
+            "throughput": count / elapsed,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "failure_rate": failures / count,
+            "abort_rate": aborts / count,
+            "retry_rate": retries[operation] / count,
+            "outcomes": {outcome: n for (name, outcome), n in sorted(outcomes.items()) if name == operation},
+        }
+    total = sum(len(values) for values in latencies.values())
+    report["throughput"] = total / elapsed
+    return report
+
+
+def print_report(report):
+    print("Operation|Count|Ops/s|p50 ms|p95 ms|p99 ms|Failure rate|Abort rate|Retry rate")
+    for operation, stats in report["operations"].items():
+        print(f"{operation}|{stats['count']}|{stats['throughput']:.1f}|{stats['p50_ms']:.2f}|{stats['p95_ms']:.2f}|"
+              f"{stats['p99_ms']:.2f}|{stats['failure_rate']:.3f}|{stats['abort_rate']:.3f}|{stats['retry_rate']:.3f}")
+    print("Operation|Outcome|Count")
+    for operation, stats in report["operations"].items():
+        for outcome, count in stats["outcomes"].items():
+            print(f"{operation}|{outcome}|{count}")
+    print(f"total throughput: {report['throughput']:.1f} ops/s in {report['elapsed']:.2f} s")
+    print("oversell violations: %d" % report["oversell_violations"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed-operation load test of Mp2Client with zipfian product popularity.")
+    parser.add_argument("--config", default="database.cfg")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--mode", choices=["threads", "processes"], default="processes")
+    parser.add_argument("--operations", type=int, default=1000, help="operations per worker")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation weights, e.g. %s" % DEFAULT_MIX)
+    parser.add_argument("--sellers", type=int, default=10)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--stock", type=int, default=100, help="initial stock per stock row")
+    parser.add_argument("--zipf", type=float, default=1.1, help="zipf exponent of product popularity, 0 for uniform")
+    parser.add_argument("--ship-batch", type=int, default=5, help="orders per ship call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="FILE", help="also write the report as JSON, for comparing runs")
+    args = parser.parse_args()
+
+    setup = Mp2Client(config_filename=args.config)
+    setup.connect()
+    prefix = fixtures.new_prefix("workload")
+    catalog = fixtures.seed_catalog(
+        setup.conn, prefix,
+        seller_count=args.sellers, product_count=args.products,
+        customer_count=max(args.customers, args.workers), stock_count=args.stock
+    )
+
+    try:
+        # every worker owns a disjoint share of the customers
+        tasks = [
+            (args.config, catalog, catalog["customers"][i::args.workers], args.mix, args.zipf,
+             args.operations, args.ship_batch, args.seed * 1000 + i)
+            for i in range(args.workers)
+        ]
+
+        started = time.perf_counter()
+        if args.mode == "processes":
+            with multiprocessing.Pool(args.workers) as workers:
+                results = workers.starmap(worker, tasks)
+        else:
+            with ThreadPoolExecutor(args.workers) as workers:
+                results = list(workers.map(lambda task: worker(*task), tasks))
+        elapsed = time.perf_counter() - started
+
+        applied = Counter()
+        for result in results:
+            applied.update(result["applied"])
+        violations = verify(setup.conn, prefix, args.stock, applied)
+
+        report = summarize(results, elapsed, violations)
+        report["parameters"] = vars(args)
+        print_report(report)
+        for product_id, seller_id, stock_count, expected in violations:
+            print(f"VIOLATION {product_id}|{seller_id}|stock={stock_count}|expected={expected}")
+
+        if args.json:
+            with open(args.json, "w") as report_file:
+                json.dump(report, report_file, indent=2)
+    finally:
+        fixtures.cleanup(setup.conn, prefix)
+        setup.close()
+
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+
+"""
+    Thread-safe pool of PostgreSQL connections shared by one or more Mp2Client objects.
+    - At least minconn connections are kept open, at most maxconn connections exist at the same time.
+    - Idle connections are health checked on checkout and recycled after idle_timeout seconds.
+    - When every connection is in use, getconn waits up to checkout_timeout seconds and then raises PoolError.
+"""
+class ConnectionPool:
+    def __init__(self, conn_params, minconn=1, maxconn=10, idle_timeout=300.0, checkout_timeout=30.0, health_check=True):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("pool size must satisfy 0 <= minconn <= maxconn and maxconn >= 1")
+
+        self.conn_params = conn_params
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check = health_check
+
+        self._lock = threading.Condition()
+        # idle connections as (connection, returned_at) pairs, most recently returned last
+        self._idle = []
+        self._used = set()
+        self._pending = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "created": 0,
+            "recycled": 0,
+            "health_check_failures": 0,
+        }
+        self._close_callbacks = []
+
+        for _ in range(minconn):
+            self._idle.append((self._create(), time.monotonic()))
+
+    """
+        Registers a callable that is invoked with every connection the pool closes.
+        Used by per-connection state (e.g. prepared statements) to drop what belongs to it.
+    """
+    def on_close(self, callback):
+        if callback not in self._close_callbacks:
+            self._close_callbacks.append(callback)
+
+    def _create(self):
+        conn = psycopg2.connect(**self.conn_params)
+        conn.autocommit = False
+        with self._lock:
+            self._stats["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        for callback in self._close_callbacks:
+            callback(conn)
+        if not conn.closed:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    """
+        Returns True if the connection can still run queries.
+    """
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if not self.health_check:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    """
+        Closes idle connections that were not used for idle_timeout seconds, keeping minconn connections open.
+        Must be called with the lock held.
+    """
+    def _recycle_idle(self):
+        if self.idle_timeout is None or self.idle_timeout <= 0:
+            return
+        now = time.monotonic()
+        open_count = len(self._idle) + len(self._used) + self._pending
+        kept = []
+        # oldest connections are at the front of the list
+        for conn, returned_at in self._idle:
+            if open_count > self.minconn and now - returned_at > self.idle_timeout:
+                self._discard(conn)
+                self._stats["recycled"] += 1
+                open_count -= 1
+            else:
+                kept.append((conn, returned_at))
+        self._idle = kept
+
+    """
+        Checks out a connection from the pool.
+        - Raises PoolError if the pool is closed or no connection becomes free within checkout_timeout seconds.
+        - Connecting and health checking happen outside the lock so a slow server does not stall other borrowers.
+    """
+    def getconn(self):
+        deadline = None
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+
+                self._recycle_idle()
+
+                if self._idle:
+                    conn, _ = self._idle.pop()
+                    break
+                if len(self._used) + self._pending < self.maxconn:
+                    conn = None
+                    break
+
+                if deadline is None:
+                    deadline = time.monotonic() + self.checkout_timeout
+                    self._stats["waits"] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolError("connection pool exhausted")
+                wait_started = time.monotonic()
+                self._lock.wait(remaining)
+                self._stats["wait_time"] += time.monotonic() - wait_started
+
+            # reserve the slot until the connection is known to be usable
+            self._pending += 1
+
+        try:
+            if conn is not None and not self._is_healthy(conn):
+                with self._lock:
+                    self._stats["health_check_failures"] += 1
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._create()
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+                self._lock.notify()
+            raise
+
+        with self._lock:
+            self._pending -= 1
+            self._used.add(conn)
+            self._stats["checkouts"] += 1
+        return conn
+
+    """
+        Returns a connection to the pool.
+        - Any open transaction is rolled back so the next borrower starts clean.
+        - Broken connections are closed instead of being kept.
+    """
+    def putconn(self, conn):
+        with self._lock:
+            if conn not in self._used:
+                raise PoolError("trying to put unkeyed connection")
+            self._used.discard(conn)
+
+            if self._closed or conn.closed:
+                self._discard(conn)
+            else:
+                try:
+                    if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                    self._idle.append((conn, time.monotonic()))
+                except psycopg2.Error:
+                    self._discard(conn)
+            self._lock.notify()
+
+    """
+        Closes every idle connection; connections still checked out are closed when they are returned.
+    """
+    def closeall(self):
+        with self._lock:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._idle = []
+            self._lock.notify_all()
+
+    """
+        Returns a snapshot of pool counters and current sizes.
+    """
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = len(self._used)
+            stats["size"] = len(self._idle) + len(self._used) + self._pending
+            stats["minconn"] = self.minconn
+            stats["maxconn"] = self.maxconn
+            return stats
+
+
+"""
+    Builds a ConnectionPool from the [pool] section of the configuration file.
+"""
+def create_pool(conn_params, pool_params):
+    return ConnectionPool(
+        conn_params,
+        minconn=int(pool_params.get("minconn", 1)),
+        maxconn=int(pool_params.get("maxconn", 10)),
+        idle_timeout=float(pool_params.get("idle_timeout", 300)),
+        checkout_timeout=float(pool_params.get("checkout_timeout", 30)),
+        health_check=pool_params.get("health_check", "true").lower() in ("1", "true", "yes", "on"),
+    )
@@ -1,8 +1,15 @@
+"""
+    Signed in seller.
+    - session_count is the slot of the seller's session, 1..max_parallel_sessions of the plan.
+    - session_token identifies the session in seller_sessions; last_heartbeat is the time.monotonic() of its last heartbeat.
+"""
 class Seller:
-    def __init__(self, seller_id="", session_count=0, plan_id=0):
+    def __init__(self, seller_id="", session_count=0, plan_id=0, session_token=None):
         self.seller_id = seller_id
         self.session_count = session_count
         self.plan_id = plan_id
+        self.session_token = session_token
+        self.last_heartbeat = None
 
     def __str__(self):
         return self.seller_id
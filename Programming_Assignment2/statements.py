@@ -0,0 +1,91 @@
+import threading
+import time
+import weakref
+
+
+"""
+    Registry of named server-side prepared statements.
+    - Statements are registered once with PostgreSQL $n placeholders.
+    - execute() sends PREPARE the first time a statement is used on a connection and EXECUTE afterwards,
+      so the server parses and plans each statement once per connection instead of on every call.
+    - Prepared statements live as long as the server session. Which statements are prepared is tracked per
+      connection object; a reconnect yields a new connection object and everything is prepared again.
+      Connections closed by the pool are dropped through invalidate().
+    - Call counts and timings are collected per statement.
+"""
+class StatementRegistry:
+    def __init__(self):
+        self._statements = {}
+        self._prepared = weakref.WeakKeyDictionary()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    """
+        Registers sql under name. The name must be a valid SQL identifier.
+    """
+    def register(self, name, sql):
+        if not name.isidentifier():
+            raise ValueError("statement name must be an identifier: %r" % name)
+        self._statements[name] = sql
+        self._stats[name] = {"calls": 0, "prepares": 0, "total_time": 0.0, "max_time": 0.0}
+
+    def sql(self, name):
+        return self._statements[name]
+
+    def names(self):
+        return list(self._statements)
+
+    """
+        Prepares the named statement on the cursor's connection unless it is already prepared there.
+    """
+    def prepare(self, cursor, name):
+        sql = self._statements[name]
+        conn = cursor.connection
+
+        with self._lock:
+            prepared = self._prepared.setdefault(conn, set())
+            if name in prepared:
+                return
+
+        cursor.execute("PREPARE %s AS %s" % (name, sql))
+        with self._lock:
+            prepared.add(name)
+            self._stats[name]["prepares"] += 1
+
+    """
+        Executes the named statement with params on the cursor, preparing it on the cursor's connection first if needed.
+    """
+    def execute(self, cursor, name, params=()):
+        self.prepare(cursor, name)
+
+        started = time.perf_counter()
+        if params:
+            cursor.execute("EXECUTE %s (%s)" % (name, ", ".join(["%s"] * len(params))), tuple(params))
+        else:
+            cursor.execute("EXECUTE %s" % name)
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            stats = self._stats[name]
+            stats["calls"] += 1
+            stats["total_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+        return cursor
+
+    """
+        Forgets which statements are prepared on conn. Called when a connection is closed or reset.
+    """
+    def invalidate(self, conn):
+        with self._lock:
+            self._prepared.pop(conn, None)
+
+    """
+        Returns per-statement counters: calls, prepares, total_time, max_time and avg_time (seconds).
+    """
+    def stats(self):
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                result[name] = dict(stats)
+                result[name]["avg_time"] = stats["total_time"] / stats["calls"] if stats["calls"] else 0.0
+            return result
@@ -0,0 +1,114 @@
+import csv
+import io
+import json
+import sys
+import uuid
+
+
+"""
+    Rows fetched per round trip by a server-side cursor.
+"""
+DEFAULT_ITERSIZE = 2000
+
+"""
+    Rows formatted into the buffer before it is written to the output.
+"""
+DEFAULT_CHUNK_SIZE = 1000
+
+
+"""
+    Result of a query read through a named (server-side) cursor.
+    - Used as a context manager; rows are fetched itersize at a time while iterating, never all at once.
+    - columns holds the column names of the result.
+    - The cursor lives in the connection's transaction; the caller commits or rolls back afterwards.
+"""
+class StreamingQuery:
+    def __init__(self, conn, query, params=None, itersize=DEFAULT_ITERSIZE):
+        self.conn = conn
+        self.query = query
+        self.params = params
+        self.itersize = itersize
+        self.columns = None
+        self._cursor = None
+        self._first = None
+
+    def __enter__(self):
+        self._cursor = self.conn.cursor(name="mp2_stream_%s" % uuid.uuid4().hex)
+        self._cursor.itersize = self.itersize
+        self._cursor.execute(self.query, self.params)
+        # a named cursor only knows its columns after the first fetch
+        self._first = self._cursor.fetchmany(self.itersize)
+        self.columns = [column[0] for column in self._cursor.description]
+        return self
+
+    def __iter__(self):
+        first, self._first = self._first, None
+        if first:
+            yield from first
+        yield from self._cursor
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._cursor is not None and not self._cursor.closed and not self.conn.closed:
+            self._cursor.close()
+        self._cursor = None
+
+
+"""
+    Row writers of the output formats. Each writes the header to buffer and returns a function writing one row.
+    Columns are (key, label) pairs: text output uses the labels, csv and jsonl the keys.
+"""
+def text_writer(buffer, columns):
+    buffer.write("|".join(label for _, label in columns) + "\n")
+    return lambda row: buffer.write("|".join(str(value) for value in row) + "\n")
+
+
+def csv_writer(buffer, columns):
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow([key for key, _ in columns])
+    return writer.writerow
+
+
+def jsonl_writer(buffer, columns):
+    keys = [key for key, _ in columns]
+    return lambda row: buffer.write(json.dumps(dict(zip(keys, row)), default=str) + "\n")
+
+
+FORMATS = {"text": text_writer, "csv": csv_writer, "jsonl": jsonl_writer}
+
+
+"""
+    Writes rows in the given format to out (stdout by default) and returns the number of rows written.
+    - columns are column names or (key, label) pairs.
+    - Rows are formatted into a buffer that is written out every chunk_size rows, rows may be a generator.
+    - out is not flushed; buffered outputs (batch mode, exports) keep their block buffering.
+"""
+def write_rows(rows, columns, fmt="text", out=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    if fmt not in FORMATS:
+        raise ValueError("unknown output format: %s" % fmt)
+    out = out or sys.stdout
+    columns = [(column, column) if isinstance(column, str) else column for column in columns]
+
+    buffer = io.StringIO()
+    write_row = FORMATS[fmt](buffer, columns)
+    count = 0
+    for row in rows:
+        write_row(row)
+        count += 1
+        if count % chunk_size == 0:
+            out.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+    out.write(buffer.getvalue())
+    return count
+
+
+"""
+    Streams the result of query through a server-side cursor to out and flushes it once at the end.
+    Returns the number of rows written.
+"""
+def stream_query(conn, query, params=None, fmt="text", out=None, itersize=DEFAULT_ITERSIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    out = out or sys.stdout
+    with StreamingQuery(conn, query, params, itersize=itersize) as result:
+        count = write_rows(result, result.columns, fmt=fmt, out=out, chunk_size=chunk_size)
+    out.flush()
+    return count